@@ -0,0 +1,7 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[  Init  ]
+[Code related to   init  ]
+[Matt Franchi]
+"""
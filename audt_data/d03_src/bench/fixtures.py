@@ -0,0 +1,252 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Fixtures]
+[Module with functions for generating synthetic Census-shaped benchmark inputs]
+[Matt Franchi]
+"""
+
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.geo.nyc.counties import NYC_BOROUGHS, COUNTY_NAMES as NYC_COUNTY_NAMES
+
+logger = setup_logger("bench.fixtures")
+
+# County FIPS of the five boroughs, with a rough share of NYC's tracts each
+COUNTIES = {"005": 0.15, "047": 0.35, "061": 0.14, "081": 0.31, "085": 0.05}
+COUNTY_NAMES = {fips[2:]: name for fips, name in NYC_COUNTY_NAMES.items()}
+
+# Variable suffixes of a profile table; subject and detailed tables have no
+# percent columns
+PROFILE_SUFFIXES = (("E", "Estimate"), ("M", "Margin of Error"),
+                    ("PE", "Percent"), ("PM", "Percent Margin of Error"))
+TABLE_SUFFIXES = (("E", "Estimate"), ("M", "Margin of Error"))
+
+ANNOTATION_CODES = ("-666666666", "-999999999", "-888888888", "-222222222")
+
+# Words to build label hierarchies from
+_TOPICS = ("SEX AND AGE", "RACE", "HISPANIC OR LATINO AND RACE", "CITIZEN, VOTING AGE POPULATION",
+           "INCOME IN THE PAST 12 MONTHS", "EDUCATIONAL ATTAINMENT", "HOUSEHOLDS")
+_LEVELS = ("Total population", "Male", "Female", "Under 5 years", "5 to 9 years",
+           "18 years and over", "65 years and over", "One race", "Two or more races",
+           "White", "Black or African American", "Asian", "Population 25 years and over",
+           "Less than $10,000", "$50,000 to $74,999", "Median income (dollars)",
+           "Bachelor's degree or higher", "Limited English speaking households")
+
+
+def tract_geoids(n_tracts, seed=0):
+    """`n_tracts` distinct NYC-style tract GEOIDs, spread over the five counties."""
+    rng = np.random.default_rng(seed)
+    counties = rng.choice(list(COUNTIES), size=n_tracts, p=list(COUNTIES.values()))
+    geoids = []
+    for county in COUNTIES:
+        n = int((counties == county).sum())
+        codes = np.sort(rng.choice(np.arange(100, 999_999), size=n, replace=False))
+        geoids.extend(f"36{county}{code:06d}" for code in codes)
+    return geoids
+
+
+def _labels(n_vars, max_depth, trailing_colons, rng):
+    labels = []
+    for _ in range(n_vars):
+        depth = int(rng.integers(1, max_depth + 1))
+        parts = [str(rng.choice(_TOPICS))] + [str(rng.choice(_LEVELS)) for _ in range(depth - 1)]
+        if trailing_colons:
+            # 2019+ vintages end every non-leaf level with a colon
+            parts = [part + ":" for part in parts[:-1]] + parts[-1:]
+        labels.append("!!".join(parts))
+    return labels
+
+
+def make_acs_group(directory, year=2022, group="DP05", n_tracts=2327, n_vars=200,
+                   max_depth=5, annotations=True, annotation_rate=0.02,
+                   null_rate=0.005, geoids=None, seed=0):
+    """
+    Write a synthetic ACS group: 'acs{year}_{group}.json' and its '_md.json'.
+
+    The data file has the Census API layout (array of arrays, header first,
+    one row per line, every value a string or null). It holds estimate,
+    margin of error and (for 'DP' groups) percent variables, plus their
+    annotation columns, GEO_ID and NAME. Labels have the 'Estimate!!...'
+    hierarchy with up to `max_depth` levels below the first.
+
+    Parameters:
+    directory (str or Path): Output directory
+    year (int): ACS vintage
+    group (str): Group code; 'DP...' groups get percent columns
+    n_tracts (int): Number of rows
+    n_vars (int): Number of variable lines (each has 2 or 4 suffixes)
+    max_depth (int): Maximum label depth below the 'Estimate' level
+    annotations (bool): Include the '...EA'/'...MA' annotation columns
+    annotation_rate (float): Share of values replaced by annotation codes
+    null_rate (float): Share of values that are null
+    geoids (list): Tract GEOIDs, e.g. to share tracts across vintages;
+                   drawn with `tract_geoids` if None
+    seed (int): Random seed
+
+    Returns:
+    tuple: (data_path, metadata_path)
+    """
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    os.makedirs(directory, exist_ok=True)
+    suffixes = PROFILE_SUFFIXES if group.upper().startswith("DP") else TABLE_SUFFIXES
+    labels = _labels(n_vars, max_depth, trailing_colons=year >= 2019, rng=rng)
+
+    variables = {
+        "for": {"label": "Census API FIPS 'for' clause", "concept": "Census API Geography Specification",
+                "predicateType": "fips-for", "group": "N/A", "limit": 0, "predicateOnly": True},
+        "in": {"label": "Census API FIPS 'in' clause", "concept": "Census API Geography Specification",
+               "predicateType": "fips-in", "group": "N/A", "limit": 0, "predicateOnly": True},
+        "GEO_ID": {"label": "Geography", "concept": group, "predicateType": "string",
+                   "group": group, "limit": 0, "predicateOnly": True},
+        "NAME": {"label": "Geographic Area Name", "concept": group, "predicateType": "string",
+                 "group": group, "limit": 0, "predicateOnly": True},
+    }
+    codes, kinds = [], []
+    for i, label in enumerate(labels, start=1):
+        for suffix, kind in suffixes:
+            code = f"{group}_{i:04d}{suffix}"
+            variables[code] = {
+                "label": f"{kind}!!{label}", "concept": group,
+                "predicateType": "float" if suffix.startswith("P") else "int",
+                "group": group, "limit": 0, "attributes": f"{code}A",
+            }
+            codes.append(code)
+            kinds.append(suffix)
+            if annotations:
+                variables[f"{code}A"] = {
+                    "label": f"Annotation of {kind}!!{label}", "concept": group,
+                    "predicateType": "string", "group": group, "limit": 0,
+                }
+
+    geoids = tract_geoids(n_tracts, seed) if geoids is None else list(geoids)
+    n_tracts = len(geoids)
+    n_codes = len(codes)
+    counts = rng.integers(0, 8000, size=(n_tracts, n_codes))
+    percents = np.round(rng.random((n_tracts, n_codes)) * 100, 1)
+    is_percent = np.array([kind.startswith("P") for kind in kinds])
+    cells = np.where(is_percent, percents.astype(str), counts.astype(str)).astype(object)
+    annotated = rng.random((n_tracts, n_codes)) < annotation_rate
+    cells[annotated] = rng.choice(ANNOTATION_CODES, size=int(annotated.sum()))
+    cells[rng.random((n_tracts, n_codes)) < null_rate] = None
+
+    header = codes + ([f"{code}A" for code in codes] if annotations else []) + ["GEO_ID", "NAME"]
+    data_path = directory / f"acs{year}_{group.lower()}.json"
+    with open(data_path, "w") as f:
+        f.write("[" + json.dumps(header))
+        for row, geoid in enumerate(geoids):
+            name = (f"Census Tract {int(geoid[5:]) / 100:g}; "
+                    f"{COUNTY_NAMES[geoid[2:5]]} County; New York")
+            values = list(cells[row])
+            if annotations:
+                values += [None] * n_codes
+            f.write(",\n" + json.dumps(values + [f"1400000US{geoid}", name]))
+        f.write("]")
+
+    md_path = directory / f"acs{year}_{group.lower()}_md.json"
+    with open(md_path, "w") as f:
+        json.dump({"variables": variables}, f)
+    return data_path, md_path
+
+
+def make_tracts(geoids=None, n_tracts=2327, seed=0, crs="EPSG:2263"):
+    """
+    Square tract polygons on a grid over the NYC extent (State Plane feet).
+
+    Returns:
+    GeoDataFrame: 'GEOID' and 'BoroName' columns, in `crs`
+    """
+    geoids = tract_geoids(n_tracts, seed) if geoids is None else list(geoids)
+    n = len(geoids)
+    side = int(np.ceil(np.sqrt(n)))
+    x0, y0, extent = 913_000.0, 120_000.0, 150_000.0
+    size = extent / side
+    col, row = np.arange(n) % side, np.arange(n) // side
+    geometry = shapely.box(x0 + col * size, y0 + row * size,
+                           x0 + (col + 1) * size, y0 + (row + 1) * size)
+    tracts = gpd.GeoDataFrame({
+        "GEOID": geoids,
+        "BoroName": [NYC_BOROUGHS[geoid[:5]] for geoid in geoids],
+    }, geometry=geometry, crs="EPSG:2263")
+    return tracts.to_crs(crs)
+
+
+def make_estimates(geoids=None, n_tracts=2327, n_vars=40, zero_rate=0.1, seed=0):
+    """
+    Tract estimates with margins of error, as returned by `parse_acs` with MOEs.
+
+    A share `zero_rate` of the estimates is zero, so the zero-estimate rule
+    of the MOE formulas is exercised.
+
+    Returns:
+    DataFrame: 'GEOID', 'county', then 'v{i}' and 'v{i}_moe' for every variable
+    """
+    rng = np.random.default_rng(seed)
+    geoids = tract_geoids(n_tracts, seed) if geoids is None else list(geoids)
+    n = len(geoids)
+    estimates = rng.integers(1, 5_000, size=(n, n_vars)).astype(float)
+    estimates[rng.random((n, n_vars)) < zero_rate] = 0.0
+    # Zero estimates still carry a MOE, as published ACS tables do
+    moes = np.maximum(np.round(np.sqrt(estimates) * rng.uniform(1, 4, size=(n, n_vars))), 11.0)
+    columns = {"GEOID": geoids, "county": [geoid[2:5] for geoid in geoids]}
+    for i in range(n_vars):
+        columns[f"v{i}"] = estimates[:, i]
+        columns[f"v{i}_moe"] = moes[:, i]
+    return pd.DataFrame(columns)
+
+
+def make_dem(path, bounds=(913_000.0, 120_000.0, 1_063_000.0, 270_000.0), width=2048,
+             height=2048, nodata=-32768, water_share=0.1, seed=0, blocksize=256):
+    """
+    Write a synthetic integer DEM GeoTIFF (EPSG:2263) like the NYC 1ft DEM.
+
+    Elevation is smooth terrain plus noise; a band along one edge is
+    nodata, standing in for water.
+
+    Returns:
+    Path: `path`
+    """
+    import rasterio
+    from affine import Affine
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    x /= width
+    y /= height
+    elevation = (120 * np.sin(3 * x) * np.cos(2 * y) + 80 * np.exp(-((x - 0.6) ** 2 + (y - 0.4) ** 2) * 12)
+                 + rng.normal(0, 2, size=(height, width)))
+    dem = np.clip(elevation, -50, 400).astype(np.int16)
+    dem[:, : int(width * water_share)] = nodata
+
+    west, south, east, north = bounds
+    transform = Affine((east - west) / width, 0.0, west, 0.0, -(north - south) / height, north)
+
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    profile = {
+        "driver": "GTiff", "height": height, "width": width, "count": 1, "dtype": "int16",
+        "crs": "EPSG:2263", "transform": transform, "nodata": nodata,
+        "tiled": True, "blockxsize": blocksize, "blockysize": blocksize, "compress": "deflate",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(dem, 1)
+    return path
+
+
+def acs_columns(md_path, group, n_columns=20):
+    """An `acs_columns` entry for `merge_acs_data` with the first estimates of a fixture."""
+    with open(md_path, "r") as f:
+        variables = json.load(f)["variables"]
+    codes = sorted(code for code in variables if code.startswith(group) and code.endswith("E")
+                   and not code.endswith("PE"))[:n_columns]
+    return {"name": group, "columns": {code: f"{group.lower()}_{code[-5:-1]}" for code in codes}}
+
@@ -0,0 +1,630 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Harness]
+[Module with functions for benchmarking the ACS and topology pipelines]
+[Matt Franchi]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.bench import fixtures, reference
+
+logger = setup_logger("bench.harness")
+
+# Sizes to run every case at. 'tracts' and 'variables' shape the ACS
+# fixtures (NYC has ~2,300 tracts; profile groups have up to ~800 variable
+# lines); 'dem' is the side of the synthetic DEM in pixels
+SWEEPS = {
+    "quick": [
+        {"tracts": 300, "variables": 40, "dem": 512},
+    ],
+    "default": [
+        {"tracts": 2327, "variables": 150, "dem": 2048},
+        {"tracts": 2327, "variables": 600, "dem": 4096},
+    ],
+    "scaling": [
+        {"tracts": 500, "variables": 150, "dem": 1024},
+        {"tracts": 1000, "variables": 150, "dem": 2048},
+        {"tracts": 2327, "variables": 150, "dem": 2048},
+        {"tracts": 2327, "variables": 300, "dem": 4096},
+        {"tracts": 2327, "variables": 600, "dem": 4096},
+        {"tracts": 2327, "variables": 1200, "dem": 8192},
+    ],
+}
+
+# A case is slower than its baseline when its median time grew by more than this
+DEFAULT_TOLERANCE = 0.25
+
+YEARS = (2021, 2022)
+GROUP = "DP05"
+
+
+def bench_dir():
+    """Default directory for saved baselines."""
+    return Path(get_repo_root()) / "audt_data" / "d01_data" / "bench"
+
+
+@contextmanager
+def working_directory(path):
+    """Temporarily chdir, for code that reads 'data/...' relative paths."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def clear_caches():
+    """Drop every in-process cache, so each timed run starts cold."""
+    from audt_data.d03_src.pp.acs.helpers import clear_acs_cache
+    from audt_data.d03_src.pp.acs.md_cache import clear_md_cache
+    from audt_data.d03_src.pp.geo.nyc.zonal import clear_label_grids
+    clear_acs_cache()
+    clear_md_cache()
+    clear_label_grids()
+
+
+def time_call(run, repeat=3, setup=None):
+    """
+    Wall-clock seconds of `repeat` calls of `run()`, each after `setup()`.
+
+    Returns:
+    list: One duration per call
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _mask_annotations(df):
+    """Replace Census annotation codes with NaN, as `parse_acs` does by default."""
+    from audt_data.d03_src.pp.acs.helpers import CENSUS_ANNOTATION_CODES
+    numeric = df.select_dtypes("number").columns
+    masked = df.copy()
+    masked[numeric] = df[numeric].where(~df[numeric].isin(list(CENSUS_ANNOTATION_CODES)))
+    return masked
+
+
+def _frames_match(current, expected, **kwargs):
+    try:
+        pd.testing.assert_frame_equal(current, expected, **kwargs)
+        return True, None
+    except AssertionError as e:
+        return False, str(e).splitlines()[0] if str(e) else "frames differ"
+
+
+# Each case builds its inputs in `workdir` and returns a dict with 'run' and
+# 'reference' callables, an optional 'setup' run before every timed call, and
+# a 'check' callable that runs both once and returns (match, detail)
+
+def case_parse_md(workdir, size):
+    from audt_data.d03_src.pp.acs.helpers import parse_md
+
+    _, md_path = fixtures.make_acs_group(workdir, YEARS[-1], GROUP, size["tracts"], size["variables"])
+    with open(md_path, "r") as f:
+        md = json.load(f)
+
+    def check():
+        return _frames_match(parse_md(md), reference.parse_md(md))
+
+    return {"run": lambda: parse_md(md), "reference": lambda: reference.parse_md(md), "check": check}
+
+
+def case_parse_acs(workdir, size):
+    from audt_data.d03_src.pp.acs.helpers import parse_acs
+    from audt_data.d03_src.pp.acs.loader import load_acs_data
+
+    data_path, md_path = fixtures.make_acs_group(workdir, YEARS[-1], GROUP, size["tracts"], size["variables"])
+    cols = fixtures.acs_columns(md_path, GROUP, n_columns=size["variables"])["columns"]
+
+    def run(annotations="null"):
+        return parse_acs(load_acs_data(data_path, columns=["GEO_ID", *cols]), cols, annotations=annotations)
+
+    def run_reference():
+        return reference.parse_acs(pd.read_json(data_path), cols)
+
+    def check():
+        current = run(annotations="keep")
+        expected = run_reference()
+        expected.columns.name = None
+        return _frames_match(current, expected, check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "check": check}
+
+
+def case_process_acs_file(workdir, size):
+    from audt_data.d03_src.pp.acs.batch_pp import process_acs_file
+
+    year = YEARS[-1]
+    data_path, md_path = fixtures.make_acs_group(workdir / "raw", year, GROUP, size["tracts"], size["variables"])
+    output_dir = workdir / "preprocessed"
+    reference_path = workdir / "reference" / data_path.name.replace(".json", "_processed.csv")
+
+    def setup():
+        # Cold: no parsed metadata in memory or on disk
+        clear_caches()
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+
+    def run():
+        if not process_acs_file(str(data_path), output_dir):
+            raise RuntimeError(f"process_acs_file failed on {data_path}")
+
+    def run_reference():
+        os.makedirs(reference_path.parent, exist_ok=True)
+        reference.process_acs_data_file(data_path, md_path, year, reference_path)
+
+    def check():
+        setup()
+        run()
+        run_reference()
+        current = pd.read_csv(output_dir / reference_path.name, index_col=0, dtype={"tract_id": str})
+        expected = pd.read_csv(reference_path, index_col=0, dtype={"tract_id": str})
+        return _frames_match(current, _mask_annotations(expected), check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "setup": setup, "check": check}
+
+
+def case_merge_acs_data(workdir, size):
+    from audt_data.d03_src.pp.acs.helpers import merge_acs_data
+
+    geoids = fixtures.tract_geoids(size["tracts"])
+    for seed, year in enumerate(YEARS):
+        fixtures.make_acs_group(workdir / "data", year, GROUP, n_vars=size["variables"],
+                                geoids=geoids, seed=seed)
+    md_path = workdir / "data" / f"acs{YEARS[-1]}_{GROUP.lower()}_md.json"
+    acs_columns = {GROUP.lower(): fixtures.acs_columns(md_path, GROUP, n_columns=size["variables"])}
+    tracts = fixtures.make_tracts(geoids)
+
+    def run():
+        with working_directory(workdir):
+            return merge_acs_data(tracts, YEARS[0], YEARS[-1], acs_columns)
+
+    def run_reference():
+        with working_directory(workdir):
+            return reference.merge_acs_data(tracts, YEARS[0], YEARS[-1], acs_columns)
+
+    def check():
+        clear_caches()
+        current = pd.DataFrame(run())
+        expected = pd.DataFrame(run_reference())
+        expected = _mask_annotations(expected.drop(columns="tract_id", errors="ignore"))
+        return _frames_match(current, expected, check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "setup": clear_caches, "check": check}
+
+
+def case_sample_topology(workdir, size):
+    from audt_data.d03_src.pp.geo.nyc.pp_topology import sample_topology
+
+    dem_path = fixtures.make_dem(workdir / "dem.tif", width=size["dem"], height=size["dem"])
+    tracts_path = workdir / "tracts.geojson"
+    fixtures.make_tracts(n_tracts=size["tracts"], crs="EPSG:4326").to_file(tracts_path)
+    output_path = workdir / "out" / "topology.csv"
+    reference_path = workdir / "reference" / "topology.csv"
+
+    def run():
+        sample_topology(dem_path, tracts_path, output_path, save=True, cache_dir=workdir / "zonal")
+
+    def run_reference():
+        reference.sample_topology(dem_path, tracts_path, reference_path)
+
+    def check():
+        run()
+        run_reference()
+        current = pd.read_csv(output_path, index_col=0, dtype={"GEOID": str})
+        expected = pd.read_csv(reference_path, index_col=0, dtype={"GEOID": str})
+        return _frames_match(current, expected, check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "setup": clear_caches, "check": check}
+
+
+# Worked examples of the MOE formulas, computed by hand from the Census ACS
+# handbook's formulas (chapter "Calculating Measures of Error for Derived
+# Estimates"): component (estimate, MOE) pairs and the MOE of their sum
+MOE_SUM_EXAMPLES = [
+    # Plain sum: sqrt(4,754^2 + 3,897^2) = 6,147.1
+    ([(33_193, 4_754), (29_139, 3_897)], 6_147.1),
+    # Zero estimates: only the largest of their MOEs (17) counts,
+    # sqrt(17^2 + 9^2) = 19.235, not sqrt(11^2 + 17^2 + 9^2) = 22.159
+    ([(0, 11), (0, 17), (12, 9)], 19.235),
+    # Every estimate zero: the largest MOE alone
+    ([(0, 11), (0, 23)], 23.0),
+]
+
+# (numerator, MOE, denominator, MOE) and the MOE of the proportion
+MOE_PROPORTION_EXAMPLES = [
+    # sqrt(8^2 - 0.3^2 * 10^2) / 100 = sqrt(55) / 100
+    ((30, 8, 100, 10), 0.074162),
+    # 5^2 - 0.5^2 * 20^2 < 0, so the ratio formula is used:
+    # sqrt(5^2 + 0.5^2 * 20^2) / 20 = sqrt(125) / 20
+    ((10, 5, 20, 20), 0.559017),
+]
+
+
+def check_moe_examples():
+    """
+    Check `moe.aggregate_moe`, `derive_sums` and `derive_ratios` against
+    MOE_SUM_EXAMPLES and MOE_PROPORTION_EXAMPLES.
+
+    Returns:
+    tuple: (match, detail of the first mismatch or None)
+    """
+    from audt_data.d03_src.pp.acs.moe import aggregate_moe, derive_sums, derive_ratios
+
+    for pairs, expected in MOE_SUM_EXAMPLES:
+        rows = pd.DataFrame({"g": 0, "x": [e for e, _ in pairs], "x_moe": [m for _, m in pairs]})
+        wide = pd.DataFrame({f"c{i}": [e] for i, (e, _) in enumerate(pairs)}
+                            | {f"c{i}_moe": [m] for i, (_, m) in enumerate(pairs)})
+        summed = derive_sums(wide, {"s": [f"c{i}" for i in range(len(pairs))]})
+        for how, moe in (("aggregate_moe", aggregate_moe(rows, "g", ["x"])["x_moe"].iloc[0]),
+                         ("derive_sums", summed["s_moe"].iloc[0])):
+            if not np.isclose(moe, expected, atol=0.05):
+                return False, f"{how} of {pairs}: MOE {moe:.3f}, expected {expected}"
+
+    for (num, moe_num, den, moe_den), expected in MOE_PROPORTION_EXAMPLES:
+        df = pd.DataFrame({"n": [num], "n_moe": [moe_num], "d": [den], "d_moe": [moe_den]})
+        moe = derive_ratios(df, {"p": ("n", "d")})["p_moe"].iloc[0]
+        if not np.isclose(moe, expected, atol=5e-6):
+            return False, f"proportion {num}/{den}: MOE {moe:.6f}, expected {expected}"
+    return True, None
+
+
+def case_aggregate_moe(workdir, size):
+    from audt_data.d03_src.pp.acs.moe import aggregate_moe
+
+    estimates = fixtures.make_estimates(n_tracts=size["tracts"], n_vars=size["variables"])
+    columns = [f"v{i}" for i in range(size["variables"])]
+
+    def run():
+        return aggregate_moe(estimates, "county", columns)
+
+    def run_reference():
+        return reference.aggregate_moe(estimates, "county", columns)
+
+    def check():
+        match, detail = check_moe_examples()
+        if not match:
+            return match, detail
+        return _frames_match(run(), run_reference(), check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "check": check}
+
+
+def check_crosswalk_example():
+    """
+    Check `Crosswalk.rollup` on two tracts and two targets, computed by hand.
+
+    Tract A lies wholly in target T1; tract B is split evenly between T1 and
+    T2. For T1: population 100 + 0.5 x 60 = 130 with MOE
+    sqrt(20^2 + (0.5 x 30)^2) = 25; 'none' is zero in both tracts, so only
+    the larger scaled MOE counts, max(20, 0.5 x 30) = 20; income is the
+    population-weighted mean (50,000 x 100 + 80,000 x 30) / 130 = 56,923.08.
+
+    Returns:
+    tuple: (match, detail of the first mismatch or None)
+    """
+    from audt_data.d03_src.pp.geo.nyc.crosswalk import Crosswalk
+
+    crosswalk = Crosswalk(["A", "B"], ["T1", "T2"], [[1.0, 0.5], [0.0, 0.5]])
+    tracts = pd.DataFrame({"pop": [100.0, 60.0], "pop_moe": [20.0, 30.0],
+                           "none": [0.0, 0.0], "none_moe": [20.0, 30.0],
+                           "income": [50_000.0, 80_000.0]},
+                          index=pd.Index(["A", "B"], name="GEOID"))
+    expected = pd.DataFrame({"pop": [130.0, 30.0], "none": [0.0, 0.0],
+                             "pop_moe": [25.0, 15.0], "none_moe": [20.0, 15.0],
+                             "income": [7_400_000 / 130, 80_000.0]},
+                            index=pd.Index(["T1", "T2"], name="target"))
+
+    current = crosswalk.rollup(tracts, extensive=["pop", "none"], intensive=["income"],
+                               intensive_weight="pop")
+    match, detail = _frames_match(current, expected)
+    if not match:
+        return match, detail
+
+    try:
+        crosswalk.rollup(pd.concat([tracts, tracts]), extensive=["pop"])
+    except ValueError:
+        return True, None
+    return False, "rollup accepted duplicate GEOIDs"
+
+
+def case_rollup_boroughs(workdir, size):
+    from audt_data.d03_src.pp.geo.nyc.crosswalk import borough_crosswalk
+    from audt_data.d03_src.pp.geo.nyc.counties import NYC_BOROUGHS
+
+    estimates = fixtures.make_estimates(n_tracts=size["tracts"], n_vars=size["variables"])
+    columns = [f"v{i}" for i in range(size["variables"])]
+    tracts = estimates.drop(columns="county").set_index("GEOID")
+    estimates["borough"] = estimates["GEOID"].str[:5].map(NYC_BOROUGHS)
+
+    def run():
+        return borough_crosswalk(tracts.index).rollup(tracts, extensive=columns)
+
+    def run_reference():
+        return reference.aggregate_moe(estimates, "borough", columns)
+
+    def check():
+        match, detail = check_crosswalk_example()
+        if not match:
+            return match, detail
+        current = run()
+        expected = run_reference()[list(current.columns)]
+        expected.index.name = current.index.name
+        return _frames_match(current, expected, check_dtype=False)
+
+    return {"run": run, "reference": run_reference, "check": check}
+
+
+def check_prefix_example():
+    """
+    Check that `VariableIndex.prefix` matches whole label levels only: the
+    sibling '65 years and over' extends the text of '65 years' but is not
+    below it.
+
+    Returns:
+    tuple: (match, detail of the first mismatch or None)
+    """
+    from audt_data.d03_src.pp.acs.variables import VariableIndex
+
+    index = VariableIndex(pd.DataFrame({
+        "year": 2022, "group": "dp05", "code": ["A", "B", "C"],
+        "label": ["SEX AND AGE!!Total population!!65 years",
+                  "SEX AND AGE!!Total population!!65 years and over",
+                  "SEX AND AGE!!Total population!!65 years!!Male"],
+    }))
+    codes = [record["code"] for record in index.prefix("SEX AND AGE!!Total population!!65 years")]
+    if codes != ["A", "C"]:
+        return False, f"prefix of '65 years' returned {codes}, expected ['A', 'C']"
+    return True, None
+
+
+def case_variable_prefix(workdir, size):
+    from audt_data.d03_src.pp.acs.variables import build_variable_index
+
+    for year in YEARS:
+        fixtures.make_acs_group(workdir / "data", year, GROUP, n_tracts=1, n_vars=size["variables"])
+    index = build_variable_index(workdir / "data", cache_dir=workdir / "md_cache")
+    # Every label and each of its ancestors
+    queries = sorted({"!!".join(label.split("!!")[:depth]) for label in index.labels
+                      for depth in range(1, label.count("!!") + 2)})
+
+    def run():
+        return [index.prefix(query) for query in queries]
+
+    def run_reference():
+        return [reference.variable_prefix(index, query) for query in queries]
+
+    def check():
+        match, detail = check_prefix_example()
+        if not match:
+            return match, detail
+        for query, current, expected in zip(queries, run(), run_reference()):
+            if current != expected:
+                return False, f"prefix({query!r}) returned {len(current)} variables, expected {len(expected)}"
+        return True, None
+
+    return {"run": run, "reference": run_reference, "check": check}
+
+
+CASES = {
+    "parse_md": case_parse_md,
+    "parse_acs": case_parse_acs,
+    "process_acs_file": case_process_acs_file,
+    "merge_acs_data": case_merge_acs_data,
+    "sample_topology": case_sample_topology,
+    "aggregate_moe": case_aggregate_moe,
+    "rollup_boroughs": case_rollup_boroughs,
+    "variable_prefix": case_variable_prefix,
+}
+
+
+def run_benchmarks(cases=None, sweep="quick", repeat=3, with_reference=False,
+                   differential=False, workdir=None):
+    """
+    Run benchmark cases over a sweep of fixture sizes.
+
+    Fixtures are generated into a fresh temporary directory (or `workdir`),
+    so nothing touches the network or the repository's data.
+
+    Parameters:
+    cases (list): Case names (see CASES); all if None
+    sweep (str or list): Name of a sweep in SWEEPS, or a list of size dicts
+    repeat (int): Timed calls per case and size
+    with_reference (bool): Also time the reference implementation
+    differential (bool): Check that each case's output matches the reference
+
+    Returns:
+    list: One result dict per case and size, with 'case', the size keys,
+          'times', 'min', 'median' and, if requested, 'reference_median',
+          'speedup' and 'match'/'mismatch'; a case that raised has 'error'
+          instead of timings
+    """
+    sizes = SWEEPS[sweep] if isinstance(sweep, str) else list(sweep)
+    cases = list(CASES) if cases is None else list(cases)
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        raise ValueError(f"Unknown benchmark cases {unknown}; choose from {list(CASES)}")
+
+    results = []
+    root = Path(workdir) if workdir is not None else Path(tempfile.mkdtemp(prefix="audt-bench-"))
+    try:
+        for size in sizes:
+            for name in cases:
+                case_dir = root / f"{name}-{size['tracts']}x{size['variables']}-{size['dem']}"
+                os.makedirs(case_dir, exist_ok=True)
+                result = {"case": name, **size}
+                try:
+                    case = CASES[name](case_dir, size)
+                    if differential:
+                        match, detail = case["check"]()
+                        result["match"] = match
+                        if not match:
+                            result["mismatch"] = detail
+                            logger.error(f"{name} {size}: output differs from reference: {detail}")
+
+                    times = time_call(case["run"], repeat, case.get("setup"))
+                    result.update(times=times, min=min(times), median=statistics.median(times))
+                    if with_reference:
+                        reference_times = time_call(case["reference"], repeat, case.get("setup"))
+                        result["reference_median"] = statistics.median(reference_times)
+                        result["speedup"] = result["reference_median"] / result["median"]
+                except Exception as e:
+                    # Keep going, so one broken case does not hide the others
+                    logger.error(f"{name} {size} failed: {type(e).__name__}: {e}")
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    results.append(result)
+                    continue
+
+                logger.info(format_result(result))
+                results.append(result)
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def format_result(result):
+    line = (f"{result['case']:<18} {result['tracts']:>6} tracts {result['variables']:>5} vars "
+            f"{result['dem']:>5}px  median {result['median'] * 1e3:9.1f} ms  min {result['min'] * 1e3:9.1f} ms")
+    if "speedup" in result:
+        line += f"  reference {result['reference_median'] * 1e3:9.1f} ms ({result['speedup']:.1f}x)"
+    if "match" in result:
+        line += "  output matches" if result["match"] else "  OUTPUT DIFFERS"
+    return line
+
+
+def environment():
+    """Machine and library versions a baseline was recorded with."""
+    import scipy
+    import pyarrow
+    import geopandas
+    import rasterio
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pyarrow": pyarrow.__version__,
+        "scipy": scipy.__version__,
+        "geopandas": geopandas.__version__,
+        "rasterio": rasterio.__version__,
+    }
+
+
+def _key(result):
+    return (result["case"], result["tracts"], result["variables"], result["dem"])
+
+
+def save_baseline(results, path):
+    """Write results and the environment to a baseline JSON file."""
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "environment": environment(), "results": results}, f, indent=2)
+    logger.success(f"Saved benchmark baseline to {path}")
+    return path
+
+
+def compare_to_baseline(results, path, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare results with a saved baseline.
+
+    Returns:
+    list: Regressions as dicts with 'case', the size keys, 'baseline',
+          'median' and 'ratio'; cases without a baseline entry are skipped
+    """
+    with open(path, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("environment", {}).get("platform") != platform.platform():
+        logger.warning(f"Baseline {path} was recorded on {baseline['environment'].get('platform')}; "
+                       f"timings may not be comparable")
+
+    previous = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None or "median" not in result or "median" not in before:
+            continue
+        ratio = result["median"] / before["median"]
+        if ratio > 1 + tolerance:
+            regressions.append({"case": result["case"], "tracts": result["tracts"],
+                                "variables": result["variables"], "dem": result["dem"],
+                                "baseline": before["median"], "median": result["median"],
+                                "ratio": ratio})
+            logger.error(f"{result['case']} {result['tracts']}x{result['variables']}/{result['dem']}px "
+                         f"regressed: {before['median'] * 1e3:.1f} ms -> {result['median'] * 1e3:.1f} ms "
+                         f"({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ACS and topology pipelines on synthetic data")
+    parser.add_argument("--sweep", choices=list(SWEEPS), default="quick")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reference", action="store_true", help="Also time the reference implementations")
+    parser.add_argument("--differential", action="store_true",
+                        help="Check outputs against the reference implementations")
+    parser.add_argument("--save-baseline", nargs="?", const="", default=None, metavar="PATH",
+                        help="Save results as a baseline (default: d01_data/bench/baseline-{sweep}.json)")
+    parser.add_argument("--compare", nargs="?", const="", default=None, metavar="PATH",
+                        help="Compare with a saved baseline (default path as for --save-baseline)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--workdir", default=None, help="Keep fixtures in this directory")
+    args = parser.parse_args(argv)
+
+    default_path = bench_dir() / f"baseline-{args.sweep}.json"
+    results = run_benchmarks(args.cases, args.sweep, args.repeat, args.reference,
+                             args.differential, args.workdir)
+
+    errors = [result for result in results if "error" in result]
+    failed = bool(errors)
+    if args.differential:
+        mismatches = [result for result in results if result.get("match") is False]
+        if mismatches:
+            logger.error(f"{len(mismatches)} case(s) differ from the reference implementation")
+            failed = True
+        # A case that raised has no 'match', so it must not count as matching
+        if errors:
+            logger.error(f"{len(errors)} case(s) raised before their output could be checked")
+        elif not mismatches:
+            logger.success("All outputs match the reference implementations")
+    if args.compare is not None:
+        regressions = compare_to_baseline(results, args.compare or default_path, args.tolerance)
+        if regressions:
+            failed = True
+        else:
+            logger.success(f"No regressions beyond {args.tolerance:.0%}")
+    if args.save_baseline is not None:
+        save_baseline(results, args.save_baseline or default_path)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
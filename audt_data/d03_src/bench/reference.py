@@ -0,0 +1,169 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Reference]
+[Module with functions for the reference ACS and topology implementations]
+[Matt Franchi]
+"""
+
+# Frozen copies of the original, unoptimized pipeline functions. The
+# benchmark harness times them next to the current code and, in differential
+# mode, checks that the current code produces the same output. Do not
+# optimize anything here.
+
+import os
+import json
+import math
+
+import pandas as pd
+import geopandas as gpd
+from rasterstats import zonal_stats
+
+
+def parse_md(md):
+    """Reference `helpers.parse_md`."""
+    vars_df = pd.DataFrame.from_dict(md['variables'], orient='index')
+    vars_df.reset_index(inplace=True)
+    vars_df.rename(columns={'index': 'column'}, inplace=True)
+
+    min_sep = min(vars_df['label'].apply(lambda x: x.count('!!')))
+    max_sep = max(vars_df['label'].apply(lambda x: x.count('!!')))
+
+    for i in range(min_sep + 1, max_sep + 2):
+        vars_df[f'desc_{i}'] = vars_df['label'].apply(
+            lambda x: x.split('!!')[i-1] if len(x.split('!!')) >= i else None
+        )
+
+    TO_DROP = ['label','concept','predicateType','group','limit','predicateOnly']
+    drop_cols = [col for col in TO_DROP if col in vars_df.columns]
+    vars_df = vars_df.drop(columns=drop_cols)
+
+    vars_df = vars_df[vars_df['desc_1'].isin(['Estimate'])]
+    vars_df = vars_df.sort_values('column')
+    vars_df = vars_df[['column'] + [col for col in vars_df.columns if col != 'column']]
+
+    return vars_df
+
+
+def parse_acs(acs, cols: dict):
+    """Reference `helpers.parse_acs`; annotation codes are kept as values."""
+    acs.columns = acs.iloc[0]
+    acs = acs[1:]
+    acs['tract_id'] = acs['GEO_ID'].str.split('US', expand=True)[1]
+    acs = acs.set_index('tract_id')
+
+    acs = acs[list(cols.keys())]
+    acs.columns = acs.columns.map(lambda x: cols[x])
+
+    for col in acs.columns:
+        acs[col] = pd.to_numeric(acs[col], errors='coerce')
+
+    acs = acs.fillna(0)
+
+    for col in acs.columns:
+        if acs[col].dtype.kind == 'f':
+            if (acs[col] % 1 == 0).all():
+                acs[col] = acs[col].astype(int)
+
+    return acs
+
+
+def get_acs_data(year, identifier, cols_to_keep):
+    """Reference `helpers.get_acs_data`; reads data/ relative to the working directory."""
+    raw = pd.read_json(f"data/acs{year}_{identifier}.json")
+    parsed_data = parse_acs(raw, cols_to_keep)
+    parsed_data['year'] = year
+    return parsed_data
+
+
+def merge_acs_data(ct_nyc, year_start, year_end, acs_columns):
+    """Reference `helpers.merge_acs_data`."""
+    yearly_dfs = []
+    for year in range(year_start, year_end + 1):
+        ct_year = ct_nyc.copy()
+        ct_year['year'] = year
+
+        merged_year = ct_year
+        for dataset_code, dataset_info in acs_columns.items():
+            dataset_df = get_acs_data(year, dataset_code, dataset_info['columns'])
+            dataset_df['year'] = year
+            merged_year = merged_year.merge(
+                dataset_df,
+                left_on=['GEOID', 'year'],
+                right_on=['tract_id', 'year'],
+                how='left'
+            )
+
+        yearly_dfs.append(merged_year)
+
+    result = pd.concat(yearly_dfs, ignore_index=True)
+    result.attrs['acs_years'] = list(range(year_start, year_end + 1))
+    result.attrs['acs_datasets'] = list(acs_columns.keys())
+    return result
+
+
+def process_acs_data_file(input_file, md_file, year, output_path):
+    """Reference data-file path of `batch_pp.process_acs_file`."""
+    # The original decoded the data file once to sniff it and again to parse it
+    with open(input_file, 'r') as f:
+        json.loads(f.read().strip())
+
+    with open(md_file, 'r') as f:
+        metadata = parse_md(json.load(f))
+    col_mapping = {col: f"{col}_{desc}" for col, desc in
+                   zip(metadata['column'], metadata['desc_2'])}
+
+    parsed_data = parse_acs(pd.read_json(input_file), col_mapping)
+    parsed_data.loc[:, 'year'] = year
+    parsed_data.to_csv(output_path)
+    return output_path
+
+
+def sample_topology(topology_path, sampling_geom, output_path):
+    """Reference `pp_topology.sample_topology` (with save=True)."""
+    sampling_geom = gpd.read_file(sampling_geom).to_crs("EPSG:2263")
+    summary_stats = zonal_stats(sampling_geom, topology_path)
+
+    summary_stats_df = pd.DataFrame(summary_stats)
+    summary_stats_df = sampling_geom[['GEOID']].join(summary_stats_df)
+    summary_stats_df = summary_stats_df.drop(columns='count')
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    summary_stats_df.to_csv(output_path)
+    return output_path
+
+
+def aggregate_moe(df, by, columns):
+    """
+    Reference `moe.aggregate_moe`: one group and one column at a time, with
+    the Census formula spelled out (root of the summed squared MOEs, where
+    of the zero estimates only the largest MOE is counted).
+    """
+    rows = {}
+    for key, group in df.groupby(by):
+        row = {}
+        for col in columns:
+            pairs = list(zip(group[col], group[f"{col}_moe"]))
+            squares = sum(moe ** 2 for estimate, moe in pairs if estimate != 0)
+            zero_moes = [moe for estimate, moe in pairs if estimate == 0]
+            if zero_moes:
+                squares += max(zero_moes) ** 2
+            row[col] = sum(estimate for estimate, _ in pairs)
+            row[f"{col}_moe"] = math.sqrt(squares)
+        rows[key] = row
+    result = pd.DataFrame.from_dict(rows, orient="index")
+    result.index.name = by
+    return result
+
+
+def variable_prefix(index, label):
+    """
+    Reference `VariableIndex.prefix`: a scan of every indexed label, keeping
+    those equal to `label` or below it by whole '!!' levels.
+    """
+    from audt_data.d03_src.pp.acs.variables import normalize_label
+
+    key = normalize_label(label)
+    rows = [row for row, candidate in enumerate(index.keys)
+            if candidate == key or candidate.startswith(f"{key}!!")]
+    return index._records(rows)
@@ -8,18 +8,34 @@
 
 import os
 import json
-import pandas as pd
 import glob
 import re
-import subprocess
-import sys
+import time
+import logging
+import argparse
+import threading
+from contextvars import ContextVar
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.logger import setup_logger, pool_logging_kwargs, queue_logging
 from audt_data.d03_src.utils.repo import get_repo_root
-from audt_data.d03_src.pp.acs.helpers import parse_md, parse_acs
+from audt_data.d03_src.pp.acs.helpers import parse_acs
+from audt_data.d03_src.pp.acs.store import (
+    write_acs_parquet, dataset_name, OUTPUT_FORMATS, PROCESSED, METADATA
+)
+from audt_data.d03_src.pp.acs.md_cache import load_parsed_md, MD_CACHE_DIR
+from audt_data.d03_src.pp.acs.loader import sniff_acs_json, load_acs_data, load_acs_md
+from audt_data.d03_src.pp.acs.manifest import (
+    load_manifest, save_manifest, file_fingerprint, is_up_to_date, record_result
+)
+from audt_data.d03_src.utils.profiling import StageRecorder, stage, aggregate_stages, profiled
 # Set up the logger
 logger = setup_logger("acs.batch_processor")
 
+RUN_REPORT = "run_report.json"
+PROFILE_DIR = ".profiles"
+
 def extract_acs_metadata(filename):
     """
     Extract metadata from ACS filename (year, identifier).
@@ -35,120 +51,145 @@ def extract_acs_metadata(filename):
         logger.error(f"Could not parse filename: {basename}")
         return None, None
 
-def process_acs_file(input_file, output_dir):
-    """Process a single ACS dataset file"""
+def find_metadata_file(input_file, year, identifier):
+    """
+    Find the metadata file that belongs to a raw ACS data file.
+
+    Returns:
+    str: Path to the metadata file, or None if there is none
+    """
+    # Look for metadata file with different naming patterns
+    # Try with _md.json suffix (seen in the error logs)
+    md_file = os.path.join(os.path.dirname(input_file), f"acs{year}_{identifier}_md.json")
+    if os.path.exists(md_file):
+        return md_file
+    
+    # Try with _metadata.json suffix (as in your original code)
+    meta_files = glob.glob(os.path.join(os.path.dirname(input_file), 
+                                        f"acs{year}_{identifier}_metadata.json"))
+    if meta_files:
+        return meta_files[0]
+    
+    return None
+
+def _process_acs_file(input_file, output_dir, output_format="csv"):
+    """
+    Process a single ACS dataset file.
+
+    Parameters:
+    input_file (str): Raw ACS JSON file (data or metadata)
+    output_dir (str or Path): Directory to write the processed output to
+    output_format (str): 'csv' for flat CSV files, 'parquet' for the
+                         partitioned, typed Parquet store (see `store`)
+
+    Returns:
+    tuple: (output_path, error) - output_path is None if processing failed,
+           in which case error holds a short description of the failure
+    """
     try:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}")
+
         year, identifier = extract_acs_metadata(input_file)
         if not year or not identifier:
-            return False
+            return None, f"Could not parse filename: {os.path.basename(input_file)}"
         
         logger.info(f"Processing ACS {year} - {identifier}")
         
         # Check if file exists and has content
         if not os.path.exists(input_file) or os.path.getsize(input_file) == 0:
             logger.error(f"File {input_file} is empty or does not exist")
-            return False
-        
-        # Try to load the raw data with proper error handling
-        try:
-            with open(input_file, 'r') as f:
-                content = f.read().strip()
-                
-                # Check if file is empty or just whitespace
-                if not content:
-                    logger.error(f"File {input_file} is empty")
-                    return False
-                    
-                # Try to parse JSON
-                data = json.loads(content)
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON from {input_file}: {e}")
-            
-            # Try alternative parsing methods
-            try:
-                # Some files might be CSV or other format - check first few bytes
-                with open(input_file, 'rb') as f:
-                    header = f.read(4)
-                    
-                if header.startswith(b'PK'):
-                    logger.error(f"File {input_file} appears to be a ZIP file")
-                elif content and (content[0] == '<' or content.startswith('<?xml')):
-                    logger.error(f"File {input_file} appears to be an XML file")
-                else:
-                    # Try as CSV
-                    try:
-                        df = pd.read_csv(input_file)
-                        logger.info(f"Successfully parsed {input_file} as CSV")
-                        # Process CSV data differently
-                        # ...
-                    except Exception:
-                        logger.error(f"Could not parse {input_file} as CSV either")
-            except Exception as alt_err:
-                logger.error(f"Alternative parsing failed for {input_file}: {alt_err}")
-                
-            return False
+            return None, "File is empty or does not exist"
         
+        # Tell metadata from data files (and catch wrong downloads) by
+        # their leading bytes, so each file is decoded exactly once
+        with stage("sniff"):
+            kind = sniff_acs_json(input_file)
+        if kind == 'empty':
+            logger.error(f"File {input_file} is empty")
+            return None, "File is empty"
+        if kind == 'zip':
+            logger.error(f"File {input_file} appears to be a ZIP file")
+            return None, "File is a ZIP file, not ACS JSON"
+        if kind == 'xml':
+            logger.error(f"File {input_file} appears to be an XML file")
+            return None, "File is an XML file, not ACS JSON"
+        if kind == 'unknown':
+            logger.error(f"File {input_file} does not look like ACS JSON")
+            return None, "File is not ACS JSON"
+
         # Parse metadata to get column mapping
-        if 'variables' in data:
+        if kind == 'metadata':
+            # Try to load the raw data with proper error handling
+            try:
+                with stage("decode_json", bytes_in=os.path.getsize(input_file)) as span:
+                    data = load_acs_md(input_file)
+                    span["rows"] = len(data.get('variables', {}))
+            except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+                logger.error(f"Error parsing JSON from {input_file}: {e}")
+                return None, f"Error parsing JSON: {e}"
+
             # This is a metadata file
             logger.info(f"Processing metadata file: {input_file}")
             try:
-                metadata = parse_md(data)
+                with stage("parse_md") as span:
+                    metadata, _ = load_parsed_md(input_file, year, dataset_name(identifier),
+                                                 cache_dir=Path(output_dir) / MD_CACHE_DIR, md=data)
+                    span.update(rows=len(metadata), columns=metadata.shape[1])
                 
                 # Save processed metadata
-                output_path = os.path.join(output_dir, f"acs{year}_{identifier}_metadata.csv")
-                metadata.to_csv(output_path)
+                with stage("write") as span:
+                    if output_format == "parquet":
+                        output_path = write_acs_parquet(metadata, output_dir, METADATA, identifier, year)
+                    else:
+                        output_path = os.path.join(output_dir, f"acs{year}_{identifier}_metadata.csv")
+                        metadata.to_csv(output_path)
+                    span["bytes_out"] = _output_bytes(output_path)
                 logger.success(f"Saved processed metadata to {output_path}")
             except Exception as e:
                 logger.error(f"Error parsing metadata: {str(e)}")
-                return False
+                return None, f"Error parsing metadata: {str(e)}"
         else:
             # This is a data file - we need column mapping
-            # Look for metadata file with different naming patterns
-            metadata_file = None
-            
-            # Try with _md.json suffix (seen in the error logs)
-            md_file = os.path.join(os.path.dirname(input_file), f"acs{year}_{identifier}_md.json")
-            if os.path.exists(md_file):
-                metadata_file = md_file
-            
-            # Try with _metadata.json suffix (as in your original code)
-            if not metadata_file:
-                meta_files = glob.glob(os.path.join(os.path.dirname(input_file), 
-                                                f"acs{year}_{identifier}_metadata.json"))
-                if meta_files:
-                    metadata_file = meta_files[0]
+            metadata_file = find_metadata_file(input_file, year, identifier)
             
             if not metadata_file:
                 logger.error(f"Could not find metadata file for {input_file}")
-                return False
+                return None, "Could not find metadata file"
             
             try:    
-                with open(metadata_file, 'r') as f:
-                    metadata_data = json.load(f)
-                
-                metadata = parse_md(metadata_data)
-                
-                # Create column mapping
-                col_mapping = {col: f"{col}_{desc}" for col, desc in 
-                              zip(metadata['column'], metadata['desc_2'])}
-                
-                # Parse ACS data
-                df = pd.read_json(input_file)
-                
-                # Remove data type conversion here - we'll handle it better in parse_acs
-                # The improved parse_acs will handle data types appropriately
+                # Parsed once per vintage and shared with the metadata file itself
+                with stage("parse_md") as span:
+                    metadata, col_mapping = load_parsed_md(metadata_file, year, identifier,
+                                                           cache_dir=Path(output_dir) / MD_CACHE_DIR)
+                    span.update(rows=len(metadata), columns=metadata.shape[1])
+
+                # Only decode the estimate columns the mapping keeps
+                try:
+                    with stage("decode_json", bytes_in=os.path.getsize(input_file)) as span:
+                        data = load_acs_data(input_file, columns=['GEO_ID', *col_mapping])
+                        span.update(rows=len(data), columns=data.shape[1])
+                except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+                    logger.error(f"Error parsing JSON from {input_file}: {e}")
+                    return None, f"Error parsing JSON: {e}"
                 
                 # Process the data with the column mapping
                 try:
-                    parsed_data = parse_acs(df, col_mapping)
-                    
-                    # Add year column
-                    parsed_data.loc[:, 'year'] = year
+                    with stage("parse_acs") as span:
+                        parsed_data = parse_acs(data, col_mapping)
+                        
+                        # Add year column
+                        parsed_data.loc[:, 'year'] = year
+                        span.update(rows=len(parsed_data), columns=parsed_data.shape[1])
                     
                     # Save processed data
-                    output_path = os.path.join(output_dir, f"acs{year}_{identifier}_processed.csv")
-                    parsed_data.to_csv(output_path)
+                    with stage("write") as span:
+                        if output_format == "parquet":
+                            output_path = write_acs_parquet(parsed_data, output_dir, PROCESSED, identifier, year)
+                        else:
+                            output_path = os.path.join(output_dir, f"acs{year}_{identifier}_processed.csv")
+                            parsed_data.to_csv(output_path)
+                        span["bytes_out"] = _output_bytes(output_path)
                     
                     # Log data type information for debugging
                     dtypes_msg = "Data types in processed file:\n" + "\n".join([f"{col}: {dtype}" for col, dtype in parsed_data.dtypes.items()])
@@ -160,53 +201,368 @@ def process_acs_file(input_file, output_dir):
                     logger.error(f"Error processing data file: {str(e)}")
                     import traceback
                     logger.error(f"Traceback: {traceback.format_exc()}")
-                    return False
+                    return None, f"Error processing data file: {str(e)}"
             except Exception as e:
                 logger.error(f"Error processing data file: {str(e)}")
-                return False
+                return None, f"Error processing data file: {str(e)}"
                 
-        return True
+        return output_path, None
     
     except Exception as e:
         logger.error(f"Error processing {input_file}: {str(e)}")
+        return None, f"Error processing {input_file}: {str(e)}"
+
+def _output_bytes(output_path):
+    """Size of a written output: a file, or a directory of Parquet parts."""
+    if os.path.isdir(output_path):
+        return sum(path.stat().st_size for path in Path(output_path).rglob("*") if path.is_file())
+    return os.path.getsize(output_path)
+
+def process_acs_file(input_file, output_dir, output_format="csv"):
+    """Process a single ACS dataset file"""
+    output_path, _ = _process_acs_file(input_file, output_dir, output_format)
+    return output_path is not None
+
+def process_acs_file_result(input_file, output_dir, output_format="csv", profile=False,
+                            trace_memory=False):
+    """
+    Process a single ACS dataset file and report on the run.
+
+    Parameters:
+    input_file, output_dir, output_format: As for `process_acs_file`
+    profile (bool): Run under cProfile and save the stats to
+                    {output_dir}/.profiles/{file name}.prof
+    trace_memory (bool): Record each stage's peak Python allocations with
+                         tracemalloc (slows processing down noticeably)
+
+    Returns:
+    dict: Per-file result with keys 'file', 'success', 'output_path', 'error',
+          'started' (epoch seconds), 'elapsed' (wall seconds), 'cpu_time'
+          (CPU seconds), 'pid' (the process that did the work), 'stages'
+          (one dict per stage - 'sniff', 'parse_md', 'decode_json',
+          'parse_acs', 'write' - with wall/CPU seconds, memory and
+          rows/columns/bytes counts; see `profiling.StageRecorder`),
+          'peak_rss' (bytes) and 'profile' (the stats file, if profiled)
+    """
+    started = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    recorder = StageRecorder(trace_memory=trace_memory)
+    profile_path = None
+    if profile:
+        profile_path = str(Path(output_dir) / PROFILE_DIR / f"{os.path.basename(input_file)}.prof")
+    with recorder.activate(), profiled(profile_path):
+        output_path, error = _process_acs_file(input_file, output_dir, output_format)
+
+    return {
+        'file': str(input_file),
+        'success': output_path is not None,
+        'output_path': str(output_path) if output_path is not None else None,
+        'error': error,
+        'started': started,
+        'elapsed': time.perf_counter() - wall_start,
+        'cpu_time': time.process_time() - cpu_start,
+        'pid': os.getpid(),
+        'skipped': False,
+        'stages': recorder.stages,
+        'peak_rss': recorder.stages[-1]['peak_rss'] if recorder.stages else None,
+        'profile': profile_path,
+    }
+
+# Records of the file being processed in the current task, while its logs
+# are captured (see `_capture_logs`); each thread has its own value
+_captured_records = ContextVar("captured_records", default=None)
+
+class _RecordCollector(logging.Filter):
+    """
+    Logger filter that diverts records logged while a capture is active in
+    the current context into that capture, so they can be replayed
+    elsewhere; other records pass through to the handlers untouched.
+    """
+
+    def filter(self, record):
+        records = _captured_records.get()
+        if records is None:
+            return True
+        # Flatten the record so it can be pickled back to the parent process
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        records.append(record)
         return False
 
-def batch_process_acs():
+_collector = _RecordCollector()
+_collector_lock = threading.Lock()
+
+@contextmanager
+def _capture_logs(prefix="acs"):
+    """
+    Collect the records of every `prefix` logger logged by this task for
+    the duration of the block instead of emitting them.
+
+    One shared filter is attached to the loggers and never removed; what it
+    collects depends on a context variable, so tasks running concurrently on
+    threads each collect only their own records and logging elsewhere is
+    unaffected.
+    """
+    with _collector_lock:
+        for name in list(logging.Logger.manager.loggerDict):
+            if name == prefix or name.startswith(f"{prefix}."):
+                lg = logging.getLogger(name)
+                if _collector not in lg.filters:
+                    lg.addFilter(_collector)
+    records = []
+    token = _captured_records.set(records)
+    try:
+        yield records
+    finally:
+        _captured_records.reset(token)
+
+def _process_acs_file_worker(input_file, output_dir, output_format, profile=False, trace_memory=False):
+    """Pool entry point: process one file, returning its result and log records."""
+    with _capture_logs() as records:
+        result = process_acs_file_result(input_file, output_dir, output_format, profile, trace_memory)
+    return result, records
+
+def _failed_result(input_file, error):
+    """Result for a file whose worker died before it could report back."""
+    return {
+        'file': str(input_file),
+        'success': False,
+        'output_path': None,
+        'error': f"Worker failed: {error!r}",
+        'started': None,
+        'elapsed': None,
+        'cpu_time': None,
+        'pid': None,
+        'skipped': False,
+        'stages': [],
+        'peak_rss': None,
+        'profile': None,
+    }
+
+def _replay_logs(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+def _skipped_result(input_file, entry):
+    """Result for a file whose manifest entry shows its output is current."""
+    return {
+        'file': str(input_file),
+        'success': True,
+        'output_path': entry['output_path'],
+        'error': None,
+        'started': None,
+        'elapsed': 0.0,
+        'cpu_time': 0.0,
+        'pid': None,
+        'skipped': True,
+        'stages': [],
+        'peak_rss': None,
+        'profile': None,
+    }
+
+def _input_fingerprints(input_file, previous=None):
+    """Fingerprints of a raw file and (for data files) its metadata file."""
+    previous = previous or {}
+    year, identifier = extract_acs_metadata(input_file)
+    metadata_file = None
+    if year and identifier and not identifier.endswith(("_md", "_metadata")):
+        metadata_file = find_metadata_file(input_file, year, identifier)
+    return {
+        'input': file_fingerprint(input_file, previous.get('input')),
+        'metadata': file_fingerprint(metadata_file, previous.get('metadata')),
+    }
+
+def _process_files_parallel(files, output_dir, executor, output_format="csv", on_result=None,
+                            profile=False, trace_memory=False):
+    """
+    Process `files` on `executor`, returning results in input order.
+
+    Each worker buffers its log output; the buffered records are replayed in
+    the parent in file order as soon as every earlier file has finished, so
+    the log reads the same as a serial run regardless of completion order.
+    `on_result(index, result)` is called as soon as each file finishes.
+    """
+    futures = {
+        executor.submit(_process_acs_file_worker, file, output_dir, output_format,
+                        profile, trace_memory): i
+        for i, file in enumerate(files)
+    }
+    finished = {}
+    results = []
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            finished[i] = future.result()
+        except Exception as e:
+            finished[i] = (_failed_result(files[i], e), [])
+        if on_result is not None:
+            on_result(i, finished[i][0])
+
+        while len(results) in finished:
+            result, records = finished.pop(len(results))
+            _replay_logs(records)
+            if result['pid'] is None:
+                logger.error(f"Error processing {result['file']}: {result['error']}")
+            results.append(result)
+    return results
+
+def _process_files(files, output_dir, jobs, executor, output_format, on_result=None,
+                   profile=False, trace_memory=False):
+    """Process `files` serially or on a pool, depending on `jobs`/`executor`."""
+    if executor is not None:
+        return _process_files_parallel(files, output_dir, executor, output_format, on_result,
+                                       profile, trace_memory)
+
+    jobs = min(jobs or os.cpu_count() or 1, len(files))
+    if jobs > 1:
+        logger.info(f"Processing with {jobs} worker processes")
+        with ProcessPoolExecutor(max_workers=jobs, **pool_logging_kwargs()) as pool:
+            return _process_files_parallel(files, output_dir, pool, output_format, on_result,
+                                           profile, trace_memory)
+
+    results = []
+    for i, file in enumerate(files):
+        results.append(process_acs_file_result(file, output_dir, output_format, profile, trace_memory))
+        if on_result is not None:
+            on_result(i, results[-1])
+    return results
+
+def build_run_report(results, started, elapsed, settings):
+    """
+    Machine-readable summary of a batch run.
+
+    Parameters:
+    results (list): Per-file results (see `process_acs_file_result`)
+    started (float): Epoch seconds the batch started at
+    elapsed (float): Wall seconds the batch took
+    settings (dict): Options the batch ran with
+
+    Returns:
+    dict: 'started', 'elapsed', 'settings', 'totals' (file counts, summed
+          per-file wall/CPU seconds and the highest peak RSS), 'stages'
+          (per-stage totals over all processed files, see
+          `profiling.aggregate_stages`) and 'files' (the per-file results)
+    """
+    processed = [result for result in results if not result['skipped']]
+    peaks = [result['peak_rss'] for result in processed if result.get('peak_rss') is not None]
+    return {
+        'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        'elapsed': elapsed,
+        'settings': settings,
+        'totals': {
+            'files': len(results),
+            'processed': len(processed),
+            'skipped': len(results) - len(processed),
+            'failed': sum(not result['success'] for result in results),
+            'wall': sum(result['elapsed'] or 0.0 for result in processed),
+            'cpu': sum(result['cpu_time'] or 0.0 for result in processed),
+            'peak_rss': max(peaks) if peaks else None,
+        },
+        'stages': aggregate_stages(result.get('stages', []) for result in processed),
+        'files': results,
+    }
+
+def write_run_report(report, output_dir):
+    """Write a run report to {output_dir}/run_report.json, returning its path."""
+    path = Path(output_dir) / RUN_REPORT
+    tmp_path = path.with_name(f".{RUN_REPORT}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def batch_process_acs(jobs=1, executor=None, output_format="csv", force=False,
+                      raw_dir=None, preprocessed_dir=None, profile=False,
+                      trace_memory=False, report=True):
     """
     Batch process all ACS datasets in the repository and save processed data.
     
     Uses the standardized repository structure:
     - Raw ACS data is stored in {repo_root}/d01_data/acs/
     - Processed data will be saved to {repo_root}/d01_data/acs/preprocessed/
+
+    Parameters:
+    jobs (int): Number of worker processes to use. 1 (the default) processes
+                files serially in this process; None uses every available core.
+    executor (concurrent.futures.Executor): Optional executor to run the files
+                on instead of creating a process pool. It is not shut down.
+    output_format (str): 'csv' or 'parquet' (see `process_acs_file`)
+    force (bool): Reprocess every file, ignoring the manifest. By default only
+                  files whose raw/metadata contents, processing code or output
+                  format changed since their last successful run are rebuilt.
+    raw_dir (str or Path): Override the raw ACS directory
+    preprocessed_dir (str or Path): Override the output directory (defaults
+                  to the 'preprocessed' sibling of raw_dir)
+    profile (bool): Save a cProfile of every processed file under
+                  {preprocessed_dir}/.profiles/
+    trace_memory (bool): Record per-stage Python allocation peaks with
+                  tracemalloc (see `process_acs_file_result`)
+    report (bool): Write a run report (see `build_run_report`) to
+                  {preprocessed_dir}/run_report.json
+
+    Returns:
+    list: One result dict per raw file (see `process_acs_file_result`), in
+          sorted filename order
     """
     # Define directories using repository root
-    repo_root = get_repo_root()
-    if not repo_root:
-        logger.error("Could not determine repository root. Aborting.")
-        return
-    
-    # Update paths to match repository structure
-    raw_dir = Path(repo_root) / "audt_data" / "d01_data" / "acs" / "raw"
-    # go up a dir and go to preprocessed 
-    preprocessed_dir = Path(raw_dir).parent / "preprocessed"
+    if raw_dir is None:
+        repo_root = get_repo_root()
+        if not repo_root:
+            logger.error("Could not determine repository root. Aborting.")
+            return []
+        
+        # Update paths to match repository structure
+        raw_dir = Path(repo_root) / "audt_data" / "d01_data" / "acs" / "raw"
+    raw_dir = Path(raw_dir)
+    if preprocessed_dir is None:
+        # go up a dir and go to preprocessed 
+        preprocessed_dir = raw_dir.parent / "preprocessed"
     
     # Create preprocessed directory if it doesn't exist
     os.makedirs(preprocessed_dir, exist_ok=True)
     
     # Find all ACS JSON files in raw directory
-    files = glob.glob(str(raw_dir / "acs*.json"))
+    files = sorted(glob.glob(str(raw_dir / "acs*.json")))
     
     if not files:
         logger.warning(f"No ACS files found in {raw_dir}")
-        return
+        return []
     
     logger.info(f"Found {len(files)} ACS files to process")
-    
+    started = time.time()
+    wall_start = time.perf_counter()
+
+    # Skip files whose outputs are current according to the manifest; the
+    # manifest is saved after every file so an interrupted run resumes here
+    manifest = load_manifest(preprocessed_dir)
+    results = [None] * len(files)
+    inputs = {}
+    for i, file in enumerate(files):
+        entry = manifest['files'].get(os.path.basename(file))
+        inputs[i] = _input_fingerprints(file, entry)
+        if not force and is_up_to_date(entry, inputs[i], output_format):
+            results[i] = _skipped_result(file, entry)
+    pending = [i for i, result in enumerate(results) if result is None]
+    if len(pending) < len(files):
+        logger.info(f"Skipping {len(files) - len(pending)} files that are up to date")
+
+    def on_result(i, result):
+        record_result(manifest, inputs[i], result, output_format)
+        save_manifest(preprocessed_dir, manifest)
+
     # Process each file
-    success_count = 0
-    for file in files:
-        if process_acs_file(file, preprocessed_dir):
-            success_count += 1
+    processed = []
+    if pending:
+        processed = _process_files(
+            [files[i] for i in pending], preprocessed_dir, jobs, executor, output_format,
+            on_result=lambda j, result: on_result(pending[j], result),
+            profile=profile, trace_memory=trace_memory)
+    for i, result in zip(pending, processed):
+        results[i] = result
+    success_count = sum(result['success'] for result in results)
     
     # Final report
     logger.info(f"Batch processing complete: {success_count}/{len(files)} files processed successfully")
@@ -214,8 +570,39 @@ def batch_process_acs():
         logger.success("All files processed successfully!")
     else:
         logger.warning(f"Failed to process {len(files) - success_count} files")
+        for result in results:
+            if not result['success']:
+                logger.warning(f"- {os.path.basename(result['file'])}: {result['error']}")
+
+    if report:
+        settings = {'jobs': jobs, 'output_format': output_format, 'force': force,
+                    'profile': profile, 'trace_memory': trace_memory}
+        run_report = build_run_report(results, started, time.perf_counter() - wall_start, settings)
+        for name, totals in run_report['stages'].items():
+            logger.info(f"Stage {name}: {totals['wall']:.2f}s wall, {totals['cpu']:.2f}s CPU "
+                        f"over {totals['count']} files")
+        logger.info(f"Saved run report to {write_run_report(run_report, preprocessed_dir)}")
+
+    return results
 
 if __name__ == "__main__":
-    logger.info("Starting ACS batch processing")
-    batch_process_acs()
-    logger.info("Batch processing completed")
+    parser = argparse.ArgumentParser(description="Batch process raw ACS files")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of worker processes (0 uses every available core)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv",
+                        help="Output format for the preprocessed files")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocess every file, even if the manifest says it is up to date")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save a cProfile of every processed file next to the outputs")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record per-stage memory peaks with tracemalloc (slower)")
+    parser.add_argument("--log-json", default=None, metavar="PATH",
+                        help="Also write the log as JSON lines to PATH (logs through a background queue)")
+    args = parser.parse_args()
+
+    with (queue_logging(json_path=args.log_json) if args.log_json else nullcontext()):
+        logger.info("Starting ACS batch processing")
+        batch_process_acs(jobs=args.jobs or None, output_format=args.format, force=args.force,
+                          profile=args.profile, trace_memory=args.trace_memory)
+        logger.info("Batch processing completed")
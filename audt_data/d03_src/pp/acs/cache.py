@@ -0,0 +1,109 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Cache]
+[Module containing FrameCache classes for cache]
+[Matt Franchi]
+"""
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("acs.cache")
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def _copy_on_write_enabled():
+    return bool(getattr(pd.options.mode, "copy_on_write", False))
+
+
+def _frame_nbytes(frame):
+    try:
+        return int(frame.memory_usage(deep=True).sum())
+    except ValueError:
+        # pandas cannot measure read-only object arrays (copy-on-write views)
+        # deeply; copy them to get a measurable frame
+        return int(frame.copy().memory_usage(deep=True).sum())
+
+
+class FrameCache:
+    """
+    Thread-safe LRU cache of DataFrames bounded by total memory.
+
+    Cached frames are never handed out directly. With pandas copy-on-write
+    enabled callers get a cheap shallow copy; otherwise they get a deep
+    copy, so mutating a returned frame can never corrupt the cache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (frame, nbytes)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _handout(self, frame):
+        return frame.copy(deep=not _copy_on_write_enabled())
+
+    def get(self, key):
+        """Return a copy of the cached frame for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._handout(entry[0])
+
+    def put(self, key, frame):
+        """Cache `frame` under `key`, evicting least recently used entries."""
+        nbytes = _frame_nbytes(frame)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Not caching {key}: {nbytes} bytes exceeds the budget")
+            return
+        frame = frame.copy()
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (frame, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        """Change the memory budget, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Hit/miss statistics and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
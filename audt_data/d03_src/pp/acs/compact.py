@@ -0,0 +1,158 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Compact]
+[Module with functions for compact ACS dtypes]
+[Matt Franchi]
+"""
+
+import numpy as np
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.cache import _frame_nbytes
+
+logger = setup_logger("acs.compact")
+
+# Integer types counts may be narrowed to. pandas keeps the dtype through
+# arithmetic, so an int8 or int16 column would wrap around when counts are
+# summed (tracts into boroughs, variables into totals); int32 holds any sum
+# of NYC counts, so it is the narrowest used
+INT_DTYPES = (np.int32, np.int64)
+
+# Largest number of decimals a float column may carry and still be stored as
+# float32; ACS percentages and ratios are published with one decimal
+MAX_FLOAT32_DECIMALS = 3
+
+# float32 represents every integer up to 2**24 exactly
+FLOAT32_EXACT_INT = 2 ** 24
+
+
+def smallest_int_dtype(values):
+    """Smallest of INT_DTYPES that holds every value of an integer array."""
+    if len(values) == 0:
+        return np.dtype(INT_DTYPES[0])
+    low, high = values.min(), values.max()
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return values.dtype
+
+
+def _decimals(values):
+    """Decimals needed to write every finite value exactly, or None if > MAX_FLOAT32_DECIMALS."""
+    for decimals in range(MAX_FLOAT32_DECIMALS + 1):
+        if np.array_equal(np.round(values, decimals), values):
+            return decimals
+    return None
+
+
+def fits_float32(values):
+    """
+    Whether a float64 array can be stored as float32 without changing any
+    value at its published precision.
+
+    The column's precision is the fewest decimals that reproduce it; the
+    float32 copy must round back to the same numbers at that precision.
+    """
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return True
+    decimals = _decimals(finite)
+    if decimals is None:
+        return False
+    if decimals == 0:
+        return bool(np.abs(finite).max() <= FLOAT32_EXACT_INT)
+    narrowed = finite.astype(np.float32).astype(np.float64)
+    return np.array_equal(np.round(narrowed, decimals), finite)
+
+
+def _compact_values(values, name, category_ratio):
+    """Compact representation of one column (or index), or None to keep it."""
+    dtype = values.dtype
+    if name == 'year' and pd.api.types.is_integer_dtype(dtype):
+        return values.astype(np.int16)
+    if pd.api.types.is_bool_dtype(dtype):
+        return None
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        narrow = smallest_int_dtype(np.asarray(values))
+        return values.astype(narrow) if narrow != dtype else None
+    if dtype == np.float64:
+        return values.astype(np.float32) if fits_float32(np.asarray(values)) else None
+    if dtype == object:
+        # Repeated labels (GEOIDs across years, borough names) as categories
+        n_unique = pd.Series(values).nunique(dropna=False)
+        if n_unique <= category_ratio * len(values):
+            return values.astype('category')
+    return None
+
+
+def compact_acs(df, category_ratio=0.5, report=False):
+    """
+    Shrink an ACS frame (e.g. from `parse_acs` or `merge_acs_data`) in memory.
+
+    - integer counts become int32 when they fit (see INT_DTYPES)
+    - float columns become float32 where no value changes at its published
+      precision (one decimal for ACS percentages); others stay float64.
+      Read back as float64, float32 values differ only below that precision
+    - 'year' becomes int16
+    - text columns and indexes whose values repeat (GEOID across the years
+      of a panel, borough names) become categoricals; all-unique ones such
+      as a single year's tract index are left as they are, since a
+      categorical would not be smaller
+    - geometry columns are untouched
+
+    Parameters:
+    df (DataFrame): Frame to compact; it is not modified
+    category_ratio (float): Convert text to categorical when it has at most
+                            this many unique values per row
+    report (bool): Also return a report of the bytes saved
+
+    Returns:
+    DataFrame: Compacted copy, of the same class as `df` (GeoDataFrames stay
+               GeoDataFrames); with report=True, a (frame, report) tuple where
+               report has 'bytes_before', 'bytes_after', 'bytes_saved' and
+               the per-column 'dtypes' changes
+    """
+    before = _frame_nbytes(df)
+    result = df.copy(deep=False)
+    changes = {}
+
+    geometry_name = getattr(df, '_geometry_column_name', None)
+    for name in df.columns:
+        if name == geometry_name:
+            continue
+        compacted = _compact_values(df[name], name, category_ratio)
+        if compacted is not None:
+            result[name] = compacted
+            changes[name] = (str(df[name].dtype), str(compacted.dtype))
+
+    if isinstance(df.index, pd.MultiIndex):
+        # Levels are already stored once; only the level values can shrink
+        levels = []
+        for level in df.index.levels:
+            compacted = _compact_values(level, level.name, 1.0)
+            if compacted is not None and not isinstance(compacted.dtype, pd.CategoricalDtype):
+                changes[f"index:{level.name}"] = (str(level.dtype), str(compacted.dtype))
+                level = compacted
+            levels.append(level)
+        result.index = df.index.set_levels(levels)
+    elif not isinstance(df.index, pd.RangeIndex):
+        compacted = _compact_values(df.index, df.index.name, category_ratio)
+        if compacted is not None:
+            result.index = compacted
+            changes[f"index:{df.index.name}"] = (str(df.index.dtype), str(compacted.dtype))
+
+    after = _frame_nbytes(result)
+    if before:
+        logger.info(f"Compacted frame from {before / 1e6:.1f} MB to {after / 1e6:.1f} MB "
+                    f"({100 * (before - after) / before:.0f}% saved)")
+    if report:
+        return result, {
+            'bytes_before': before,
+            'bytes_after': after,
+            'bytes_saved': before - after,
+            'dtypes': changes,
+        }
+    return result
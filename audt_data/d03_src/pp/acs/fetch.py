@@ -0,0 +1,312 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Fetch]
+[Module with functions for fetch]
+[Matt Franchi]
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.acs.loader import sniff_acs_json
+
+logger = setup_logger("acs.fetch")
+
+CENSUS_API_BASE_URL = "https://api.census.gov/data"
+
+# ACS group -> table type in the API path ('' for detailed tables)
+NYC_GROUPS = {
+    "DP05": "profile",   # Demographics
+    "S2801": "subject",  # Internet access
+    "S1901": "subject",  # Median household income
+    "S1501": "subject",  # Educational attainment
+    "S1602": "subject",  # Limited English speaking households
+}
+
+# All tracts in the five NYC counties
+NYC_GEOGRAPHY = {
+    "for": "tract:*",
+    "in": ["state:36", "county:005,047,061,081,085"],
+}
+
+# Statuses worth retrying; anything else fails immediately
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def build_fetch_jobs(groups, years, geography, raw_dir,
+                     base_url=CENSUS_API_BASE_URL, survey="acs/acs5"):
+    """
+    Expand a declarative pull into one job per file to download.
+
+    Parameters:
+    groups (dict): ACS group -> table type ('profile', 'subject' or '')
+    years (iterable): ACS vintages to pull
+    geography (dict): 'for'/'in' clauses of the data query
+    raw_dir (str or Path): Directory the raw files are saved to
+    base_url (str): Census API root; point it at a local server for testing
+    survey (str): Survey path under each year
+
+    Returns:
+    list: Dicts with 'url' (without the API key), 'params' and 'path', for
+          the metadata and data file of every (group, year), metadata first
+    """
+    jobs = []
+    for year in years:
+        for group, table_type in groups.items():
+            endpoint = f"{base_url.rstrip('/')}/{year}/{survey}"
+            if table_type:
+                endpoint = f"{endpoint}/{table_type}"
+            stem = f"acs{year}_{group.lower()}"
+            jobs.append({
+                "url": f"{endpoint}/groups/{group}.json",
+                "params": {},
+                "path": Path(raw_dir) / f"{stem}_md.json",
+            })
+            jobs.append({
+                "url": endpoint,
+                "params": {"get": f"group({group})", **geography},
+                "path": Path(raw_dir) / f"{stem}.json",
+            })
+    return jobs
+
+
+def _job_url(job, api_key=None):
+    params = dict(job["params"])
+    if api_key:
+        params["key"] = api_key
+    if not params:
+        return job["url"]
+    # Keep the Census query syntax readable: group(...), tract:*, 005,047
+    return f"{job['url']}?{urlencode(params, doseq=True, safe=':*(),')}"
+
+
+def _validators_path(path):
+    return path.with_name(f".{path.name}.http.json")
+
+
+def _load_validators(path):
+    try:
+        with open(_validators_path(path), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _download(url, path, validators, timeout):
+    """
+    Blocking download of `url` into `path`, run on a worker thread.
+
+    Returns:
+    tuple: (http_status, bytes_written); bytes_written is 0 on a 304
+    """
+    headers = {}
+    if path.exists():
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        response = urlopen(Request(url, headers=headers), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304:
+            return 304, 0
+        raise
+
+    with response:
+        # Write next to the target and swap in, so a failed or partial
+        # download never replaces a good file
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.part")
+        written = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: response.read(1 << 16), b""):
+                    f.write(chunk)
+                    written += len(chunk)
+            kind = sniff_acs_json(tmp_path)
+            if kind not in ("data", "metadata"):
+                raise ValueError(f"Response is not ACS JSON ({kind})")
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        new_validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if any(new_validators.values()):
+            with open(_validators_path(path), "w") as f:
+                json.dump(new_validators, f)
+        return response.status, written
+
+
+def _retry_delay(error, attempt, backoff):
+    """Honour Retry-After on 429/503, otherwise exponential backoff with jitter."""
+    if isinstance(error, HTTPError):
+        retry_after = error.headers.get("Retry-After") if error.headers else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+async def _fetch_one(job, semaphore, pool, api_key, skip_existing, retries, backoff, timeout):
+    loop = asyncio.get_running_loop()
+    path = job["path"]
+    result = {"url": _job_url(job), "path": str(path), "status": None,
+              "http_status": None, "bytes": 0, "attempts": 0,
+              "elapsed": 0.0, "error": None}
+
+    validators = _load_validators(path)
+    if skip_existing and path.exists() and not validators:
+        result["status"] = "skipped"
+        return result
+
+    async with semaphore:
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            result["attempts"] = attempt + 1
+            try:
+                status, written = await loop.run_in_executor(
+                    pool, _download, _job_url(job, api_key), path, validators, timeout)
+                result.update(http_status=status, bytes=written, error=None,
+                              status="not_modified" if status == 304 else "downloaded")
+                break
+            except (HTTPError, URLError, OSError, ValueError) as e:
+                result["error"] = str(e)
+                if isinstance(e, HTTPError):
+                    result["http_status"] = e.code
+                    retryable = e.code in RETRY_STATUSES
+                else:
+                    # Connection problems are retried; a bad payload is not
+                    retryable = not isinstance(e, ValueError)
+                if not retryable or attempt == retries:
+                    result["status"] = "failed"
+                    break
+                delay = _retry_delay(e, attempt, backoff)
+                logger.warning(f"Retrying {path.name} in {delay:.1f}s after error: {e}")
+                await asyncio.sleep(delay)
+        result["elapsed"] = time.perf_counter() - start
+
+    if result["status"] == "failed":
+        logger.error(f"Failed to fetch {path.name}: {result['error']}")
+    elif result["status"] == "downloaded":
+        logger.info(f"Fetched {path.name} ({result['bytes']} bytes, {result['elapsed']:.1f}s)")
+    return result
+
+
+async def fetch_acs_async(jobs, api_key=None, concurrency=8, skip_existing=False,
+                          retries=4, backoff=1.0, timeout=120):
+    """
+    Download every job concurrently, at most `concurrency` at a time.
+
+    Parameters:
+    jobs (list): Output of `build_fetch_jobs`
+    api_key (str): Census API key, appended to every request (never logged)
+    concurrency (int): Maximum number of requests in flight
+    skip_existing (bool): Skip files that already exist and have no stored
+                          ETag/Last-Modified to revalidate against
+    retries (int): Retries per file on connection errors, 429 and 5xx
+    backoff (float): Base delay in seconds for exponential backoff
+    timeout (float): Per-request socket timeout in seconds
+
+    Returns:
+    list: One result dict per job, in job order, with 'status' one of
+          'downloaded', 'not_modified', 'skipped' or 'failed'
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    for directory in {job["path"].parent for job in jobs}:
+        os.makedirs(directory, exist_ok=True)
+    # Blocking urllib calls run on a pool sized to the concurrency limit
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return await asyncio.gather(*[
+            _fetch_one(job, semaphore, pool, api_key, skip_existing, retries, backoff, timeout)
+            for job in jobs
+        ])
+
+
+def fetch_acs(groups=None, years=range(2020, 2024), geography=None, raw_dir=None,
+              base_url=CENSUS_API_BASE_URL, api_key=None, convert=None, **kwargs):
+    """
+    Pull ACS groups for a range of years into the raw data directory.
+
+    Parameters:
+    groups (dict): ACS group -> table type; defaults to NYC_GROUPS
+    years (iterable): ACS vintages to pull
+    geography (dict): 'for'/'in' clauses; defaults to NYC_GEOGRAPHY
+    raw_dir (str or Path): Defaults to {repo_root}/audt_data/d01_data/acs/raw
+    base_url (str): Census API root
+    api_key (str): Census API key; defaults to $CENSUS_API_KEY
+    convert (str): If 'csv' or 'parquet', preprocess the pulled files with
+                   `batch_process_acs` in the same run
+    **kwargs: Passed to `fetch_acs_async`
+
+    Returns:
+    list: Per-file fetch results (see `fetch_acs_async`)
+    """
+    if raw_dir is None:
+        raw_dir = Path(get_repo_root()) / "audt_data" / "d01_data" / "acs" / "raw"
+    api_key = api_key or os.environ.get("CENSUS_API_KEY")
+
+    jobs = build_fetch_jobs(groups or NYC_GROUPS, years, geography or NYC_GEOGRAPHY,
+                            raw_dir, base_url=base_url)
+    logger.info(f"Fetching {len(jobs)} ACS files from {base_url}")
+    results = asyncio.run(fetch_acs_async(jobs, api_key=api_key, **kwargs))
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info("Fetch complete: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+
+    if convert:
+        # Imported here to keep the fetcher usable without the parsing stack
+        from audt_data.d03_src.pp.acs.batch_pp import batch_process_acs
+        batch_process_acs(raw_dir=raw_dir, output_format=convert)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull ACS groups from the Census API")
+    parser.add_argument("--years", type=int, nargs=2, default=[2020, 2023],
+                        metavar=("START", "END"), help="Inclusive range of ACS vintages")
+    parser.add_argument("--groups", nargs="+", default=list(NYC_GROUPS),
+                        help="ACS groups to pull (must be listed in NYC_GROUPS)")
+    parser.add_argument("--key-file", default=None,
+                        help="File containing only the Census API key")
+    parser.add_argument("--base-url", default=CENSUS_API_BASE_URL)
+    parser.add_argument("--raw-dir", default=None)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--skip-existing", action="store_true")
+    parser.add_argument("--convert", choices=("csv", "parquet"), default=None)
+    args = parser.parse_args()
+
+    api_key = None
+    if args.key_file:
+        with open(args.key_file, "r") as f:
+            api_key = f.read().strip()
+
+    results = fetch_acs(
+        groups={group: NYC_GROUPS[group] for group in args.groups},
+        years=range(args.years[0], args.years[1] + 1),
+        raw_dir=args.raw_dir,
+        base_url=args.base_url,
+        api_key=api_key,
+        convert=args.convert,
+        concurrency=args.concurrency,
+        skip_existing=args.skip_existing,
+    )
+    if any(result["status"] == "failed" for result in results):
+        raise SystemExit(1)
@@ -6,17 +6,58 @@
 [Matt Franchi]
 """
 
+import os
+import numpy as np
 import pandas as pd 
 from audt_data.d03_src.utils.logger import setup_logger 
+from audt_data.d03_src.pp.acs.loader import load_acs_data
+from audt_data.d03_src.pp.acs.cache import FrameCache
+from audt_data.d03_src.pp.acs.compact import compact_acs
 
 logger = setup_logger("acs.helpers")
 
-def parse_md(md):
+# Census API annotation values that stand in for an estimate or margin of
+# error, as documented in the ACS API notes on annotation values
+CENSUS_ANNOTATION_CODES = {
+    -999999999: "Too few sample observations to compute",
+    -888888888: "Not applicable or not available",
+    -666666666: "Estimate could not be computed",
+    -555555555: "Estimate is controlled; no margin of error",
+    -333333333: "Median falls in an open-ended interval",
+    -222222222: "Too few sample observations to compute a margin of error",
+}
+
+def _to_float_block(block):
+    """
+    Convert a 2-D object array of Census values to float64 in one pass.
+    Entries that are not numbers (None, '', text) become NaN.
+    """
+    block = np.where(pd.isna(block), np.nan, block)
+    try:
+        return block.astype(np.float64)
+    except (TypeError, ValueError):
+        # Some entry is not a plain number; let pandas coerce it to NaN
+        values = pd.to_numeric(pd.Series(block.ravel()), errors='coerce')
+        return values.to_numpy(dtype=np.float64).reshape(block.shape)
+
+def moe_code(code):
+    """
+    Census code of the margin of error that belongs to an estimate code
+    ('DP05_0001E' -> 'DP05_0001M', 'DP05_0001PE' -> 'DP05_0001PM'), or None.
+    """
+    if code.endswith('PE'):
+        return code[:-2] + 'PM'
+    if code.endswith('E'):
+        return code[:-1] + 'M'
+    return None
+
+def parse_md(md, include_moe=False):
     """
     Parse ACS metadata into a structured DataFrame.
     
     Parameters:
     md (dict): Dictionary containing ACS metadata with a 'variables' key
+    include_moe (bool): Also keep the 'Margin of Error' variables
     
     Returns:
     pd.DataFrame: Processed metadata DataFrame
@@ -28,14 +69,15 @@ def parse_md(md):
     
     logger.info(f"Found {len(vars_df)} columns in the dataset")
     
-    # Process the labels with separators
-    min_sep = min(vars_df['label'].apply(lambda x: x.count('!!')))
-    max_sep = max(vars_df['label'].apply(lambda x: x.count('!!')))
+    # Split every label once; missing levels are padded with None
+    parts = vars_df['label'].str.split('!!', expand=True)
+    min_sep = int(parts.notna().sum(axis=1).min()) - 1
+    max_sep = parts.shape[1] - 1
 
-    for i in range(min_sep + 1, max_sep + 2):  # Adjusting range to account for correct indexing
-        vars_df[f'desc_{i}'] = vars_df['label'].apply(
-            lambda x: x.split('!!')[i-1] if len(x.split('!!')) >= i else None
-        )
+    # desc_i holds the i-th level of the label hierarchy
+    desc = parts.iloc[:, min_sep:max_sep + 1]
+    desc.columns = [f'desc_{i}' for i in range(min_sep + 1, max_sep + 2)]
+    vars_df = pd.concat([vars_df, desc], axis=1)
     
     # Drop unnecessary columns
     TO_DROP = ['label','concept','predicateType','group','limit','predicateOnly']
@@ -44,6 +86,8 @@ def parse_md(md):
 
     # Filter to include only estimates
     desc_1_filter = ['Estimate']
+    if include_moe:
+        desc_1_filter.append('Margin of Error')
     vars_df = vars_df[vars_df['desc_1'].isin(desc_1_filter)]
    
     # Sort by column name
@@ -54,57 +98,132 @@ def parse_md(md):
 
     return vars_df
 
-def parse_acs(acs, cols: dict):
+def parse_acs(acs, cols: dict, annotations="null", include_moe=False):
     """
     Parse ACS data with column mapping.
     
     Parameters:
-    acs (DataFrame): Raw ACS data
+    acs (DataFrame): Raw ACS data, as returned by `loader.load_acs_data`
+                     (or by `pd.read_json`, with the header as first row)
     cols (dict): Mapping of original column names to descriptive names
+    annotations (str): How to treat Census annotation values (see
+                       CENSUS_ANNOTATION_CODES) found in the data:
+                       - 'null': replace them with NaN (default)
+                       - 'flag': replace them with NaN and add an
+                         '{column}_annotation' column holding the code for
+                         every column that had any
+                       - 'keep': leave the raw codes in place
+    include_moe (bool): For every requested estimate whose margin of error
+                        is in the data, add it as '{name}_moe' right after
+                        the estimate. A 'controlled' MOE annotation
+                        (-555555555) becomes 0 rather than NaN.
     
     Returns:
     DataFrame: Processed ACS data with appropriate data types
     """
-    acs.columns = acs.iloc[0]
-    acs = acs[1:]
-    acs['tract_id'] = acs['GEO_ID'].str.split('US', expand=True)[1]
-    acs = acs.set_index('tract_id')
+    if annotations not in ("null", "flag", "keep"):
+        raise ValueError(f"annotations must be 'null', 'flag' or 'keep', got {annotations!r}")
 
-    acs = acs[list(cols.keys())]
-    acs.columns = acs.columns.map(lambda x: cols[x])
+    if 'GEO_ID' not in acs.columns:
+        # Frame from pd.read_json: the header is still the first row
+        acs.columns = acs.iloc[0]
+        acs = acs[1:]
+    tract_id = acs['GEO_ID'].str.split('US', expand=True)[1]
 
-    # Convert columns to numeric instead of forcing to integers
+    moe_cols = set()
+    if include_moe:
+        with_moe = {}
+        for code, name in cols.items():
+            with_moe[code] = name
+            moe = moe_code(code)
+            if moe and moe in acs.columns and moe not in cols:
+                with_moe[moe] = f"{name}_moe"
+                moe_cols.add(moe)
+        cols = with_moe
+
+    # Convert the whole block to numbers in one pass instead of per column.
     # This handles missing values and non-integer values better
-    numeric_cols = acs.columns
-    for col in numeric_cols:
-        try:
-            acs[col] = pd.to_numeric(acs[col], errors='coerce')
-        except Exception as e:
-            logger.warning(f"Could not convert column {col} to numeric: {e}")
-    
+    values = _to_float_block(acs[list(cols.keys())].to_numpy(dtype=object))
+
     # Fill NA values created by numeric conversion
-    acs = acs.fillna(0)
-    
-    # Try to convert to integer where possible (without losing data)
-    for col in acs.columns:
-        if acs[col].dtype.kind == 'f':  # If float
-            # Check if all values are actually integers
-            if (acs[col] % 1 == 0).all():
-                acs[col] = acs[col].astype(int)
-    
-    return acs
+    values[np.isnan(values)] = 0
+
+    codes = None
+    if annotations != "keep":
+        if moe_cols:
+            # Controlled estimates have no sampling error
+            is_moe = np.array([col in moe_cols for col in cols])
+            values[:, is_moe] = np.where(values[:, is_moe] == -555555555, 0, values[:, is_moe])
+        is_code = np.isin(values, list(CENSUS_ANNOTATION_CODES))
+        if is_code.any():
+            if annotations == "flag":
+                codes = np.where(is_code, values, np.nan)
+            values[is_code] = np.nan
 
-def get_acs_data(year, identifier, cols_to_keep):
-    raw = pd.read_json(f"data/acs{year}_{identifier}.json")
-    parsed_data = parse_acs(raw, cols_to_keep)
+    # Integer dtype wherever a column is complete and whole-valued
+    is_int = (values == np.floor(values)).all(axis=0)
+
+    parsed = {}
+    for j, col in enumerate(cols.keys()):
+        parsed[cols[col]] = values[:, j].astype(np.int64) if is_int[j] else values[:, j]
+        if codes is not None and not np.isnan(codes[:, j]).all():
+            parsed[f"{cols[col]}_annotation"] = pd.array(codes[:, j], dtype="Int64")
+
+    return pd.DataFrame(parsed, index=pd.Index(tract_id.to_numpy(copy=True), name='tract_id'))
+
+# Parsed get_acs_data results, keyed by file identity and requested columns
+_acs_cache = FrameCache()
+
+def get_acs_data(year, identifier, cols_to_keep, use_cache=True, include_moe=False,
+                 data_dir="data"):
+    """
+    Load and parse {data_dir}/acs{year}_{identifier}.json (data/ relative to
+    the working directory by default).
+
+    Results are memoized in a bounded LRU cache keyed by year, identifier,
+    the requested columns and the file's mtime and size, so re-slicing the
+    same vintages does not re-parse them. Returned frames are copies and
+    can be modified freely (see `acs_cache_info`, `set_acs_cache_budget`).
+    With include_moe=True, margins of error are carried along as
+    '{name}_moe' columns (see `parse_acs`).
+    """
+    path = os.path.abspath(os.path.join(data_dir, f"acs{year}_{identifier}.json"))
+    key = None
+    if use_cache:
+        stat = os.stat(path)
+        key = (year, identifier, tuple(cols_to_keep.items()), include_moe,
+               path, stat.st_mtime_ns, stat.st_size)
+        cached = _acs_cache.get(key)
+        if cached is not None:
+            return cached
+
+    # Only decode the requested variables (and their MOEs)
+    wanted = ['GEO_ID', *cols_to_keep]
+    if include_moe:
+        wanted += [moe_code(code) for code in cols_to_keep if moe_code(code)]
+    raw = load_acs_data(path, columns=wanted)
+    parsed_data = parse_acs(raw, cols_to_keep, include_moe=include_moe)
     # Add year column after parsing
     parsed_data['year'] = year
 
     # quick validate 
     quick_validate_acs(parsed_data)
 
+    if key is not None:
+        _acs_cache.put(key, parsed_data)
     return parsed_data
 
+def acs_cache_info():
+    """Hit/miss statistics of the `get_acs_data` cache."""
+    return _acs_cache.stats()
+
+def set_acs_cache_budget(max_bytes):
+    """Set the memory budget of the `get_acs_data` cache (0 disables it)."""
+    _acs_cache.resize(max_bytes)
+
+def clear_acs_cache():
+    _acs_cache.clear()
+
 def get_acs_data_range(start, end, identifier, cols_to_keep):
     return pd.concat([get_acs_data(year, identifier, cols_to_keep) 
                      for year in range(start, end+1)])
@@ -142,7 +261,9 @@ def combine_acs_years(data_dict, year_range):
     
     return pd.concat(combined, ignore_index=True)
 
-def merge_acs_data(ct_nyc, year_start, year_end, acs_columns):
+def merge_acs_data(ct_nyc, year_start, year_end, acs_columns, as_panel=False,
+                   jobs=None, executor=None, include_moe=False, compact=False,
+                   data_dir="data"):
     """
     Merges ACS data for specified years into the census tract GeoDataFrame.
     Handles multiple years correctly by creating separate rows for each year.
@@ -162,45 +283,38 @@ def merge_acs_data(ct_nyc, year_start, year_end, acs_columns):
                            },
                            ...
                        }
+    as_panel (bool): Return an `AcsPanel` instead, which stores each tract
+                     geometry once and the ACS attributes in a
+                     (GEOID, year)-indexed table
+    jobs (int): Number of threads loading (year, dataset) pieces; None uses
+                one per core
+    executor (concurrent.futures.Executor): Optional executor for loading
+    include_moe (bool): Add each variable's margin of error as '{name}_moe'
+    compact (bool): Use compact dtypes (see `compact.compact_acs`): int32
+                    counts, float32 where precision allows, int16 year
+                    and categorical GEOID
+    data_dir (str or Path): Directory with the raw acs{year}_{identifier}.json
+                            files
     
     Returns:
     GeoDataFrame: Merged dataset with proper year handling
     """
-    # Create a list to store DataFrames for each year
-    yearly_dfs = []
-    
-    # Process each year
-    for year in range(year_start, year_end + 1):
-        # Start with a copy of the base census tracts
-        ct_year = ct_nyc.copy()
-        ct_year['year'] = year
-        
-        merged_year = ct_year
-        
-        # Process each ACS dataset
-        for dataset_code, dataset_info in acs_columns.items():
-            # Get data for this dataset and year
-            dataset_df = get_acs_data(year, dataset_code, dataset_info['columns'])
-            dataset_df['year'] = year
-            
-            # Merge with the growing result
-            merged_year = merged_year.merge(
-                dataset_df,
-                left_on=['GEOID', 'year'],
-                right_on=['tract_id', 'year'],
-                how='left'
-            )
-        
-        yearly_dfs.append(merged_year)
-    
-    # Combine all years
-    result = pd.concat(yearly_dfs, ignore_index=True)
-    
-    # Add helpful metadata
-    result.attrs['acs_years'] = list(range(year_start, year_end + 1))
-    result.attrs['acs_datasets'] = list(acs_columns.keys())
-    
-    return result
+    from audt_data.d03_src.pp.acs.panel import build_acs_panel
+
+    panel = build_acs_panel(ct_nyc, year_start, year_end, acs_columns,
+                            jobs=jobs, executor=executor, include_moe=include_moe,
+                            data_dir=data_dir)
+    if compact:
+        panel = panel.compact()
+    if as_panel:
+        return panel
+
+    # One row per tract and year, with metadata in attrs
+    merged = panel.to_geodataframe()
+    if compact:
+        # GEOID and the other tract columns repeat once per year
+        merged = compact_acs(merged)
+    return merged
 
 def verify_acs_data(merged_data, acs_columns):
     """
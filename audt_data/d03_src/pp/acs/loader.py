@@ -0,0 +1,161 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Loader]
+[Module with functions for loader]
+[Matt Franchi]
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("acs.loader")
+
+_BOM = b'\xef\xbb\xbf'
+
+
+def sniff_acs_json(path, chunk_size=4096):
+    """
+    Classify a raw ACS file from its leading bytes, without parsing it.
+
+    Returns:
+    str: 'metadata' (a JSON object, as served by .../groups/{group}.json),
+         'data' (the Census array-of-arrays format), 'zip', 'xml',
+         'empty' (no content besides whitespace) or 'unknown'
+    """
+    with open(path, 'rb') as f:
+        head = f.read(chunk_size)
+        if head.startswith(b'PK'):
+            return 'zip'
+        if head.startswith(_BOM):
+            head = head[len(_BOM):]
+        head = head.lstrip()
+        # Skip any run of leading whitespace longer than one chunk
+        while not head:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return 'empty'
+            head = chunk.lstrip()
+
+    first = head[:1]
+    if first == b'{':
+        return 'metadata'
+    if first == b'[':
+        return 'data'
+    if first == b'<':
+        return 'xml'
+    return 'unknown'
+
+
+def _row_text(line):
+    """A single row's JSON from one line of a row-per-line data file."""
+    line = line.rstrip().rstrip(b',')
+    if line.endswith(b']]'):
+        line = line[:-1]
+    return line
+
+
+def _stream_columns(path, columns):
+    """
+    Decode a data file one line (row) at a time, keeping only `columns`.
+
+    The Census API writes one row per line, so every row can be decoded and
+    reduced to the requested cells before the next is read: the unrequested
+    cells never accumulate. Returns None if the file is not laid out that
+    way.
+    """
+    with open(path, 'rb') as f:
+        lines = iter(f)
+        first = next(lines, b'').strip()
+        if first.startswith(_BOM):
+            first = first[len(_BOM):]
+        if not first.startswith(b'[['):
+            return None
+        try:
+            header = json.loads(_row_text(first[1:]))
+        except ValueError:
+            return None
+        if not isinstance(header, list):
+            return None
+
+        position = {name: j for j, name in enumerate(header)}
+        keep = [name for name in dict.fromkeys(columns) if name in position]
+        positions = [position[name] for name in keep]
+
+        rows = []
+        for line in lines:
+            text = _row_text(line.strip())
+            if not text or text == b']':
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                return None
+            if not isinstance(row, list) or len(row) != len(header):
+                raise ValueError(f"{path} has rows that do not match its header")
+            rows.append([row[j] for j in positions])
+
+    body = np.array(rows, dtype=object).reshape(len(rows), len(keep))
+    return pd.DataFrame(body, columns=keep, copy=False)
+
+
+def load_acs_data(path, columns=None):
+    """
+    Load a Census API data file into a DataFrame in a single parse.
+
+    The Census API returns an array of arrays whose first row is the header.
+    The file is decoded once, the body is packed into a single object block
+    and the header becomes the column index directly, so no header-row
+    shuffle is needed afterwards.
+
+    With `columns`, only those variables are kept: the file is decoded one
+    row at a time and each row is cut down to the requested cells at once,
+    so the other cells (most of a DP05 or S-table file when a caller needs a
+    handful of estimates) are never stored or converted. Peak memory is then
+    about one row plus the result instead of the whole table.
+
+    Parameters:
+    path (str or Path): Raw 'acs{year}_{identifier}.json' data file
+    columns (list): Census variable codes to keep, in order; codes not in
+                    the file are skipped. All columns if None
+
+    Returns:
+    DataFrame: Raw (string-valued) ACS data with the Census variable codes
+               as columns
+    """
+    if columns is not None:
+        df = _stream_columns(path, columns)
+        if df is not None:
+            return df
+        logger.debug(f"{path} is not one row per line; decoding it whole")
+
+    with open(path, 'rb') as f:
+        rows = json.load(f)
+
+    if not isinstance(rows, list) or not rows or not isinstance(rows[0], list):
+        raise ValueError(f"{path} is not in the Census array-of-arrays format")
+
+    header = rows[0]
+    if len(rows) > 1:
+        body = np.array(rows[1:], dtype=object)
+        if body.ndim != 2 or body.shape[1] != len(header):
+            raise ValueError(f"{path} has rows that do not match its header")
+    else:
+        body = np.empty((0, len(header)), dtype=object)
+    # Drop the row lists now; the cell values are shared with `body`
+    del rows
+
+    df = pd.DataFrame(body, columns=header, copy=False)
+    if columns is not None:
+        df = df[[name for name in dict.fromkeys(columns) if name in df.columns]]
+    return df
+
+
+def load_acs_md(path):
+    """Load a Census API group metadata file."""
+    with open(path, 'rb') as f:
+        return json.load(f)
@@ -0,0 +1,135 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Manifest]
+[Module with functions for manifest]
+[Matt Franchi]
+"""
+
+import os
+import json
+import time
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("acs.manifest")
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# The source of every module in this package (batch_pp, helpers, loader,
+# store, compact, moe, ...) determines what the batch writes; editing any of
+# them invalidates every manifest entry
+CODE_PACKAGE = Path(__file__).parent
+
+
+def code_modules():
+    """Names of the ACS preprocessing source files, sorted."""
+    return tuple(sorted(path.name for path in CODE_PACKAGE.glob("*.py")))
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Fingerprint a file as {'path', 'size', 'mtime_ns', 'sha256'}.
+
+    If `previous` is an earlier fingerprint of the same file with the same
+    size and mtime, its hash is reused instead of re-reading the file.
+    """
+    if path is None:
+        return None
+    stat = os.stat(path)
+    if (previous and previous.get("size") == stat.st_size
+            and previous.get("mtime_ns") == stat.st_mtime_ns):
+        sha256 = previous["sha256"]
+    else:
+        sha256 = hash_file(path)
+    return {
+        "path": os.path.basename(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+    }
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """Hash of the ACS preprocessing source files."""
+    digest = hashlib.sha256()
+    for name in code_modules():
+        digest.update(name.encode())
+        digest.update((CODE_PACKAGE / name).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def load_manifest(output_dir):
+    """Load the manifest from `output_dir`, or return an empty one."""
+    path = Path(output_dir) / MANIFEST_NAME
+    if path.exists():
+        try:
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+            logger.warning(f"Ignoring manifest {path} with unsupported version")
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Ignoring unreadable manifest {path}: {e}")
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def save_manifest(output_dir, manifest):
+    """Atomically write the manifest to `output_dir`."""
+    path = Path(output_dir) / MANIFEST_NAME
+    tmp_path = path.with_name(f".{MANIFEST_NAME}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, inputs, output_format):
+    """
+    Whether a manifest entry still describes a valid output.
+
+    Parameters:
+    entry (dict): Manifest entry for the raw file, or None
+    inputs (dict): Current {'input': fingerprint, 'metadata': fingerprint}
+    output_format (str): Output format requested for this run
+
+    Returns:
+    bool: True if the file processed successfully with identical inputs,
+          code and output format, and its output still exists
+    """
+    if not entry or entry.get("status") != "success":
+        return False
+    if entry.get("code_version") != code_version() or entry.get("output_format") != output_format:
+        return False
+    for key, fingerprint in inputs.items():
+        previous = entry.get(key)
+        if (previous or {}).get("sha256") != (fingerprint or {}).get("sha256"):
+            return False
+    output_path = entry.get("output_path")
+    return bool(output_path) and os.path.exists(output_path)
+
+
+def record_result(manifest, inputs, result, output_format):
+    """Store a processing result (see `process_acs_file_result`) in the manifest."""
+    manifest["files"][os.path.basename(result["file"])] = {
+        **inputs,
+        "code_version": code_version(),
+        "output_format": output_format,
+        "output_path": result["output_path"],
+        "status": "success" if result["success"] else "failed",
+        "error": result["error"],
+        "processed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
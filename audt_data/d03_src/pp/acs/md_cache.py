@@ -0,0 +1,112 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Md Cache]
+[Module with functions for md cache]
+[Matt Franchi]
+"""
+
+import os
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.helpers import parse_md
+from audt_data.d03_src.pp.acs.manifest import hash_file, code_version
+
+logger = setup_logger("acs.md_cache")
+
+MD_CACHE_DIR = ".md_cache"
+
+# (year, group, sha256) -> (metadata, col_mapping), for the life of the process
+_parsed = {}
+# path -> (size, mtime_ns, sha256), so unchanged files are not re-hashed
+_hashes = {}
+
+
+def column_mapping(metadata):
+    """Map each ACS variable code to its '{code}_{desc_2}' column name."""
+    return {col: f"{col}_{desc}" for col, desc in
+            zip(metadata['column'], metadata['desc_2'])}
+
+
+def _file_sha256(path):
+    stat = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    sha256 = hash_file(path)
+    _hashes[path] = (stat.st_size, stat.st_mtime_ns, sha256)
+    return sha256
+
+
+def load_parsed_md(md_file, year, group, cache_dir=None, md=None):
+    """
+    Return the parsed metadata of an ACS group, parsing it at most once.
+
+    Results are kept in memory for the life of the process and, if
+    `cache_dir` is given, pickled there so later runs (and other worker
+    processes) can reuse them. Entries are keyed by year, group and the
+    SHA-256 of the metadata file, plus the preprocessing code version.
+
+    Parameters:
+    md_file (str or Path): Raw metadata JSON ('acs{year}_{group}_md.json')
+    year (int): ACS vintage
+    group (str): ACS group identifier (e.g. 'dp05')
+    cache_dir (str or Path): Optional directory for the on-disk cache
+    md (dict): The already-decoded contents of `md_file`, if the caller has
+               them, to avoid reading the file again on a cache miss
+
+    Returns:
+    tuple: (metadata, col_mapping) - the `parse_md` table and the column
+           mapping built from it. Treat both as read-only.
+    """
+    md_file = str(md_file)
+    sha256 = _file_sha256(md_file)
+    key = (int(year), group, sha256)
+
+    if key in _parsed:
+        return _parsed[key]
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"acs{year}_{group}_{sha256[:16]}_{code_version()}.pkl"
+        if cache_path.exists():
+            try:
+                metadata = pd.read_pickle(cache_path)
+                _parsed[key] = (metadata, column_mapping(metadata))
+                logger.debug(f"Loaded parsed metadata from {cache_path}")
+                return _parsed[key]
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable metadata cache {cache_path}: {e}")
+
+    if md is None:
+        with open(md_file, 'r') as f:
+            md = json.load(f)
+    metadata = parse_md(md)
+
+    if cache_path is not None:
+        os.makedirs(cache_path.parent, exist_ok=True)
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        metadata.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+
+    _parsed[key] = (metadata, column_mapping(metadata))
+    return _parsed[key]
+
+
+def get_acs_metadata(year, identifier, data_dir="data", cache_dir=None):
+    """
+    Parsed metadata and column mapping for `data/acs{year}_{identifier}_md.json`,
+    the metadata counterpart of `helpers.get_acs_data`.
+    """
+    md_file = Path(data_dir) / f"acs{year}_{identifier}_md.json"
+    return load_parsed_md(md_file, year, identifier, cache_dir)
+
+
+def clear_md_cache():
+    """Drop the in-memory cache (the on-disk cache is left alone)."""
+    _parsed.clear()
+    _hashes.clear()
@@ -0,0 +1,240 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[MOE]
+[Module with functions for margin of error propagation]
+[Matt Franchi]
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("acs.moe")
+
+# Published ACS margins of error are at the 90% confidence level
+Z_90 = 1.645
+MOE_SUFFIX = "_moe"
+
+
+def moe_column(name):
+    """Name of the margin of error column for an estimate column."""
+    return f"{name}{MOE_SUFFIX}"
+
+
+def moe_to_se(moe, z=Z_90):
+    """Standard error from a margin of error."""
+    return np.asarray(moe, dtype=float) / z
+
+
+def coefficient_of_variation(estimate, moe, z=Z_90):
+    """CV in percent; NaN where the estimate is zero."""
+    estimate = np.asarray(estimate, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = 100 * moe_to_se(moe, z) / np.abs(estimate)
+    return np.where(estimate == 0, np.nan, cv)
+
+
+def moe_sum(estimates, moes, axis=-1):
+    """
+    MOE of a sum (or difference) of estimates.
+
+    Follows the Census guidance: the root of the summed squared MOEs, except
+    that among components whose estimate is zero only the largest MOE is
+    counted.
+
+    Parameters:
+    estimates (array-like): Component estimates, components along `axis`
+    moes (array-like): Component MOEs, same shape as `estimates`
+    axis (int): Axis holding the components
+
+    Returns:
+    ndarray: MOE of the aggregate
+    """
+    estimates = np.asarray(estimates, dtype=float)
+    moes = np.asarray(moes, dtype=float)
+    is_zero = estimates == 0
+    squares = np.where(is_zero, 0.0, moes ** 2).sum(axis=axis)
+    zero_max = np.where(is_zero, moes, 0.0).max(axis=axis)
+    return np.sqrt(squares + zero_max ** 2)
+
+
+def moe_weighted_sum(weights, estimates, moes):
+    """
+    MOEs of weighted sums of estimates, e.g. tracts allocated to larger areas.
+
+    The `moe_sum` rule with every component scaled by its weight: the root of
+    the summed squares of weight x MOE, except that among components whose
+    estimate is zero only the largest weight x MOE is counted. With 0/1
+    weights this is `moe_sum` over each target's components. Missing
+    estimates or MOEs propagate.
+
+    Parameters:
+    weights (array-like or sparse matrix): targets x components
+    estimates (array-like): components x columns
+    moes (array-like): Component MOEs, same shape as `estimates`
+
+    Returns:
+    ndarray: targets x columns MOEs
+    """
+    weights = sparse.csr_matrix(weights, dtype=np.float64)
+    estimates = np.asarray(estimates, dtype=float)
+    moes = np.asarray(moes, dtype=float)
+    is_zero = estimates == 0
+    squares = weights.multiply(weights) @ np.where(is_zero, 0.0, moes ** 2)
+
+    zero_max = np.zeros_like(squares)
+    if is_zero.any():
+        # Largest scaled MOE among each target's zero-estimate components
+        zero_moes = np.where(is_zero, moes, 0.0)
+        for j in range(weights.shape[0]):
+            start, end = weights.indptr[j], weights.indptr[j + 1]
+            if end > start:
+                scaled = np.abs(weights.data[start:end, None]) * zero_moes[weights.indices[start:end]]
+                zero_max[j] = scaled.max(axis=0)
+    return np.sqrt(squares + zero_max ** 2)
+
+
+def moe_ratio(numerator, denominator, moe_numerator, moe_denominator):
+    """MOE of a ratio whose numerator is not a subset of its denominator."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = numerator / denominator
+        return (np.sqrt(np.asarray(moe_numerator, dtype=float) ** 2
+                        + ratio ** 2 * np.asarray(moe_denominator, dtype=float) ** 2)
+                / np.abs(denominator))
+
+
+def moe_proportion(numerator, denominator, moe_numerator, moe_denominator):
+    """
+    MOE of a proportion (numerator is a subset of the denominator).
+
+    Where the value under the square root is negative, the ratio formula is
+    used instead, as the Census guidance recommends.
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    moe_numerator = np.asarray(moe_numerator, dtype=float)
+    moe_denominator = np.asarray(moe_denominator, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        proportion = numerator / denominator
+        under = moe_numerator ** 2 - proportion ** 2 * moe_denominator ** 2
+        under = np.where(under < 0,
+                         moe_numerator ** 2 + proportion ** 2 * moe_denominator ** 2,
+                         under)
+        return np.sqrt(under) / np.abs(denominator)
+
+
+def moe_product(a, b, moe_a, moe_b):
+    """MOE of the product of two estimates."""
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    return np.sqrt(a ** 2 * np.asarray(moe_b, dtype=float) ** 2
+                   + b ** 2 * np.asarray(moe_a, dtype=float) ** 2)
+
+
+def _pairs(df, columns):
+    missing = [moe_column(col) for col in columns if moe_column(col) not in df.columns]
+    if missing:
+        raise KeyError(f"Missing margin of error columns: {missing}")
+    return df[list(columns)].to_numpy(dtype=float), \
+        df[[moe_column(col) for col in columns]].to_numpy(dtype=float)
+
+
+def derive_sums(df, groups):
+    """
+    Add summed estimates and their MOEs to an ACS frame.
+
+    The estimates and the non-zero squared MOEs of all groups come from one
+    product with a columns x groups indicator matrix, vectorized across
+    rows. When some estimates are zero, their largest MOE per group (see
+    `moe_weighted_sum`) takes one loop step per group, each vectorized
+    across rows.
+
+    Parameters:
+    df (DataFrame): Frame with estimate columns and their '{name}_moe' columns
+    groups (dict): New column name -> list of estimate columns to add up
+
+    Returns:
+    DataFrame: Copy of `df` with '{new}' and '{new}_moe' for every group
+    """
+    columns = sorted({col for members in groups.values() for col in members})
+    position = {col: i for i, col in enumerate(columns)}
+    estimates, moes = _pairs(df, columns)
+
+    weights = np.zeros((len(columns), len(groups)))
+    for j, members in enumerate(groups.values()):
+        weights[[position[col] for col in members], j] = 1.0
+
+    totals = estimates @ weights
+    # Groups are weighted sums over the columns of each row
+    group_moes = moe_weighted_sum(weights.T, estimates.T, moes.T).T
+
+    result = df.copy()
+    for j, name in enumerate(groups):
+        result[name] = totals[:, j]
+        result[moe_column(name)] = group_moes[:, j]
+    return result
+
+
+def derive_ratios(df, ratios, proportion=True):
+    """
+    Add ratios (or proportions) of estimates and their MOEs to an ACS frame.
+
+    Parameters:
+    df (DataFrame): Frame with estimate columns and their '{name}_moe' columns
+    ratios (dict): New column name -> (numerator column, denominator column)
+    proportion (bool): Use the proportion formula (numerator is a subset of
+                       the denominator); otherwise the ratio formula
+
+    Returns:
+    DataFrame: Copy of `df` with '{new}' and '{new}_moe' for every ratio
+    """
+    names = list(ratios)
+    numerators, moe_numerators = _pairs(df, [ratios[name][0] for name in names])
+    denominators, moe_denominators = _pairs(df, [ratios[name][1] for name in names])
+
+    formula = moe_proportion if proportion else moe_ratio
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = numerators / denominators
+    moes = formula(numerators, denominators, moe_numerators, moe_denominators)
+
+    result = df.copy()
+    for j, name in enumerate(names):
+        result[name] = values[:, j]
+        result[moe_column(name)] = moes[:, j]
+    return result
+
+
+def aggregate_moe(df, by, columns):
+    """
+    Sum estimates over groups of rows (e.g. tracts into boroughs) with MOEs.
+
+    Parameters:
+    df (DataFrame): Frame with estimate columns and their '{name}_moe' columns
+    by (str or array-like): Group labels, as for `DataFrame.groupby`
+    columns (list): Estimate columns to aggregate
+
+    Returns:
+    DataFrame: One row per group with each estimate and its '{name}_moe'
+    """
+    estimates, moes = _pairs(df, columns)
+    is_zero = estimates == 0
+    parts = pd.DataFrame(
+        np.hstack([estimates, np.where(is_zero, 0.0, moes ** 2), np.where(is_zero, moes, 0.0)]),
+        index=df.index,
+    )
+    grouped = parts.groupby(df[by] if isinstance(by, str) else by)
+    n = len(columns)
+    summed = grouped.sum()
+    sums = summed.to_numpy()
+    zero_max = grouped.max().to_numpy()[:, 2 * n:]
+
+    result = {}
+    for j, col in enumerate(columns):
+        result[col] = sums[:, j]
+        result[moe_column(col)] = np.sqrt(sums[:, n + j] + zero_max[:, j] ** 2)
+    return pd.DataFrame(result, index=summed.index)
@@ -0,0 +1,193 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Panel]
+[Module containing AcsPanel classes for panel]
+[Matt Franchi]
+"""
+
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.helpers import get_acs_data
+from audt_data.d03_src.pp.acs.compact import compact_acs
+
+logger = setup_logger("acs.panel")
+
+
+class AcsPanel:
+    """
+    Long ACS panel that keeps tract geometry once per GEOID.
+
+    Attributes:
+    geometry (GeoDataFrame): The base tract layer, one row per GEOID, in its
+                             original row and column order
+    data (DataFrame): ACS attributes indexed by (GEOID, year)
+    datasets (list): ACS dataset codes the attributes came from
+    """
+
+    def __init__(self, geometry, data, datasets=None):
+        if geometry['GEOID'].duplicated().any():
+            raise ValueError("geometry must have one row per GEOID")
+        if list(data.index.names) != ['GEOID', 'year']:
+            raise ValueError("data must be indexed by (GEOID, year)")
+        self.geometry = geometry
+        self.data = data
+        self.datasets = list(datasets or [])
+
+    @property
+    def years(self):
+        return sorted(self.data.index.get_level_values('year').unique())
+
+    def __repr__(self):
+        return (f"AcsPanel({len(self.geometry)} tracts, years={self.years}, "
+                f"{self.data.shape[1]} columns)")
+
+    def memory_usage(self):
+        """Deep memory usage in bytes, as {'geometry': ..., 'data': ...}."""
+        return {
+            'geometry': int(self.geometry.memory_usage(deep=True).sum()),
+            'data': int(self.data.memory_usage(deep=True).sum()),
+        }
+
+    def compact(self, report=False):
+        """
+        Panel with compact attribute dtypes (see `compact_acs`).
+
+        The geometry layer is shared, not copied. With report=True, returns
+        (panel, report).
+        """
+        data, details = compact_acs(self.data, report=True)
+        panel = AcsPanel(self.geometry, data, datasets=self.datasets)
+        return (panel, details) if report else panel
+
+    def to_geodataframe(self, years=None, columns=None):
+        """
+        Join attributes onto geometry, one row per (tract, year).
+
+        This is where geometry gets repeated, so only materialise the years
+        and columns you need. The layout matches `merge_acs_data`: the base
+        tract columns, then 'year', then the ACS columns, years in order.
+
+        Parameters:
+        years (list): Years to include; all years if None
+        columns (list): ACS columns to include; all columns if None
+
+        Returns:
+        GeoDataFrame: Wide per-year tract frame
+        """
+        years = self.years if years is None else list(years)
+        data = self.data if columns is None else self.data[list(columns)]
+
+        n_tracts = len(self.geometry)
+        result = self.geometry.iloc[np.tile(np.arange(n_tracts), len(years))]
+        result = result.reset_index(drop=True)
+        result['year'] = np.repeat(np.asarray(years, dtype=np.int64), n_tracts)
+
+        keys = pd.MultiIndex.from_arrays([result['GEOID'], result['year']])
+        result = result.join(data.reindex(keys).reset_index(drop=True))
+
+        result.attrs['acs_years'] = years
+        result.attrs['acs_datasets'] = self.datasets
+        return result
+
+    def to_parquet(self, directory):
+        """Write geometry (GeoParquet, WKB) and attributes to `directory`."""
+        directory = Path(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.geometry.to_parquet(directory / "geometry.parquet")
+        data = self.data.copy()
+        data.attrs['acs_datasets'] = self.datasets
+        data.to_parquet(directory / "data.parquet")
+
+    @classmethod
+    def read_parquet(cls, directory, columns=None):
+        """Load a panel written by `to_parquet`, optionally only some ACS columns."""
+        directory = Path(directory)
+        geometry = gpd.read_parquet(directory / "geometry.parquet")
+        data = pd.read_parquet(directory / "data.parquet", columns=columns)
+        return cls(geometry, data, datasets=data.attrs.get('acs_datasets'))
+
+
+def load_acs_pieces(years, acs_columns, jobs=None, executor=None, include_moe=False,
+                    data_dir="data"):
+    """
+    Load every (year, dataset) piece of a panel concurrently.
+
+    Parameters:
+    years (iterable): ACS vintages
+    acs_columns (dict): Dataset configuration, as for `merge_acs_data`
+    jobs (int): Number of loader threads; None uses one per core
+    executor (concurrent.futures.Executor): Optional executor to use instead
+                                            of a thread pool. It is not shut down.
+    include_moe (bool): Carry margins of error as '{name}_moe' columns
+    data_dir (str or Path): Directory with the raw ACS files
+
+    Returns:
+    dict: (year, dataset_code) -> output of `get_acs_data`
+    """
+    keys = [(year, dataset_code) for year in years for dataset_code in acs_columns]
+
+    def load(key):
+        year, dataset_code = key
+        return get_acs_data(year, dataset_code, acs_columns[dataset_code]['columns'],
+                            include_moe=include_moe, data_dir=data_dir)
+
+    if executor is None:
+        jobs = min(jobs or os.cpu_count() or 1, len(keys)) or 1
+        if jobs == 1:
+            return {key: load(key) for key in keys}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return dict(zip(keys, pool.map(load, keys)))
+    return dict(zip(keys, executor.map(load, keys)))
+
+
+def build_acs_panel(ct_nyc, year_start, year_end, acs_columns, jobs=None, executor=None,
+                    include_moe=False, data_dir="data"):
+    """
+    Build an `AcsPanel` for the tracts in `ct_nyc`.
+
+    Takes the same arguments as `merge_acs_data`, whose output is
+    `build_acs_panel(...).to_geodataframe()`. All (year, dataset) pieces are
+    loaded concurrently (see `load_acs_pieces`), aligned on the tract index
+    and combined in one concat per year, so the cost grows with the number
+    of cells rather than with repeated merges of a growing frame.
+    Attributes are kept for the tracts in `ct_nyc` only; tracts missing
+    from a dataset get NaN.
+
+    Returns:
+    AcsPanel: Geometry once per GEOID plus (GEOID, year)-indexed attributes
+    """
+    years = list(range(year_start, year_end + 1))
+    geoids = pd.Index(ct_nyc['GEOID'], name='GEOID')
+
+    counts = Counter(col for info in acs_columns.values() for col in info['columns'].values())
+    duplicated = sorted(col for col, n in counts.items() if n > 1)
+    if duplicated:
+        raise ValueError(f"Column names used by more than one dataset: {duplicated}")
+
+    pieces = load_acs_pieces(years, acs_columns, jobs=jobs, executor=executor,
+                             include_moe=include_moe, data_dir=data_dir)
+
+    yearly = []
+    for year in years:
+        wide = pd.concat(
+            [pieces.pop((year, dataset_code)).drop(columns='year').reindex(geoids)
+             for dataset_code in acs_columns],
+            axis=1,
+        )
+        wide.index = pd.MultiIndex.from_arrays(
+            [geoids, np.full(len(geoids), year, dtype=np.int64)], names=['GEOID', 'year'])
+        yearly.append(wide)
+
+    data = pd.concat(yearly)
+    panel = AcsPanel(ct_nyc.reset_index(drop=True), data, datasets=list(acs_columns))
+    logger.info(f"Built {panel!r}")
+    return panel
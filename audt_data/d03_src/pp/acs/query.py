@@ -0,0 +1,298 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Query]
+[Module containing AcsStore classes for querying the preprocessed ACS store]
+[Matt Franchi]
+"""
+
+import re
+import ast
+import operator
+from functools import reduce
+from pathlib import Path
+
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.store import PROCESSED, YEAR_PARTITIONING, dataset_name
+from audt_data.d03_src.pp.geo.nyc.counties import NYC_BOROUGHS
+
+logger = setup_logger("acs.query")
+
+KEYS = ["tract_id", "year"]
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+_QUOTED_NAME = re.compile(r"`([^`]+)`")
+
+
+def parse_filter(text):
+    """
+    Compile a filter string into an Arrow dataset expression.
+
+    Supports comparisons (chained too), 'in' / 'not in' lists, 'and', 'or',
+    'not' and parentheses, e.g. "year >= 2020 and median_income > 50000".
+    Column names that are not Python identifiers go in backticks, as in
+    `DataFrame.query`. Nothing is evaluated: the string is only parsed.
+
+    Returns:
+    tuple: (expression, set of referenced column names)
+    """
+    quoted = {}
+
+    def quote(match):
+        placeholder = f"__col{len(quoted)}"
+        quoted[placeholder] = match.group(1)
+        return placeholder
+
+    tree = ast.parse(_QUOTED_NAME.sub(quote, text).strip(), mode="eval")
+    fields = set()
+
+    def value(node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return [value(element) for element in node.elts]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -value(node.operand)
+        raise ValueError(f"Unsupported value in filter: {ast.dump(node)}")
+
+    def operand(node):
+        if isinstance(node, ast.Name):
+            name = quoted.get(node.id, node.id)
+            fields.add(name)
+            return ds.field(name)
+        return value(node)
+
+    def build(node):
+        if isinstance(node, ast.Expression):
+            return build(node.body)
+        if isinstance(node, ast.BoolOp):
+            combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+            return reduce(combine, (build(child) for child in node.values))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ~build(node.operand)
+        if isinstance(node, ast.Compare):
+            terms = []
+            left = operand(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = operand(comparator)
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    term = left.isin(right)
+                    terms.append(~term if isinstance(op, ast.NotIn) else term)
+                elif type(op) in _COMPARISONS:
+                    terms.append(_COMPARISONS[type(op)](left, right))
+                else:
+                    raise ValueError(f"Unsupported comparison in filter: {type(op).__name__}")
+                left = right
+            return reduce(operator.and_, terms)
+        if isinstance(node, ast.Name):
+            return operand(node)
+        raise ValueError(f"Unsupported filter syntax: {ast.dump(node)}")
+
+    return build(tree), fields
+
+
+def _borough_codes(boroughs):
+    """County FIPS codes for borough names or codes."""
+    by_name = {name.lower(): code for code, name in NYC_BOROUGHS.items()}
+    codes = []
+    for borough in [boroughs] if isinstance(boroughs, str) else boroughs:
+        code = by_name.get(str(borough).lower(), str(borough))
+        if code not in NYC_BOROUGHS:
+            raise ValueError(f"Unknown borough {borough!r}")
+        codes.append(code)
+    return codes
+
+
+class AcsStore:
+    """
+    Query interface over the partitioned Parquet store written by `batch_pp`
+    (see `store`).
+
+    Every dataset is scanned lazily through Arrow: year filters prune whole
+    partitions, other filters are pushed into the scan, and only the
+    requested columns are read, so a slice never loads the full panel.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._datasets = {}
+
+    def __repr__(self):
+        return f"AcsStore({str(self.root)!r}, datasets={self.datasets()})"
+
+    def datasets(self, kind=PROCESSED):
+        """Names of the datasets in the store."""
+        return sorted(path.name.split("=", 1)[1]
+                      for path in (self.root / kind).glob("dataset=*") if path.is_dir())
+
+    def dataset(self, identifier, kind=PROCESSED):
+        """The Arrow dataset for one ACS group."""
+        key = (kind, dataset_name(identifier))
+        if key not in self._datasets:
+            path = self.root / kind / f"dataset={key[1]}"
+            if not path.is_dir():
+                raise KeyError(f"No dataset {key[1]!r} in {self.root / kind}")
+            self._datasets[key] = ds.dataset(path, format="parquet",
+                                             partitioning=YEAR_PARTITIONING)
+        return self._datasets[key]
+
+    def schema(self, identifier, kind=PROCESSED):
+        return self.dataset(identifier, kind).schema
+
+    def years(self, identifier, kind=PROCESSED):
+        """Vintages available for a dataset, from the partition directories."""
+        path = self.root / kind / f"dataset={dataset_name(identifier)}"
+        return sorted(int(p.name.split("=", 1)[1]) for p in path.glob("year=*"))
+
+    def refresh(self):
+        """Forget cached dataset listings, e.g. after new files were written."""
+        self._datasets.clear()
+
+    def _expression(self, years=None, where=None, tracts=None, boroughs=None):
+        terms, fields = [], set()
+        if years is not None:
+            years = [years] if isinstance(years, int) else list(years)
+            terms.append(ds.field("year").isin(years))
+        if tracts is not None:
+            terms.append(ds.field("tract_id").isin([str(t) for t in tracts]))
+        if boroughs is not None:
+            counties = pc.utf8_slice_codeunits(ds.field("tract_id"), 0, 5)
+            terms.append(counties.isin(_borough_codes(boroughs)))
+        if where is not None:
+            if isinstance(where, str):
+                where, fields = parse_filter(where)
+            terms.append(where)
+        return (reduce(operator.and_, terms) if terms else None), fields
+
+    def scan(self, identifier, columns=None, years=None, where=None, tracts=None,
+             boroughs=None, kind=PROCESSED):
+        """
+        Read a filtered, projected slice of one dataset as an Arrow table.
+
+        Parameters:
+        identifier (str): ACS group, e.g. 'dp05'
+        columns (list): Columns to return besides tract_id and year; all if None
+        years (int or list): Vintages to keep
+        where (str or Expression): Filter, as a string (see `parse_filter`)
+                                   or an Arrow dataset expression
+        tracts (list): Tract GEOIDs to keep
+        boroughs (list): Borough names or county FIPS codes to keep
+
+        Returns:
+        pa.Table
+        """
+        dataset = self.dataset(identifier, kind)
+        expression, _ = self._expression(years, where, tracts, boroughs)
+        if columns is not None:
+            keys = KEYS if kind == PROCESSED else ["year"]
+            columns = keys + [col for col in columns if col not in keys]
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def query(self, identifiers, columns=None, years=None, where=None, tracts=None,
+              boroughs=None, attributes=None, attributes_on="GEOID", how="inner",
+              as_arrow=False):
+        """
+        Slice one or more datasets and join them on (tract_id, year).
+
+        Year, tract and borough filters are pushed into every dataset scan. A
+        `where` filter is pushed into the scans of the datasets that have all
+        the columns it uses (for inner joins) and applied after the join
+        otherwise. Each dataset only reads the requested columns it has.
+
+        Parameters:
+        identifiers (str or list): ACS group(s)
+        columns (list): Columns to return (from any of the datasets); all if None
+        years, where, tracts, boroughs: As for `scan`
+        attributes (DataFrame or GeoDataFrame): Tract attributes to join,
+                                                e.g. the tract layer
+        attributes_on (str): GEOID column of `attributes`
+        how (str): Arrow join type between datasets, e.g. 'inner', 'full outer'
+        as_arrow (bool): Return an Arrow table (not with `attributes`)
+
+        Returns:
+        DataFrame, GeoDataFrame (if `attributes` is one) or pa.Table, with
+        'tract_id' and 'year' columns
+        """
+        identifiers = [identifiers] if isinstance(identifiers, str) else list(identifiers)
+        base, _ = self._expression(years, None, tracts, boroughs)
+        condition, fields = self._expression(where=where) if where is not None else (None, set())
+        schemas = {identifier: set(self.schema(identifier).names) for identifier in identifiers}
+
+        # Filtering a single dataset's scan is equivalent to filtering after
+        # an inner join whenever that dataset has every column the filter uses
+        if condition is None:
+            push_into = set()
+        elif len(identifiers) == 1:
+            push_into = set(identifiers)
+        elif how == "inner" and fields:
+            push_into = {identifier for identifier in identifiers if fields <= schemas[identifier]}
+        else:
+            push_into = set()
+        filter_after = condition is not None and not push_into
+
+        tables = []
+        for identifier in identifiers:
+            names = schemas[identifier]
+            wanted = [col for col in (columns or self.schema(identifier).names)
+                      if col in names and col not in KEYS]
+            if filter_after:
+                wanted += [col for col in fields if col in names and col not in wanted + KEYS]
+            expression = base
+            if identifier in push_into:
+                expression = condition if expression is None else expression & condition
+            tables.append(self.dataset(identifier).to_table(columns=KEYS + wanted, filter=expression))
+
+        table = tables[0]
+        for other in tables[1:]:
+            table = table.join(other, keys=KEYS, join_type=how)
+        if filter_after:
+            table = table.filter(condition)
+            if columns is not None:
+                table = table.select(KEYS + [col for col in columns
+                                             if col in table.column_names and col not in KEYS])
+
+        if attributes is not None:
+            df = table.to_pandas()
+            attributes = attributes.assign(**{attributes_on: attributes[attributes_on].astype(str)})
+            merged = attributes.merge(df, left_on=attributes_on, right_on="tract_id", how="inner")
+            return merged.drop(columns="tract_id") if attributes_on != "tract_id" else merged
+        return table if as_arrow else table.to_pandas()
+
+    def sql(self, query, tables=None, as_arrow=False):
+        """
+        Run SQL over the store with DuckDB (optional dependency).
+
+        Every dataset is available as a view named after it (e.g. dp05),
+        backed by its Arrow dataset, so DuckDB pushes filters and
+        projections into the Parquet scan. `tables` adds more relations,
+        e.g. {'tracts': tract_attributes_df}.
+        """
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("AcsStore.sql needs duckdb; install it with "
+                              "'pip install duckdb', or use AcsStore.query") from e
+
+        con = duckdb.connect()
+        try:
+            for identifier in self.datasets():
+                con.register(identifier, self.dataset(identifier))
+            for name, table in (tables or {}).items():
+                if hasattr(table, "geometry"):
+                    # DuckDB cannot scan shapely geometries; pass them as WKB
+                    table = table.to_wkb()
+                con.register(name, table)
+            result = con.execute(query)
+            return result.arrow() if as_arrow else result.df()
+        finally:
+            con.close()
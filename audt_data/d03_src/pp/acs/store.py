@@ -0,0 +1,170 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Store]
+[Module with functions for store]
+[Matt Franchi]
+"""
+
+import os
+import json
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("acs.store")
+
+# Layout of the preprocessed Parquet store:
+#   {root}/processed/dataset={identifier}/year={year}/part-0.parquet
+#   {root}/metadata/dataset={identifier}/year={year}/part-0.parquet
+PROCESSED = "processed"
+METADATA = "metadata"
+OUTPUT_FORMATS = ("csv", "parquet")
+
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_SIZE = 64 * 1024  # rows
+
+# Partition keys are stored in the directory names, not in the files
+YEAR_PARTITIONING = ds.partitioning(pa.schema([("year", pa.int64())]), flavor="hive")
+
+
+def dataset_name(identifier):
+    """
+    Normalise a raw-file identifier to its ACS group name, so that
+    'dp05' and 'dp05_md' land in the same dataset= partition.
+    """
+    for suffix in ("_md", "_metadata"):
+        if identifier.endswith(suffix):
+            return identifier[: -len(suffix)]
+    return identifier
+
+
+def partition_dir(root, kind, identifier, year):
+    """Directory holding the Parquet file for one (kind, dataset, year)."""
+    return Path(root) / kind / f"dataset={dataset_name(identifier)}" / f"year={int(year)}"
+
+
+def acs_arrow_schema(df, metadata=None):
+    """
+    Build an explicit Arrow schema for a preprocessed ACS frame.
+
+    Integer and float columns keep the dtypes inferred by `parse_acs`; object
+    columns (tract ids, labels, metadata text) are stored as strings.
+
+    Parameters:
+    df (DataFrame): Frame to describe, with any index already reset
+    metadata (dict): Optional key/value pairs stored in the schema metadata
+
+    Returns:
+    pa.Schema: Schema to pass to `pa.Table.from_pandas`
+    """
+    fields = []
+    for col, dtype in df.dtypes.items():
+        if dtype.kind in "iubf":
+            arrow_type = pa.from_numpy_dtype(dtype)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(str(col), arrow_type))
+
+    if metadata:
+        metadata = {str(k): str(v) for k, v in metadata.items()}
+    return pa.schema(fields, metadata=metadata)
+
+
+def _stringify_objects(df):
+    """Object columns may hold dicts/lists (e.g. metadata 'values'); store them as JSON text."""
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        if not values.map(lambda x: x is None or isinstance(x, str)).all():
+            df[col] = values.map(
+                lambda x: x if x is None or isinstance(x, str) else json.dumps(x)
+            )
+    return df
+
+
+def write_acs_parquet(df, root, kind, identifier, year,
+                      compression=PARQUET_COMPRESSION,
+                      row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    Write one preprocessed ACS frame into the partitioned Parquet store.
+
+    Parameters:
+    df (DataFrame): Output of `parse_acs` (indexed by tract_id) or `parse_md`
+    root (str or Path): Root of the preprocessed store
+    kind (str): PROCESSED or METADATA
+    identifier (str): Dataset identifier taken from the raw filename
+    year (int): ACS vintage
+    compression (str): Parquet compression codec
+    row_group_size (int): Maximum number of rows per row group
+
+    Returns:
+    Path: Path of the written file
+    """
+    if kind == PROCESSED:
+        df = df.reset_index()
+    else:
+        df = df.reset_index(drop=True)
+    # Partition keys live in the path
+    df = _stringify_objects(df.drop(columns=["year", "dataset"], errors="ignore"))
+
+    schema = acs_arrow_schema(df, metadata={"audt.kind": kind,
+                                            "audt.dataset": dataset_name(identifier),
+                                            "audt.year": year})
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    out_dir = partition_dir(root, kind, identifier, year)
+    os.makedirs(out_dir, exist_ok=True)
+    output_path = out_dir / "part-0.parquet"
+
+    # Write next to the target and swap in, so readers never see a partial file
+    tmp_path = out_dir / f".part-0.parquet.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path, compression=compression,
+                   row_group_size=row_group_size)
+    os.replace(tmp_path, output_path)
+
+    return output_path
+
+
+def read_acs_parquet(root, identifier, years=None, columns=None, kind=PROCESSED):
+    """
+    Read preprocessed ACS data back from the partitioned Parquet store.
+
+    Parameters:
+    root (str or Path): Root of the preprocessed store
+    identifier (str): Dataset identifier (e.g. 'dp05')
+    years (int or list): Year(s) to read; all available years if None
+    columns (list): Columns to read; all columns if None
+    kind (str): PROCESSED or METADATA
+
+    Returns:
+    DataFrame: Processed data indexed by tract_id with a 'year' column, or
+               the metadata table with a 'year' column
+    """
+    base = Path(root) / kind
+    dataset = ds.dataset(base / f"dataset={dataset_name(identifier)}",
+                         format="parquet", partitioning=YEAR_PARTITIONING)
+
+    filter_expr = None
+    if years is not None:
+        years = [years] if isinstance(years, int) else list(years)
+        filter_expr = ds.field("year").isin(years)
+
+    if columns is not None:
+        columns = list(columns)
+        if kind == PROCESSED and "tract_id" not in columns:
+            columns = ["tract_id"] + columns
+        if "year" not in columns:
+            columns = columns + ["year"]
+
+    df = dataset.to_table(columns=columns, filter=filter_expr).to_pandas()
+
+    if kind == PROCESSED:
+        df = df.set_index("tract_id")
+    return df
@@ -0,0 +1,292 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Variables]
+[Module containing VariableIndex classes for searching ACS variables across vintages]
+[Matt Franchi]
+"""
+
+import os
+import re
+import pickle
+import argparse
+from bisect import bisect_left
+from pathlib import Path
+
+import pandas as pd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.manifest import code_version
+from audt_data.d03_src.pp.acs.md_cache import MD_CACHE_DIR, load_parsed_md
+
+logger = setup_logger("acs.variables")
+
+INDEX_NAME = "variable_index.pkl"
+INDEX_VERSION = 1
+
+_MD_FILE = re.compile(r"acs(\d{4})_(.+?)_md\.json$")
+_TOKEN = re.compile(r"[a-z0-9$]+")
+
+
+def label_path(row, levels):
+    """Label hierarchy below 'Estimate' as 'level!!level!!...'."""
+    return "!!".join(str(row[level]) for level in levels
+                     if isinstance(row[level], str) and row[level])
+
+
+def normalize_label(label):
+    """
+    Comparable form of a label path: lowercase, single spaces, and without
+    the trailing colons the Census Bureau added to many labels from 2019 on.
+    """
+    parts = (" ".join(part.split()).rstrip(":").strip().lower() for part in label.split("!!"))
+    return "!!".join(part for part in parts if part)
+
+
+def _tokens(text):
+    return _TOKEN.findall(text.lower())
+
+
+class VariableIndex:
+    """
+    Searchable index over the parsed metadata of many ACS vintages and groups.
+
+    Every estimate variable is a row (year, group, code, label), where label
+    is its hierarchy below 'Estimate' (desc_2!!desc_3!!...). Lookups by code,
+    label tokens and hierarchy prefix go through prebuilt dictionaries and a
+    sorted key list, so they do not touch the metadata tables.
+    """
+
+    def __init__(self, records):
+        records = records.sort_values(["group", "year", "code"], kind="stable")
+        self.years = [int(year) for year in records["year"]]
+        self.groups = list(records["group"])
+        self.codes = list(records["code"])
+        self.labels = list(records["label"])
+        self.keys = [normalize_label(label) for label in self.labels]
+
+        self._by_code = {}
+        self._by_token = {}
+        # (group, normalized label) -> {year: code}
+        self._by_key = {}
+        for row, (code, key, group, year) in enumerate(zip(self.codes, self.keys,
+                                                           self.groups, self.years)):
+            self._by_code.setdefault(code.upper(), []).append(row)
+            for token in set(_tokens(key)):
+                self._by_token.setdefault(token, set()).add(row)
+            self._by_key.setdefault((group, key), {})[year] = code
+
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self._sorted_keys = [self.keys[row] for row in order]
+        self._sorted_rows = order
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return (f"VariableIndex({len(self)} variables, groups={sorted(set(self.groups))}, "
+                f"years={sorted(set(self.years))})")
+
+    def _records(self, rows, years=None, group=None):
+        years = None if years is None else set(years)
+        return [
+            {"year": self.years[row], "group": self.groups[row],
+             "code": self.codes[row], "label": self.labels[row]}
+            for row in sorted(rows)
+            if (years is None or self.years[row] in years)
+            and (group is None or self.groups[row] == group)
+        ]
+
+    def lookup(self, code, years=None):
+        """Every vintage of a variable code, with its label in each year."""
+        return self._records(self._by_code.get(code.upper(), ()), years)
+
+    def search(self, text, years=None, group=None, limit=None):
+        """
+        Variables whose label contains every word of `text`.
+
+        Parameters:
+        text (str): Words to look for, e.g. 'median household income'
+        years (iterable): Restrict to these vintages
+        group (str): Restrict to one ACS group (e.g. 's1901')
+        limit (int): Maximum number of results
+
+        Returns:
+        list: Dicts with 'year', 'group', 'code' and 'label', ordered by
+              group, year and code
+        """
+        postings = [self._by_token.get(token, set()) for token in _tokens(text)]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        rows = set(postings[0])
+        for posting in postings[1:]:
+            rows &= posting
+            if not rows:
+                break
+        return self._records(rows, years, group)[:limit]
+
+    def prefix(self, label, years=None, group=None, limit=None):
+        """
+        Variables whose label path starts with `label`, e.g.
+        'Total population!!Male' for every age band under it.
+
+        Only whole levels match: '65 years' covers '65 years!!Male' but not
+        its sibling '65 years and over'.
+        """
+        key = normalize_label(label)
+        child = f"{key}!!"
+        start = bisect_left(self._sorted_keys, key)
+        rows = []
+        for position in range(start, len(self._sorted_keys)):
+            candidate = self._sorted_keys[position]
+            if not candidate.startswith(key):
+                break
+            # Siblings that extend the text ('65 years and over') sort
+            # among the children, so skip them rather than stop
+            if candidate == key or candidate.startswith(child):
+                rows.append(self._sorted_rows[position])
+        return self._records(rows, years, group)[:limit]
+
+    def resolve(self, label, group, years=None):
+        """
+        Code of the variable with this exact label path in each year.
+
+        Labels are compared in `normalize_label` form, so case, spacing and
+        trailing colons do not matter.
+
+        Returns:
+        dict: year -> code, for the years (of `years`, if given) that have
+              the variable
+        """
+        codes = self._by_key.get((group, normalize_label(label)), {})
+        if years is None:
+            return dict(codes)
+        return {year: codes[year] for year in years if year in codes}
+
+    def column_mappings(self, group, concepts, years):
+        """
+        Per-year column mappings for a set of concepts.
+
+        Variable codes are renumbered between vintages; resolving each
+        concept by its label in every year keeps the output columns
+        consistent across a year range.
+
+        Parameters:
+        group (str): ACS group
+        concepts (dict): Output column name -> label path
+        years (iterable): Vintages
+
+        Returns:
+        dict: year -> {code: column name}, suitable as `cols_to_keep` for
+              `get_acs_data`. Concepts missing in a year are logged and left
+              out of that year's mapping.
+        """
+        mappings = {year: {} for year in years}
+        for name, label in concepts.items():
+            codes = self.resolve(label, group, years)
+            missing = [year for year in mappings if year not in codes]
+            if missing:
+                logger.warning(f"'{label}' ({name}) not found in {group} for {missing}")
+            for year, code in codes.items():
+                mappings[year][code] = name
+        return mappings
+
+    def to_frame(self):
+        """The indexed variables as a DataFrame."""
+        return pd.DataFrame({"year": self.years, "group": self.groups,
+                             "code": self.codes, "label": self.labels})
+
+
+def _md_files(md_dir):
+    files = []
+    for path in sorted(Path(md_dir).glob("acs*_md.json")):
+        match = _MD_FILE.search(path.name)
+        if match:
+            files.append((int(match.group(1)), match.group(2), path))
+    return files
+
+
+def _signature(files):
+    return [(path.name, os.stat(path).st_size, os.stat(path).st_mtime_ns) for _, _, path in files]
+
+
+def build_variable_index(md_dir, cache_dir=None):
+    """
+    Build a `VariableIndex` from every 'acs{year}_{group}_md.json' in `md_dir`.
+
+    Metadata goes through `load_parsed_md`, so files already parsed (in this
+    process or into `cache_dir`) are not parsed again.
+    """
+    tables = []
+    for year, group, path in _md_files(md_dir):
+        metadata, _ = load_parsed_md(path, year, group, cache_dir=cache_dir)
+        levels = [col for col in metadata.columns if col.startswith("desc_") and col != "desc_1"]
+        levels.sort(key=lambda col: int(col.split("_")[1]))
+        tables.append(pd.DataFrame({
+            "year": year,
+            "group": group,
+            "code": metadata["column"].to_numpy(),
+            "label": [label_path(row, levels) for row in metadata[levels].to_dict("records")],
+        }))
+    if not tables:
+        raise FileNotFoundError(f"No ACS metadata files in {md_dir}")
+    return VariableIndex(pd.concat(tables, ignore_index=True))
+
+
+def load_variable_index(md_dir, cache_dir=None, rebuild=False):
+    """
+    Load the persisted variable index for `md_dir`, rebuilding it if any
+    metadata file was added, removed or changed (or the parsing code did).
+
+    Parameters:
+    md_dir (str or Path): Directory with the raw metadata files
+    cache_dir (str or Path): Where the index and parsed metadata are kept;
+                             defaults to {md_dir}/.md_cache
+    rebuild (bool): Rebuild even if the persisted index is current
+
+    Returns:
+    VariableIndex
+    """
+    cache_dir = Path(cache_dir) if cache_dir is not None else Path(md_dir) / MD_CACHE_DIR
+    index_path = cache_dir / INDEX_NAME
+    signature = (INDEX_VERSION, code_version(), _signature(_md_files(md_dir)))
+
+    if index_path.exists() and not rebuild:
+        try:
+            with open(index_path, "rb") as f:
+                stored_signature, index = pickle.load(f)
+            if stored_signature == signature:
+                return index
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable variable index {index_path}: {e}")
+
+    index = build_variable_index(md_dir, cache_dir=cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = index_path.with_name(f".{INDEX_NAME}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    logger.success(f"Saved {index!r} to {index_path}")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search ACS variables across vintages")
+    parser.add_argument("query", help="Words in the label, a variable code, or a label prefix")
+    parser.add_argument("--md-dir", required=True, help="Directory with acs{year}_{group}_md.json files")
+    parser.add_argument("--group", default=None)
+    parser.add_argument("--years", type=int, nargs=2, default=None, metavar=("START", "END"))
+    parser.add_argument("--prefix", action="store_true", help="Treat the query as a label prefix")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    index = load_variable_index(args.md_dir)
+    years = range(args.years[0], args.years[1] + 1) if args.years else None
+    if args.prefix:
+        matches = index.prefix(args.query, years=years, group=args.group, limit=args.limit)
+    else:
+        matches = index.lookup(args.query, years=years) or \
+            index.search(args.query, years=years, group=args.group, limit=args.limit)
+    for match in matches:
+        print(f"{match['year']}  {match['group']:<8} {match['code']:<14} {match['label']}")
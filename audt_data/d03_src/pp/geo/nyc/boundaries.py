@@ -0,0 +1,155 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Boundaries]
+[Module with functions for ingesting and loading NYC boundary layers as GeoParquet]
+[Matt Franchi]
+"""
+
+import os
+import argparse
+from pathlib import Path
+
+import geopandas as gpd
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+
+logger = setup_logger("nyc-boundaries")
+
+# Boundary layers saved by d04_scripts/geo/nyc/pull.sh
+LAYERS = ("ct-nyc-2020", "ct-nyc-wi-2020", "cb-nyc-2020", "cb-nyc-wi-2020")
+
+# Projections stored for every layer: lon/lat as downloaded, and NY State
+# Plane (feet), which the DEM and all area computations use
+CRSES = ("EPSG:4326", "EPSG:2263")
+DEFAULT_CRS = "EPSG:2263"
+
+# Rows per Parquet row group. Rows are Hilbert-sorted, so each row group
+# covers a compact area and a bbox read skips the others by their bbox
+# statistics
+ROW_GROUP_SIZE = 1024
+
+
+def geo_dir():
+    """Directory of the NYC boundary layers."""
+    return Path(get_repo_root()) / "audt_data" / "d01_data" / "geo" / "nyc"
+
+
+def parquet_path(layer, crs=DEFAULT_CRS, directory=None):
+    """Path of the GeoParquet copy of `layer` in `crs`, e.g. parquet/ct-nyc-2020.2263.parquet."""
+    epsg = crs.split(":")[-1]
+    return Path(directory or geo_dir() / "parquet") / f"{layer}.{epsg}.parquet"
+
+
+def write_geoparquet(gdf, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write `gdf` as GeoParquet (WKB) with a bbox covering column, its rows
+    sorted along a Hilbert curve so row groups are spatially compact.
+    """
+    order = gdf.geometry.hilbert_distance().argsort(kind="stable")
+    gdf = gdf.iloc[order].reset_index(drop=True)
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    # The bbox covering column is part of GeoParquet 1.1
+    gdf.to_parquet(path, index=False, compression="zstd", write_covering_bbox=True,
+                   schema_version="1.1.0", row_group_size=row_group_size)
+    return path
+
+
+def ingest_layer(layer, source_dir=None, output_dir=None, crses=CRSES, force=False,
+                 row_group_size=ROW_GROUP_SIZE):
+    """
+    Convert a boundary GeoJSON to GeoParquet, once per projection.
+
+    Copies newer than the GeoJSON are kept unless `force`.
+
+    Parameters:
+    layer (str): Layer name, e.g. 'ct-nyc-2020' (see LAYERS)
+    source_dir (str or Path): Directory of {layer}.geojson; defaults to `geo_dir()`
+    output_dir (str or Path): Defaults to {source_dir}/parquet
+    crses (iterable): Projections to write
+    force (bool): Rewrite up-to-date copies
+    row_group_size (int): Rows per row group
+
+    Returns:
+    list: Paths of the GeoParquet files
+    """
+    source_dir = Path(source_dir or geo_dir())
+    source = source_dir / f"{layer}.geojson"
+    output_dir = Path(output_dir or source_dir / "parquet")
+    paths = [parquet_path(layer, crs, output_dir) for crs in crses]
+
+    source_mtime = os.stat(source).st_mtime_ns
+    if not force and all(path.exists() and os.stat(path).st_mtime_ns >= source_mtime for path in paths):
+        logger.debug(f"{layer} GeoParquet is up to date")
+        return paths
+
+    logger.info(f"Reading {source}")
+    gdf = gpd.read_file(source)
+    for crs, path in zip(crses, paths):
+        write_geoparquet(gdf.to_crs(crs), path, row_group_size=row_group_size)
+        logger.success(f"Saved {len(gdf)} {layer} features in {crs} to {path}")
+    return paths
+
+
+def ingest_boundaries(layers=LAYERS, source_dir=None, output_dir=None, crses=CRSES, force=False):
+    """
+    Ingest every boundary layer (see `ingest_layer`).
+
+    Returns:
+    dict: Layer -> list of GeoParquet paths
+    """
+    return {layer: ingest_layer(layer, source_dir, output_dir, crses, force) for layer in layers}
+
+
+def read_boundaries(path, columns=None, bbox=None):
+    """
+    Read a boundary file: GeoParquet through `gpd.read_parquet` (with
+    `columns` and `bbox` pushed down), anything else through `gpd.read_file`.
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        if columns is not None:
+            columns = list(dict.fromkeys([*columns, "geometry"]))
+        return gpd.read_parquet(path, columns=columns, bbox=bbox)
+    gdf = gpd.read_file(path, bbox=bbox)
+    return gdf if columns is None else gdf[list(dict.fromkeys([*columns, gdf.geometry.name]))]
+
+
+def load_boundaries(layer, crs=DEFAULT_CRS, bbox=None, columns=None, directory=None):
+    """
+    Load a boundary layer from its GeoParquet copy, ingesting it first if needed.
+
+    Only the row groups whose bbox statistics overlap `bbox` are read, then
+    only rows whose bbox overlaps it; rows are not clipped or tested for
+    exact intersection.
+
+    Parameters:
+    layer (str): Layer name (see LAYERS)
+    crs (str): One of CRSES
+    bbox (tuple): (minx, miny, maxx, maxy) in `crs`
+    columns (list): Columns to read besides the geometry; all if None
+    directory (str or Path): Directory of {layer}.geojson; defaults to `geo_dir()`
+
+    Returns:
+    GeoDataFrame
+    """
+    if crs not in CRSES:
+        raise ValueError(f"crs must be one of {CRSES}, got {crs}")
+    source_dir = Path(directory or geo_dir())
+    path = parquet_path(layer, crs, source_dir / "parquet")
+    source = source_dir / f"{layer}.geojson"
+    if not path.exists() or (source.exists() and os.stat(source).st_mtime_ns > os.stat(path).st_mtime_ns):
+        ingest_layer(layer, source_dir)
+    return read_boundaries(path, columns=columns, bbox=bbox)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the NYC boundary GeoJSONs to GeoParquet")
+    parser.add_argument("layers", nargs="*", default=list(LAYERS))
+    parser.add_argument("--dir", default=None, help="Directory of the GeoJSONs (default: d01_data/geo/nyc)")
+    parser.add_argument("--force", action="store_true", help="Rewrite up-to-date copies")
+    args = parser.parse_args()
+
+    ingest_boundaries(args.layers, source_dir=args.dir, force=args.force)
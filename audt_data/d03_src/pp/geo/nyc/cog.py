@@ -0,0 +1,158 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Cog]
+[Module with functions for cloud-optimized topology rasters with overviews]
+[Matt Franchi]
+"""
+
+import os
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+
+logger = setup_logger("nyc-topology-cog")
+
+# Overview decimation factors; on the 1ft DEM these are 2, 4, 10, 20, 50 and
+# 100 ft pixels
+OVERVIEW_FACTORS = (2, 4, 10, 20, 50, 100)
+
+BLOCKSIZE = 512
+
+COG_NAME = "topology_nyc_cog.tif"
+
+
+def make_cog(input_path, output_path, factors=OVERVIEW_FACTORS, resampling="average",
+             blocksize=BLOCKSIZE, compress="deflate", jobs=None):
+    """
+    Convert a raster to a cloud-optimized GeoTIFF with internal overviews.
+
+    The raster is first copied to a tiled, compressed GeoTIFF next to the
+    output, overviews are built into that copy, and GDAL's COG driver then
+    lays tiles and overviews out so that any level can be read on its own.
+    GDAL streams all three steps, so the full-resolution DEM never has to
+    fit in memory.
+
+    Parameters:
+    input_path (str or Path): Source raster, e.g. the 1ft NYC DEM
+    output_path (str or Path): COG to write
+    factors (iterable): Overview decimation factors
+    resampling (str): Overview resampling method
+    blocksize (int): Tile size in pixels
+    compress (str): GeoTIFF compression
+    jobs (int): GDAL threads for compression and overviews; None for one per CPU
+
+    Returns:
+    Path: `output_path`
+    """
+    output_path = Path(output_path)
+    os.makedirs(output_path.parent, exist_ok=True)
+    staging_path = output_path.with_name(f".{output_path.stem}.staging.tif")
+    factors = sorted(int(factor) for factor in factors)
+    threads = jobs or "ALL_CPUS"
+
+    with rasterio.Env(GDAL_NUM_THREADS=threads, GDAL_CACHEMAX=512 * 2**20):
+        try:
+            logger.info(f"Tiling {input_path}")
+            rasterio.shutil.copy(input_path, staging_path, driver="GTiff", TILED=True,
+                                 BLOCKXSIZE=blocksize, BLOCKYSIZE=blocksize, COMPRESS=compress,
+                                 BIGTIFF="IF_SAFER")
+            logger.info(f"Building overviews {factors} ({resampling})")
+            with rasterio.open(staging_path, "r+") as dst:
+                dst.build_overviews(factors, Resampling[resampling])
+                dst.update_tags(ns="rio_overview", resampling=resampling)
+            logger.info(f"Writing cloud-optimized GeoTIFF to {output_path}")
+            rasterio.shutil.copy(staging_path, output_path, driver="COG", BLOCKSIZE=blocksize,
+                                 COMPRESS=compress, OVERVIEWS="FORCE_USE_EXISTING",
+                                 BIGTIFF="IF_SAFER", NUM_THREADS=threads)
+        finally:
+            if staging_path.exists():
+                os.remove(staging_path)
+
+    logger.success(f"Saved cloud-optimized GeoTIFF with overviews {factors} to {output_path}")
+    return output_path
+
+
+def native_resolution(src):
+    """Pixel width of an open raster, in CRS units."""
+    return abs(src.transform.a)
+
+
+def overview_level(src, resolution):
+    """
+    The overview level of an open raster to read for `resolution`.
+
+    This is the coarsest level that is still at least as fine as
+    `resolution`, so a reader only ever aggregates further and never
+    upsamples. None means the full-resolution raster.
+
+    Parameters:
+    src (DatasetReader): Raster opened at full resolution
+    resolution (float): Requested pixel size, in CRS units
+
+    Returns:
+    tuple: (level or None, decimation factor of that level)
+    """
+    factor = resolution / native_resolution(src)
+    level, chosen = None, 1
+    for i, overview in enumerate(src.overviews(1)):
+        if overview <= factor * (1 + 1e-9) and overview > chosen:
+            level, chosen = i, overview
+    return level, chosen
+
+
+def resolution_level(path, resolution):
+    """Overview level of the raster at `path` to read for `resolution` (None for full resolution)."""
+    if resolution is None:
+        return None
+    with rasterio.open(path) as src:
+        level, factor = overview_level(src, resolution)
+        if factor * native_resolution(src) != resolution:
+            logger.debug(f"No overview of {path} at {resolution}; using factor {factor}")
+    return level
+
+
+@contextmanager
+def open_at_resolution(path, resolution=None):
+    """
+    Open a raster at the overview level matching `resolution` (see
+    `overview_level`); the dataset then looks like a raster of that
+    resolution, so reads are of precomputed pixels rather than a resample
+    of the full raster.
+
+    Parameters:
+    path (str or Path): Raster, ideally a COG from `make_cog`
+    resolution (float): Requested pixel size in CRS units; None for full resolution
+
+    Yields:
+    DatasetReader
+    """
+    with rasterio.open(path, overview_level=resolution_level(path, resolution)) as src:
+        yield src
+
+
+def cog_path():
+    """Default location of the topology COG."""
+    return Path(get_repo_root()) / "audt_data" / "d01_data" / "geo" / "nyc" / COG_NAME
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the NYC DEM to a cloud-optimized GeoTIFF")
+    parser.add_argument("--input", default=None,
+                        help="Source raster (default: d01_data/geo/nyc/DEM_LiDAR_1ft_2010_Improved_NYC_int.tif)")
+    parser.add_argument("--output", default=None, help=f"Output COG (default: d01_data/geo/nyc/{COG_NAME})")
+    parser.add_argument("--factors", type=int, nargs="+", default=list(OVERVIEW_FACTORS))
+    parser.add_argument("--resampling", default="average")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else cog_path()
+    source = args.input or output.parent / "DEM_LiDAR_1ft_2010_Improved_NYC_int.tif"
+    make_cog(source, output, factors=args.factors, resampling=args.resampling, jobs=args.jobs)
@@ -0,0 +1,28 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Counties]
+[Module containing constants for the NYC counties and boroughs]
+[Matt Franchi]
+"""
+
+# Kept free of imports, so light modules (e.g. the ACS query layer) can use
+# these without loading the geospatial stack
+
+# County FIPS (state 36) -> borough
+NYC_BOROUGHS = {
+    "36005": "Bronx",
+    "36047": "Brooklyn",
+    "36061": "Manhattan",
+    "36081": "Queens",
+    "36085": "Staten Island",
+}
+
+# County FIPS (state 36) -> county name, as in Census geography names
+COUNTY_NAMES = {
+    "36005": "Bronx",
+    "36047": "Kings",
+    "36061": "New York",
+    "36081": "Queens",
+    "36085": "Richmond",
+}
@@ -0,0 +1,398 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Crosswalk]
+[Module containing Crosswalk classes for rolling tracts up to larger geographies]
+[Matt Franchi]
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.geo.nyc.boundaries import read_boundaries
+from audt_data.d03_src.pp.geo.nyc.counties import NYC_BOROUGHS
+from audt_data.d03_src.pp.acs.moe import MOE_SUFFIX, moe_column, moe_weighted_sum
+
+logger = setup_logger("nyc-crosswalk")
+
+# Areas are measured in NY State Plane (feet)
+AREA_CRS = "EPSG:2263"
+
+
+class Crosswalk:
+    """
+    Weighted mapping from source units (tracts) to target units.
+
+    Attributes:
+    sources (Index): Source GEOIDs, in the column order of `weights`
+    targets (Index): Target identifiers, in the row order of `weights`
+    weights (csr_matrix): targets x sources; entry (j, i) is the share of
+                          source i allocated to target j, so every column
+                          sums to 1 (or 0 for sources outside all targets)
+    method (str): How the shares were computed
+    """
+
+    def __init__(self, sources, targets, weights, method="assignment"):
+        weights = sparse.csr_matrix(weights, dtype=np.float64)
+        if weights.shape != (len(targets), len(sources)):
+            raise ValueError(f"weights has shape {weights.shape}, expected "
+                             f"({len(targets)}, {len(sources)})")
+        self.sources = pd.Index(sources, name="GEOID")
+        self.targets = pd.Index(targets, name="target")
+        self.weights = weights
+        self.method = method
+
+    def __repr__(self):
+        return (f"Crosswalk({len(self.sources)} sources -> {len(self.targets)} targets, "
+                f"method={self.method!r}, nnz={self.weights.nnz})")
+
+    def _cube(self, data, columns):
+        """
+        Scatter (GEOID[, year])-indexed rows into a sources x years x columns
+        array, positionally; rows for unknown GEOIDs are ignored and missing
+        sources are NaN.
+        """
+        if data.index.duplicated().any():
+            # Repeated rows would overwrite each other in the scatter
+            duplicates = data.index[data.index.duplicated()].unique()
+            raise ValueError(f"{len(duplicates)} duplicate index entries, e.g. {duplicates[0]!r}; "
+                             f"index by GEOID, or by (GEOID, year) for several years")
+        if isinstance(data.index, pd.MultiIndex):
+            geoids = data.index.get_level_values("GEOID")
+            year_codes, years = pd.factorize(data.index.get_level_values("year"), sort=True)
+        else:
+            geoids = data.index
+            year_codes, years = np.zeros(len(data), dtype=np.intp), None
+        rows = self.sources.get_indexer(geoids)
+        known = rows >= 0
+        missing = len(self.sources) - len(np.unique(rows[known]))
+        if missing:
+            logger.warning(f"{missing} crosswalk sources are missing from the data")
+
+        columns = list(columns)
+        block = data if columns == list(data.columns) else data[columns]
+        values = block.to_numpy(dtype=np.float64)
+        shape = (len(self.sources), 1 if years is None else len(years), len(columns))
+        if len(values) == shape[0] * shape[1]:
+            # Complete panels in (source, year) or (year, source) order, as
+            # built by `build_acs_panel`, need no scatter
+            order = np.arange(len(values))
+            if np.array_equal(rows * shape[1] + year_codes, order):
+                return values.reshape(shape), years
+            if np.array_equal(year_codes * shape[0] + rows, order):
+                return values.reshape(shape[1], shape[0], shape[2]).transpose(1, 0, 2), years
+
+        cube = np.full(shape, np.nan)
+        cube[rows[known], year_codes[known]] = values[known]
+        return cube, years
+
+    def _matmul(self, weights, cube):
+        n_sources, n_years, n_columns = cube.shape
+        if not cube.flags.c_contiguous:
+            # Year-major view: multiply each year's contiguous block rather
+            # than copying the whole cube into source-major order
+            return np.stack([weights @ cube[:, year] for year in range(n_years)], axis=1)
+        return (weights @ cube.reshape(n_sources, -1)).reshape(-1, n_years, n_columns)
+
+    def _aggregate(self, data, extensive, moes, intensive, intensive_weight):
+        """Roll up the column blocks of `data`; returns (targets x years x columns, years)."""
+        cube, years = self._cube(data, extensive + moes + intensive
+                                 + ([intensive_weight] if intensive_weight else []))
+        n_ext, n_moe, n_int = len(extensive), len(moes), len(intensive)
+
+        parts = [self._matmul(self.weights, cube[:, :, :n_ext])]
+        if moes:
+            # Estimates of the MOE columns, for the zero-estimate rule
+            paired = [extensive.index(col[:-len(MOE_SUFFIX)]) for col in moes]
+            n_sources, n_years = cube.shape[:2]
+            estimates = cube[:, :, paired].reshape(n_sources, -1)
+            margins = cube[:, :, n_ext:n_ext + n_moe].reshape(n_sources, -1)
+            parts.append(moe_weighted_sum(self.weights, estimates, margins)
+                         .reshape(-1, n_years, n_moe))
+        if intensive:
+            values = cube[:, :, n_ext + n_moe:n_ext + n_moe + n_int]
+            factors = cube[:, :, -1:] if intensive_weight else np.ones_like(values[:, :, :1])
+            # Sources without a value drop out of both sums
+            factors = np.where(np.isnan(values), 0.0, factors)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parts.append(self._matmul(self.weights, np.nan_to_num(values * factors))
+                             / self._matmul(self.weights, factors))
+        return np.concatenate(parts, axis=2), years
+
+    @staticmethod
+    def _split(data, extensive, intensive):
+        if extensive is None and intensive is None:
+            extensive = [col for col, dtype in data.dtypes.items()
+                         if pd.api.types.is_numeric_dtype(dtype)
+                         and col != "year" and not str(col).endswith(MOE_SUFFIX)]
+        columns = data.columns
+        extensive = list(extensive or [])
+        moes = [moe_column(col) for col in extensive if moe_column(col) in columns]
+        return extensive, moes, list(intensive or [])
+
+    def rollup(self, df, extensive=None, intensive=None, intensive_weight=None):
+        """
+        Aggregate a tract-indexed frame to the targets.
+
+        Counts (extensive variables) are allocated by the crosswalk shares and
+        summed: one sparse product over the whole column block. Margins of
+        error ('{name}_moe' columns next to an extensive variable) are
+        combined by `moe.moe_weighted_sum`: the root of the summed,
+        share-scaled squares, counting only the largest of the sources with
+        a zero estimate. Rates, medians and other intensive variables become
+        a weighted mean, with weights share x `intensive_weight` (e.g.
+        population; 1 if None).
+        Missing values propagate for counts and are skipped for means.
+
+        Parameters:
+        df (DataFrame): Indexed by source GEOID
+        extensive (list): Count columns; all numeric columns except 'year'
+                          and MOEs if both `extensive` and `intensive` are None
+        intensive (list): Columns to average
+        intensive_weight (str): Column of `df` to weight the average by
+
+        Returns:
+        DataFrame: Indexed by target
+        """
+        extensive, moes, intensive = self._split(df, extensive, intensive)
+        result, _ = self._aggregate(df, extensive, moes, intensive, intensive_weight)
+        return pd.DataFrame(result[:, 0], index=self.targets,
+                            columns=extensive + moes + intensive)
+
+    def rollup_panel(self, panel, extensive=None, intensive=None, intensive_weight=None):
+        """
+        Aggregate an `AcsPanel` (or a (GEOID, year)-indexed frame) to the targets.
+
+        Takes the same column arguments as `rollup`. All years are rolled up
+        together: the panel is scattered into a tracts x (year, variable)
+        block and multiplied once.
+
+        Returns:
+        DataFrame: Indexed by (target, year)
+        """
+        data = getattr(panel, "data", panel)
+        extensive, moes, intensive = self._split(data, extensive, intensive)
+        result, years = self._aggregate(data, extensive, moes, intensive, intensive_weight)
+        index = pd.MultiIndex.from_product([self.targets, years], names=["target", "year"])
+        return pd.DataFrame(result.reshape(len(index), -1), index=index,
+                            columns=extensive + moes + intensive)
+
+    def save(self, path):
+        """Write the crosswalk to a .npz file."""
+        path = Path(path)
+        os.makedirs(path.parent, exist_ok=True)
+        weights = self.weights.tocoo()
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            sources=self.sources.to_numpy(dtype=str),
+            targets=self.targets.to_numpy(dtype=str),
+            row=weights.row, col=weights.col, data=weights.data,
+            method=np.array(self.method),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a crosswalk written by `save`."""
+        with np.load(path, allow_pickle=False) as f:
+            weights = sparse.coo_matrix((f["data"], (f["row"], f["col"])),
+                                        shape=(len(f["targets"]), len(f["sources"])))
+            return cls(f["sources"], f["targets"], weights, method=str(f["method"]))
+
+
+def assignment_crosswalk(sources, targets, method="assignment"):
+    """
+    Crosswalk for sources that nest in exactly one target.
+
+    Parameters:
+    sources (array-like): Source GEOIDs
+    targets (array-like): Target of each source, aligned with `sources`;
+                          missing targets leave the source unassigned
+
+    Returns:
+    Crosswalk
+    """
+    sources = pd.Index(sources)
+    targets = pd.Series(np.asarray(targets, dtype=object))
+    assigned = targets.notna().to_numpy()
+    codes, uniques = pd.factorize(targets[assigned], sort=True)
+    weights = sparse.coo_matrix(
+        (np.ones(len(codes)), (codes, np.flatnonzero(assigned))),
+        shape=(len(uniques), len(sources)),
+    )
+    return Crosswalk(sources, uniques, weights, method=method)
+
+
+def borough_crosswalk(geoids):
+    """Crosswalk from NYC tract GEOIDs to boroughs, from their county FIPS."""
+    geoids = pd.Index(geoids).astype(str)
+    return assignment_crosswalk(geoids, geoids.str[:5].map(NYC_BOROUGHS), method="borough")
+
+
+def _shares(codes_target, codes_source, amounts, n_targets, n_sources):
+    """targets x sources matrix of `amounts`, each column scaled to sum to 1."""
+    matrix = sparse.coo_matrix((amounts, (codes_target, codes_source)),
+                               shape=(n_targets, n_sources)).tocsc()
+    matrix.sum_duplicates()
+    totals = np.asarray(matrix.sum(axis=0)).ravel()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(totals > 0, 1.0 / totals, 0.0)
+    return matrix @ sparse.diags(scale)
+
+
+def overlay_crosswalk(source, target, target_id, source_id="GEOID",
+                      weight_points=None, weight_column=None, min_share=1e-6):
+    """
+    Crosswalk from source polygons to overlapping target polygons.
+
+    Every source is split across the targets it intersects. By default the
+    shares are the intersection areas ("areal interpolation"). With
+    `weight_points` (e.g. census block centroids with a population column)
+    the shares are the summed point weights that fall in each intersection,
+    which follows where people live rather than land area; sources with no
+    weight fall back to area shares. Each source's shares are rescaled to
+    sum to 1, so counts are conserved, and shares below `min_share` (edge
+    slivers from imperfectly aligned boundaries) are dropped.
+
+    All intersections are found with one bulk spatial-index query and
+    measured in one vectorized call, instead of a `gpd.overlay` per use.
+
+    Parameters:
+    source (GeoDataFrame): Source polygons, e.g. tracts
+    target (GeoDataFrame): Target polygons, e.g. NTAs, community districts
+                           or ZCTAs
+    target_id (str): Identifier column of `target`
+    source_id (str): Identifier column of `source`
+    weight_points (GeoDataFrame): Optional weighted points
+    weight_column (str): Column of `weight_points` holding the weights
+    min_share (float): Smallest share to keep
+
+    Returns:
+    Crosswalk
+    """
+    source = source.to_crs(AREA_CRS)
+    target = target.to_crs(AREA_CRS)
+    n_sources, n_targets = len(source), len(target)
+
+    i_source, i_target = target.sindex.query(source.geometry, predicate="intersects")
+    areas = shapely.area(shapely.intersection(
+        source.geometry.values[i_source], target.geometry.values[i_target]))
+    weights = _shares(i_target, i_source, areas, n_targets, n_sources)
+    method = "area"
+
+    if weight_points is not None:
+        if weight_column is None:
+            raise ValueError("weight_column is required with weight_points")
+        points = weight_points.to_crs(AREA_CRS)
+        geometry = points.geometry.representative_point()
+        # First containing polygon per point; points outside either layer drop out
+        p_source, in_source = source.sindex.query(geometry, predicate="within")
+        p_target, in_target = target.sindex.query(geometry, predicate="within")
+        source_of = pd.Series(in_source, index=p_source).groupby(level=0).first()
+        target_of = pd.Series(in_target, index=p_target).groupby(level=0).first()
+        both = source_of.index.intersection(target_of.index)
+        amounts = points[weight_column].to_numpy(dtype=np.float64)[both]
+        by_points = _shares(target_of[both].to_numpy(), source_of[both].to_numpy(),
+                            amounts, n_targets, n_sources)
+        has_points = np.asarray(by_points.sum(axis=0)).ravel() > 0
+        weights = (by_points @ sparse.diags(has_points.astype(np.float64))
+                   + weights @ sparse.diags((~has_points).astype(np.float64)))
+        method = f"points:{weight_column}"
+
+    # Drop slivers, then rescale so columns still sum to 1
+    weights = weights.tocoo()
+    keep = weights.data >= min_share
+    weights = _shares(weights.row[keep], weights.col[keep], weights.data[keep],
+                      n_targets, n_sources)
+
+    unmatched = int((np.asarray(weights.sum(axis=0)).ravel() == 0).sum())
+    if unmatched:
+        logger.warning(f"{unmatched} sources do not intersect any target")
+    return Crosswalk(source[source_id].to_numpy(), target[target_id].to_numpy(),
+                     weights, method=method)
+
+
+def crosswalk_dir():
+    """Default directory for cached crosswalks."""
+    return Path(get_repo_root()) / "audt_data" / "d01_data" / "geo" / "nyc" / "crosswalks"
+
+
+_crosswalks = {}
+
+
+def get_crosswalk(name, build, inputs=(), cache_dir=None):
+    """
+    Load a crosswalk from memory or disk, building it only when needed.
+
+    A cached crosswalk is rebuilt when any of the `inputs` files is newer
+    than it, so rollups after the first are a file read (or a dict lookup)
+    plus a sparse multiply.
+
+    Parameters:
+    name (str): Cache name, e.g. 'ct2020-nta2020-area'
+    build (callable): Zero-argument function returning a `Crosswalk`
+    inputs (iterable): Files the crosswalk is built from
+    cache_dir (str or Path): Defaults to `crosswalk_dir()`
+
+    Returns:
+    Crosswalk
+    """
+    path = Path(cache_dir or crosswalk_dir()) / f"{name}.npz"
+    newest_input = max((os.stat(p).st_mtime_ns for p in inputs), default=0)
+    cached = _crosswalks.get(path)
+    if cached is not None and cached[0] >= newest_input:
+        return cached[1]
+
+    if path.exists() and os.stat(path).st_mtime_ns >= newest_input:
+        crosswalk = Crosswalk.load(path)
+        logger.debug(f"Loaded {crosswalk!r} from {path}")
+    else:
+        logger.info(f"Building crosswalk {name}")
+        crosswalk = build()
+        crosswalk.save(path)
+        logger.success(f"Saved {crosswalk!r} to {path}")
+    _crosswalks[path] = (os.stat(path).st_mtime_ns, crosswalk)
+    return crosswalk
+
+
+def tract_crosswalk(target_path, target_id, tracts_path=None, weight_points_path=None,
+                    weight_column=None, cache_dir=None):
+    """
+    Cached overlay crosswalk from the 2020 NYC tracts to a boundary file.
+
+    Parameters:
+    target_path (str or Path): Target boundaries (NTAs, community
+                               districts, ZCTAs, ...), GeoParquet or any
+                               format geopandas reads
+    target_id (str): Identifier column of the target layer
+    tracts_path (str or Path): Defaults to d01_data/geo/nyc/ct-nyc-2020.geojson
+    weight_points_path (str or Path): Optional weighted points layer
+    weight_column (str): Weight column of the points layer
+
+    Returns:
+    Crosswalk
+    """
+    if tracts_path is None:
+        tracts_path = crosswalk_dir().parent / "ct-nyc-2020.geojson"
+    inputs = [p for p in (tracts_path, target_path, weight_points_path) if p is not None]
+    suffix = f"pts-{weight_column}" if weight_points_path else "area"
+    name = f"{Path(tracts_path).stem}--{Path(target_path).stem}-{target_id}-{suffix}"
+
+    def build():
+        return overlay_crosswalk(
+            read_boundaries(tracts_path),
+            read_boundaries(target_path),
+            target_id,
+            weight_points=read_boundaries(weight_points_path) if weight_points_path else None,
+            weight_column=weight_column,
+        )
+
+    return get_crosswalk(name, build, inputs=inputs, cache_dir=cache_dir)
@@ -8,91 +8,210 @@
 
 import os 
 import rasterio
+from affine import Affine
 from rasterio.enums import Resampling
-from rasterstats import zonal_stats
-from itertools import islice
-import pandas as pd
-import geopandas as gpd 
+from rasterio.windows import Window
 from pathlib import Path
 
 
 from audt_data.d03_src.utils.logger import setup_logger
 from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.geo.nyc.raster_io import open_source, tile_windows, imap_bounded
+from audt_data.d03_src.pp.geo.nyc.zonal import zonal_stats, DEFAULT_STATS
+from audt_data.d03_src.pp.geo.nyc.terrain import terrain_stats
 
 logger = setup_logger("nyc-topology-preprocessing")
 
 
-def downsample_raster(TOPOGRAPHY_NYC, downsample_factor=10, REGEN_TOPOLOGY=False, OUTPUT_PATH=''):
-
-    # Open the raster
-    with rasterio.open(TOPOGRAPHY_NYC) as src:
-        # Calculate new transform and dimensions
-        new_transform = src.transform * src.transform.scale(
-            downsample_factor,
-            downsample_factor
-        )
-        new_width = src.width // downsample_factor
-        new_height = src.height // downsample_factor
-        
-        # Resample the raster
-        topology = src.read(
-            out_shape=(src.count, new_height, new_width),
-            resampling=Resampling.bilinear
-        )
-
-        # Create a new rasterio-like object with updated metadata
+# Resampling methods GDAL supports when reading (the rest are warp-only)
+READ_RESAMPLING = ("nearest", "bilinear", "cubic", "cubic_spline", "lanczos",
+                   "average", "mode", "gauss", "rms")
+
+# Downsampled tiles are squares of this many pixels; also the output's GeoTIFF
+# block size, so it must be a multiple of 16
+TILE_SIZE = 512
+
+# GDAL block cache for tiled downsampling, in MB; GDAL's default (5% of RAM)
+# would otherwise fill up with source blocks that are never read again
+CACHE_MB = 64
+
+# GeoTIFF open option that hides a raster's overviews. GDAL otherwise serves
+# a decimated read from the closest overview, whose pixels were made with
+# the overview's own method (e.g. 'average' in a COG), not `resampling`
+NO_OVERVIEWS = {"OVERVIEW_LEVEL": "NONE"}
+
+
+def _resampling(method):
+    if isinstance(method, Resampling):
+        method = method.name
+    if method not in READ_RESAMPLING:
+        raise ValueError(f"resampling must be one of {READ_RESAMPLING}, got {method!r}")
+    return Resampling[method]
+
+
+def _downsampled_grid(src, downsample_factor):
+    """Width, height and transform of `src` downsampled by `downsample_factor`."""
+    t = src.transform
+    # Same as src.transform * Affine.scale(f, f), spelled out
+    transform = Affine(t.a * downsample_factor, t.b * downsample_factor, t.c,
+                       t.d * downsample_factor, t.e * downsample_factor, t.f)
+    width = max(int(src.width // downsample_factor), 1)
+    height = max(int(src.height // downsample_factor), 1)
+    return width, height, transform
+
+
+def _downsample_tile(tile, path, downsample_factor, resampling, cache_mb=CACHE_MB):
+    """
+    Resample the source pixels under one output tile.
+
+    The source window is the tile scaled by `downsample_factor` (fractional
+    offsets are fine); GDAL resamples it against the full band, reading
+    whatever neighbouring pixels the kernel needs, so tiles match a
+    whole-raster read exactly, seams included.
+    """
+    col, row, width, height = tile
+    source_window = Window(col * downsample_factor, row * downsample_factor,
+                           width * downsample_factor, height * downsample_factor)
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb * 2**20):
+        src = open_source(str(path), **NO_OVERVIEWS)
+        data = src.read(window=source_window, out_shape=(src.count, height, width),
+                        resampling=_resampling(resampling))
+    return tile, data
+
+
+def downsample_raster(TOPOGRAPHY_NYC, downsample_factor=10, REGEN_TOPOLOGY=False, OUTPUT_PATH='',
+                      resampling="bilinear", tile_size=TILE_SIZE, jobs=1, cache_mb=CACHE_MB):
+    """
+    Downsample a DEM by `downsample_factor`.
+
+    With REGEN_TOPOLOGY the raster is written to OUTPUT_PATH tile by tile: each
+    tile of the output is read from its window of the source, resampled, and
+    written as soon as it is done, so memory holds about 2 * jobs tiles plus
+    `cache_mb` per process rather than the whole DEM. Without it the
+    downsampled raster is read in one go and returned. Any overviews of the
+    source (see `cog.make_cog`) are ignored, so every output pixel is
+    resampled with `resampling` from the full-resolution pixels.
+
+    Parameters:
+    TOPOGRAPHY_NYC (str or Path): Source raster
+    downsample_factor (float): Source pixels per output pixel, along each axis
+    REGEN_TOPOLOGY (bool): Write the result to OUTPUT_PATH
+    OUTPUT_PATH (str or Path): Output GeoTIFF (tiled, deflate-compressed)
+    resampling (str): One of READ_RESAMPLING
+    tile_size (int): Output tile side in pixels, a multiple of 16
+    jobs (int): Worker processes resampling tiles; None for one per CPU
+    cache_mb (int): GDAL block cache per process while writing, in MB
+
+    Returns:
+    Path or numpy.ndarray: OUTPUT_PATH if written, else the (bands, rows, cols) array
+    """
+    if downsample_factor <= 0:
+        raise ValueError(f"downsample_factor must be positive, got {downsample_factor}")
+    if tile_size <= 0 or tile_size % 16:
+        raise ValueError(f"tile_size must be a positive multiple of 16, got {tile_size}")
+    method = _resampling(resampling)
+
+    with rasterio.open(TOPOGRAPHY_NYC, **NO_OVERVIEWS) as src:
+        new_width, new_height, new_transform = _downsampled_grid(src, downsample_factor)
+
+        if not REGEN_TOPOLOGY:
+            # Read exactly the source pixels the output grid covers, so
+            # pixels line up with new_transform when the size is not a
+            # multiple of the factor
+            window = Window(0, 0, new_width * downsample_factor, new_height * downsample_factor)
+            topology = src.read(window=window, out_shape=(src.count, new_height, new_width),
+                                resampling=method)
+            logger.success("Downsampling complete")
+            return topology
+
         new_meta = src.meta.copy()
         new_meta.update({
             "driver": "GTiff",
             "height": new_height,
             "width": new_width,
-            "transform": new_transform
+            "transform": new_transform,
+            "tiled": True,
+            "blockxsize": tile_size,
+            "blockysize": tile_size,
+            "compress": "deflate",
+            "BIGTIFF": "IF_SAFER",
         })
 
-        logger.success("Downsampling complete")
-
-        # Write the new raster to disk
-        if REGEN_TOPOLOGY: 
-            logger.info(f"Writing downsampled topology to {OUTPUT_PATH}")
-            os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-            with rasterio.open(OUTPUT_PATH, "w", **new_meta) as dst:
-                dst.write(topology)
-
-
-
-def sample_topology(topology_path, sampling_geom, output_path=None, save=True):
-
+    OUTPUT_PATH = Path(OUTPUT_PATH)
+    tiles = list(tile_windows(new_width, new_height, tile_size))
+    jobs = min(jobs or os.cpu_count() or 1, len(tiles))
+    logger.info(f"Downsampling {TOPOGRAPHY_NYC} by {downsample_factor} ({method.name}) into "
+                f"{len(tiles)} tiles of {tile_size}px with {jobs} worker(s)")
+    logger.info(f"Writing downsampled topology to {OUTPUT_PATH}")
+    os.makedirs(OUTPUT_PATH.parent, exist_ok=True)
+
+    # Tiles are written out as they finish, with at most two per worker in
+    # flight (see `raster_io.imap_bounded`)
+    args = (TOPOGRAPHY_NYC, downsample_factor, method.name, cache_mb)
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb * 2**20), rasterio.open(OUTPUT_PATH, "w", **new_meta) as dst:
+        for (col, row, width, height), data in imap_bounded(_downsample_tile, tiles, args, jobs):
+            dst.write(data, window=Window(col, row, width, height))
+
+    logger.success("Downsampling complete")
+    return OUTPUT_PATH
+
+
+def sample_topology(topology_path, sampling_geom, output_path=None, save=True,
+                    stats=DEFAULT_STATS, resolution=None, terrain=False, jobs=1, cache_dir=None):
+    """
+    Summarize a topology raster over polygons (the 2020 tracts, blocks, ...).
+
+    Uses `zonal.zonal_stats`, which rasterizes the polygons once onto the
+    raster grid and caches the labels, rather than reading the raster once
+    per polygon. Given a `resolution` (e.g. 10 for 10ft pixels) and a COG
+    with overviews (see `cog.make_cog`), the matching overview level is read
+    instead of the full raster. With `terrain`, per-GEOID statistics of
+    slope, aspect, TRI and TPI (see `terrain.terrain_stats`) are added as
+    further columns.
+
+    Parameters:
+    topology_path (str or Path): Topology GeoTIFF or COG
+    sampling_geom (str or Path): Polygons with a GEOID column
+    output_path (str or Path): .csv (as before) or .parquet
+    save (bool): Write the result to output_path
+    stats (iterable): Stats to compute (see `zonal.STATS`); 'count' is dropped
+    resolution (float): Pixel size to sample at, in CRS units; None for full resolution
+    terrain (bool): Also summarize terrain derivatives
+    jobs (int): Worker processes
+    cache_dir (str or Path): Label grid cache; defaults to `zonal.zonal_dir()`
+
+    Returns:
+    DataFrame: GEOID plus one column per stat (and per terrain stat), sorted by GEOID
+    """
     # make sure topology_path ends in .tif, topology_path is a Path object
     topology_path = Path(topology_path)
     if not topology_path.suffix == '.tif':
         raise ValueError(f"topology_path must be a .tif file, got {topology_path}")
 
-    sampling_geom = gpd.read_file(sampling_geom).to_crs("EPSG:2263")
-
-    summary_stats = zonal_stats( 
-        sampling_geom,
-        topology_path,
-    )
-
-    
-
-    # summary_stats is a list of dicts 
-    # each dict has the same keys
-    # convert summary_stats to df 
-    summary_stats_df = pd.DataFrame(summary_stats)
-    # join with sampling_geom 
-    sampling_geom = sampling_geom[['GEOID']]
-    summary_stats_df = sampling_geom.join(summary_stats_df)
+    summary_stats_df = zonal_stats(sampling_geom, topology_path, zone_id="GEOID", stats=stats,
+                                   resolution=resolution, jobs=jobs, cache_dir=cache_dir)
+    if terrain:
+        terrain_df = terrain_stats(sampling_geom, topology_path, zone_id="GEOID",
+                                   resolution=resolution, jobs=jobs, cache_dir=cache_dir)
+        summary_stats_df = summary_stats_df.join(terrain_df)
+    # Rows follow the zones file, which for GeoParquet boundaries is Hilbert
+    # order; sort so the written output is stable across inputs
+    summary_stats_df = summary_stats_df.reset_index().sort_values("GEOID", ignore_index=True)
 
     # drop 'count' 
-    summary_stats_df = summary_stats_df.drop(columns='count')
+    summary_stats_df = summary_stats_df.drop(columns='count', errors='ignore')
 
     logger.success("Topology sampling complete")
 
     if save: 
+        output_path = Path(output_path)
         os.makedirs(output_path.parent, exist_ok=True)
         logger.info(f"Saving topology sampling to {output_path}")
-        summary_stats_df.to_csv(output_path)
+        if output_path.suffix == '.parquet':
+            summary_stats_df.to_parquet(output_path)
+        else:
+            summary_stats_df.to_csv(output_path)
+    return summary_stats_df
 
 
 
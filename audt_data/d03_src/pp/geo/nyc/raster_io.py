@@ -0,0 +1,91 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Raster IO]
+[Module with functions for tiled raster reads shared by the topology modules]
+[Matt Franchi]
+"""
+
+import os
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import rasterio
+
+from audt_data.d03_src.utils.logger import pool_logging_kwargs
+
+# Rasters (per overview level and open options) opened by this process, so
+# each worker opens them once rather than once per tile or strip
+_sources = {}
+
+
+def open_source(path, level=None, **options):
+    """
+    An open dataset of `path` at overview `level`, cached for this process.
+
+    Parameters:
+    path (str): Raster path
+    level (int): Overview level; None for full resolution
+    options: GDAL open options, e.g. OVERVIEW_LEVEL='NONE'
+
+    Returns:
+    DatasetReader
+    """
+    key = (path, level, tuple(sorted(options.items())))
+    src = _sources.get(key)
+    if src is None or src.closed:
+        src = _sources[key] = rasterio.open(path, overview_level=level, **options)
+    return src
+
+
+def close_sources():
+    """Close every dataset opened by `open_source` in this process."""
+    while _sources:
+        _sources.popitem()[1].close()
+
+
+def tile_windows(width, height, tile_size):
+    """(col_off, row_off, width, height) of the tiles covering a width x height grid."""
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield (col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+
+def imap_bounded(func, items, args=(), jobs=1, in_flight=2):
+    """
+    Yield `func(item, *args)` for every item, on `jobs` worker processes.
+
+    At most `in_flight` items per worker are submitted ahead of the results
+    taken so far, so a caller writing out or merging each result as it
+    arrives holds only a few in memory. Results come in completion order.
+    With one job the items run in this process, in order, and the datasets
+    they opened through `open_source` are closed at the end.
+
+    Parameters:
+    func (callable): Picklable function of an item and `args`
+    items (iterable): Work items, e.g. tiles or strips
+    args (tuple): Further arguments of `func`
+    jobs (int): Worker processes; None for one per CPU
+    in_flight (int): Items submitted per worker ahead of the results
+
+    Yields:
+    The result of each call
+    """
+    items = list(items)
+    jobs = min(jobs or os.cpu_count() or 1, max(len(items), 1))
+    if jobs == 1:
+        try:
+            for item in items:
+                yield func(item, *args)
+        finally:
+            close_sources()
+        return
+
+    pending = iter(items)
+    with ProcessPoolExecutor(max_workers=jobs, **pool_logging_kwargs()) as pool:
+        running = {pool.submit(func, item, *args) for item in islice(pending, in_flight * jobs)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            running |= {pool.submit(func, item, *args) for item in islice(pending, len(done))}
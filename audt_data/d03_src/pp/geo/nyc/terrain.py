@@ -0,0 +1,264 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Terrain]
+[Module with functions for terrain derivatives and their zonal statistics]
+[Matt Franchi]
+"""
+
+import os
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.geo.nyc.cog import resolution_level
+from audt_data.d03_src.pp.geo.nyc.raster_io import open_source, tile_windows, imap_bounded
+from audt_data.d03_src.pp.geo.nyc.zonal import (
+    get_label_grid, raster_grid, zone_partials, merge_partials, finalize_partials, NO_ZONE,
+    _check_stats
+)
+
+logger = setup_logger("nyc-terrain")
+
+DERIVATIVES = ("slope", "aspect", "tri", "tpi")
+TERRAIN_STATS = ("mean", "std", "min", "max")
+
+# Tile side in pixels; each tile is read with a one-pixel halo
+TILE_SIZE = 1024
+
+# GDAL block cache per process, in MB
+CACHE_MB = 64
+
+
+def horn_derivatives(z, xres, yres, derivatives=DERIVATIVES, z_factor=1.0):
+    """
+    Terrain derivatives of the interior of `z`, like gdaldem.
+
+    Slope (degrees) and aspect (degrees clockwise from north, NaN where
+    flat) use Horn's 3x3 gradient; TRI is Riley's terrain ruggedness index
+    (root of the summed squared differences to the 8 neighbours) and TPI is
+    the centre minus the neighbours' mean. A pixel with any NaN in its 3x3
+    window is NaN, as gdaldem leaves it nodata.
+
+    Parameters:
+    z (ndarray): Elevations with a one-pixel border, NaN for nodata
+    xres (float): Pixel width, in the same units as the elevations / z_factor
+    yres (float): Pixel height (positive)
+    derivatives (iterable): Any of DERIVATIVES
+    z_factor (float): Vertical units per horizontal unit
+
+    Returns:
+    dict: Derivative name -> (rows - 2, cols - 2) float64 array
+    """
+    z = np.asarray(z, dtype=np.float64) * z_factor
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, e, f = z[1:-1, :-2], z[1:-1, 1:-1], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+
+    out = {}
+    if "slope" in derivatives or "aspect" in derivatives:
+        dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+        dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * yres)
+        if "slope" in derivatives:
+            out["slope"] = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+        if "aspect" in derivatives:
+            aspect = np.degrees(np.arctan2(dzdy, -dzdx))
+            aspect = np.where(aspect > 90, 450 - aspect, 90 - aspect)
+            aspect[aspect == 360] = 0
+            aspect[(dzdx == 0) & (dzdy == 0)] = np.nan
+            out["aspect"] = aspect
+    if "tri" in derivatives or "tpi" in derivatives:
+        neighbours = (a, b, c, d, f, g, h, i)
+        if "tri" in derivatives:
+            out["tri"] = np.sqrt(sum((n - e) ** 2 for n in neighbours))
+        if "tpi" in derivatives:
+            out["tpi"] = e - sum(neighbours) / 8
+    return out
+
+
+def _read_with_halo(src, tile):
+    """Band 1 under `tile` plus a one-pixel halo, as float64 with NaN outside the raster and for nodata."""
+    col, row, width, height = tile
+    col_start, row_start = max(col - 1, 0), max(row - 1, 0)
+    col_stop, row_stop = min(col + width + 1, src.width), min(row + height + 1, src.height)
+    data = src.read(1, window=Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+    data = data.astype(np.float64)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        data[data == src.nodata] = np.nan
+
+    z = np.full((height + 2, width + 2), np.nan)
+    z[row_start - row + 1: row_stop - row + 1, col_start - col + 1: col_stop - col + 1] = data
+    return z
+
+
+def _layers(derived):
+    """Derivatives as the linear layers that are aggregated (aspect as northness/eastness)."""
+    layers = {}
+    for name, values in derived.items():
+        if name == "aspect":
+            radians = np.radians(values)
+            layers["northness"] = np.cos(radians)
+            layers["eastness"] = np.sin(radians)
+        else:
+            layers[name] = values
+    return layers
+
+
+def _terrain_tile(tile, path, level, derivatives, z_factor, labels_path, n_zones, percentiles,
+                  keep, cache_mb=CACHE_MB):
+    """
+    Derivatives of one tile and their per-zone partials.
+
+    Returns:
+    tuple: (tile, {derivative: array} if `keep` else None, {layer: partials})
+    """
+    col, row, width, height = tile
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb * 2**20):
+        src = open_source(path, level)
+        z = _read_with_halo(src, tile)
+        t = src.transform
+        derived = horn_derivatives(z, abs(t.a), abs(t.e), derivatives, z_factor)
+
+    labels = np.load(labels_path, mmap_mode="r")[row:row + height, col:col + width]
+    in_zone = labels != NO_ZONE
+    partials = {}
+    for name, values in _layers(derived).items():
+        valid = in_zone & ~np.isnan(values)
+        partials[name] = zone_partials(labels[valid], values[valid], n_zones, percentiles)
+    return tile, (derived if keep else None), partials
+
+
+def terrain_stats(zones, dem_path, zone_id="GEOID", derivatives=DERIVATIVES, stats=TERRAIN_STATS,
+                  resolution=None, z_factor=1.0, tile_size=TILE_SIZE, jobs=1, raster_path=None,
+                  output_path=None, cache_dir=None):
+    """
+    Per-zone statistics of terrain derivatives of a DEM.
+
+    The DEM is processed in tiles, each read with a one-pixel halo so the
+    3x3 derivatives are exact at tile edges (see `horn_derivatives`). Each
+    tile is reduced per zone right away with the label grid of the zonal
+    engine, so memory holds about 2 * jobs tiles and never a whole
+    derivative raster. Aspect is aggregated as northness (cos) and
+    eastness (sin); 'aspect_mean' is their circular mean.
+
+    Parameters:
+    zones (str, Path or GeoDataFrame): Zone polygons, e.g. the 2020 tracts
+    dem_path (str or Path): DEM, ideally a COG (see `cog.make_cog`)
+    zone_id (str): Identifier column of `zones`
+    derivatives (iterable): Any of DERIVATIVES
+    stats (iterable): Stats per derivative (see `zonal.STATS`)
+    resolution (float): Pixel size to compute at, read from the matching
+                        overview; None for full resolution
+    z_factor (float): Vertical units per horizontal unit (1 for the NYC
+                      DEM, feet on feet)
+    tile_size (int): Tile side in pixels
+    jobs (int): Worker processes; None for one per CPU
+    raster_path (str or Path): Optional GeoTIFF to also write the
+                               derivatives to, one float32 band each
+    output_path (str or Path): Optional Parquet file for the result
+    cache_dir (str or Path): Label grid cache; defaults to `zonal.zonal_dir()`
+
+    Returns:
+    DataFrame: One row per zone, indexed by `zone_id`, with
+               '{derivative}_{stat}' columns
+    """
+    unknown = set(derivatives) - set(DERIVATIVES)
+    if unknown:
+        raise ValueError(f"Unknown derivatives {sorted(unknown)}; expected any of {DERIVATIVES}")
+    derivatives = [name for name in DERIVATIVES if name in derivatives]
+    stats = _check_stats(stats)
+    percentiles = any(stat == "median" or stat.startswith("percentile_") for stat in stats)
+    level = resolution_level(dem_path, resolution)
+    dem_path = str(dem_path)
+
+    with rasterio.open(dem_path, overview_level=level) as src:
+        grid = raster_grid(src)
+        meta = src.meta.copy()
+    label_grid = get_label_grid(zones, grid, zone_id=zone_id, cache_dir=cache_dir)
+    n_zones = len(label_grid.ids)
+    tiles = list(tile_windows(grid["width"], grid["height"], tile_size))
+    jobs = min(jobs or os.cpu_count() or 1, len(tiles))
+    logger.info(f"Computing {', '.join(derivatives)} over {len(tiles)} tiles of {tile_size}px "
+                f"with {jobs} worker(s)")
+
+    dst = None
+    if raster_path is not None:
+        raster_path = Path(raster_path)
+        os.makedirs(raster_path.parent, exist_ok=True)
+        meta.update({"driver": "GTiff", "count": len(derivatives), "dtype": "float32",
+                     "nodata": np.nan, "tiled": True, "blockxsize": 512, "blockysize": 512,
+                     "compress": "deflate", "BIGTIFF": "IF_SAFER"})
+        dst = rasterio.open(raster_path, "w", **meta)
+        for band, name in enumerate(derivatives, start=1):
+            dst.set_band_description(band, name)
+
+    totals = {}
+
+    def add(tile, derived, partials):
+        for name, partial in partials.items():
+            totals[name] = partial if name not in totals else merge_partials(totals[name], partial)
+        if dst is not None:
+            col, row, width, height = tile
+            dst.write(np.stack([derived[name] for name in derivatives]).astype(np.float32),
+                      window=Window(col, row, width, height))
+
+    args = (dem_path, level, derivatives, z_factor, str(label_grid.path), n_zones, percentiles,
+            dst is not None)
+    try:
+        # At most two tiles per worker in flight (see `raster_io.imap_bounded`)
+        for result in imap_bounded(_terrain_tile, tiles, args, jobs):
+            add(*result)
+    finally:
+        if dst is not None:
+            dst.close()
+            logger.info(f"Saved terrain derivatives to {raster_path}")
+
+    columns = {}
+    for name in derivatives:
+        if name == "aspect":
+            northness = finalize_partials(totals["northness"], stats)
+            eastness = finalize_partials(totals["eastness"], stats)
+            if "mean" in stats:
+                aspect = np.degrees(np.arctan2(eastness["mean"], northness["mean"])) % 360
+                columns["aspect_mean"] = aspect
+            for layer, values in (("northness", northness), ("eastness", eastness)):
+                for stat in stats:
+                    columns[f"{layer}_{stat}"] = values[stat]
+        else:
+            for stat, values in finalize_partials(totals[name], stats).items():
+                columns[f"{name}_{stat}"] = values
+    result = pd.DataFrame(columns, index=pd.Index(label_grid.ids, name=zone_id))
+    logger.success(f"Terrain statistics complete for {len(result)} zones")
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        os.makedirs(output_path.parent, exist_ok=True)
+        result.to_parquet(output_path)
+        logger.info(f"Saved terrain statistics to {output_path}")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Terrain derivatives of the NYC DEM per census tract")
+    parser.add_argument("--dem", default=None, help="DEM or COG (default: d01_data/geo/nyc/topology_nyc_cog.tif)")
+    parser.add_argument("--zones", default=None, help="Zones (default: d01_data/geo/nyc/ct-nyc-2020.geojson)")
+    parser.add_argument("--resolution", type=float, default=10.0, help="Pixel size in feet")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--output", default=None,
+                        help="Parquet output (default: d01_data/geo/nyc/terrain_nyc_sampled.parquet)")
+    args = parser.parse_args()
+
+    data_path = Path(get_repo_root()) / 'audt_data' / 'd01_data' / 'geo' / 'nyc'
+    terrain_stats(
+        args.zones or data_path / 'ct-nyc-2020.geojson',
+        args.dem or data_path / 'topology_nyc_cog.tif',
+        resolution=args.resolution,
+        jobs=args.jobs,
+        output_path=args.output or data_path / 'terrain_nyc_sampled.parquet',
+    )
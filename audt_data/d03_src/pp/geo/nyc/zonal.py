@@ -0,0 +1,484 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Zonal]
+[Module with functions for zonal statistics over rasterized zone labels]
+[Matt Franchi]
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+import rasterio
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.windows import Window
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.geo.nyc.cog import resolution_level
+from audt_data.d03_src.pp.geo.nyc.boundaries import read_boundaries
+from audt_data.d03_src.pp.geo.nyc.raster_io import open_source, imap_bounded
+
+logger = setup_logger("nyc-zonal-stats")
+
+# rasterstats' defaults, which sample_topology has always written
+DEFAULT_STATS = ("min", "max", "mean", "count")
+STATS = ("count", "sum", "min", "max", "range", "mean", "std", "median")
+
+# Pixels per chunk when `chunk_rows` is not given
+CHUNK_PIXELS = 4_000_000
+
+# Label value of pixels outside every zone; zone i is labelled i + 1
+NO_ZONE = 0
+
+
+def zonal_dir():
+    """Default directory for cached label grids."""
+    return Path(get_repo_root()) / "audt_data" / "d01_data" / "geo" / "nyc" / "zonal"
+
+
+def _percentile(stat):
+    """q of a 'percentile_q' stat, or None for the other stats."""
+    if not stat.startswith("percentile_"):
+        return None
+    q = float(stat[len("percentile_"):])
+    if not 0 <= q <= 100:
+        raise ValueError(f"Percentile must be between 0 and 100, got {stat}")
+    return q
+
+
+def _check_stats(stats):
+    stats = [stats] if isinstance(stats, str) else list(stats)
+    for stat in stats:
+        if stat not in STATS and _percentile(stat) is None:
+            raise ValueError(f"Unknown stat {stat!r}; expected one of {STATS} or 'percentile_<q>'")
+    return stats
+
+
+def raster_grid(src):
+    """The grid of an open raster as a JSON-friendly dict."""
+    t = src.transform
+    return {
+        "width": src.width,
+        "height": src.height,
+        "transform": [t.a, t.b, t.c, t.d, t.e, t.f],
+        "crs": src.crs.to_string() if src.crs else None,
+    }
+
+
+def _strip_transform(transform, row):
+    """Transform of the grid starting at `row` (no Affine arithmetic)."""
+    a, b, c, d, e, f = transform
+    return Affine(a, b, c + b * row, d, e, f + e * row)
+
+
+def _strip_bounds(grid, row_start, row_stop):
+    a, b, c, d, e, f = grid["transform"]
+    cols = np.array([0, grid["width"], 0, grid["width"]])
+    rows = np.array([row_start, row_start, row_stop, row_stop])
+    xs = a * cols + b * rows + c
+    ys = d * cols + e * rows + f
+    return xs.min(), ys.min(), xs.max(), ys.max()
+
+
+class LabelGrid:
+    """
+    Zones rasterized onto a raster grid, once, for every later zonal pass.
+
+    Attributes:
+    ids (Index): Zone identifiers; zone i has label i + 1 (0 is no zone)
+    labels (ndarray): height x width int32 labels, memory-mapped from `path`
+    grid (dict): Width, height, transform and CRS (see `raster_grid`)
+    all_touched (bool): Whether every pixel a zone touches is labelled,
+                        rather than only pixels whose centre it contains
+    path (Path): The .npy file of `labels`; a .json sidecar holds the rest
+    """
+
+    def __init__(self, ids, labels, grid, all_touched=False, path=None):
+        self.ids = pd.Index(ids)
+        self.labels = labels
+        self.grid = grid
+        self.all_touched = all_touched
+        self.path = Path(path) if path is not None else None
+
+    def __repr__(self):
+        return (f"LabelGrid({len(self.ids)} zones on {self.grid['width']}x{self.grid['height']}, "
+                f"all_touched={self.all_touched})")
+
+    @classmethod
+    def build(cls, zones, zone_id, grid, path, all_touched=False, strip_rows=None):
+        """
+        Rasterize `zones` onto `grid`, writing the labels to `path` (.npy).
+
+        The grid is rasterized in strips of rows, each with only the zones
+        that reach it, so memory holds one strip plus the geometries.
+        Overlapping zones are not supported: a pixel gets the last zone
+        covering it.
+        """
+        if grid["crs"] and zones.crs is not None and zones.crs != grid["crs"]:
+            zones = zones.to_crs(grid["crs"])
+        width, height = grid["width"], grid["height"]
+        strip_rows = strip_rows or max(1, CHUNK_PIXELS // width)
+        geoms = zones.geometry.values
+        tree = shapely.STRtree(geoms)
+
+        path = Path(path)
+        os.makedirs(path.parent, exist_ok=True)
+        labels = np.lib.format.open_memmap(path, mode="w+", dtype=np.int32, shape=(height, width))
+        for row in range(0, height, strip_rows):
+            stop = min(row + strip_rows, height)
+            hits = np.sort(tree.query(shapely.box(*_strip_bounds(grid, row, stop))))
+            if len(hits):
+                labels[row:stop] = rasterize(
+                    zip(geoms[hits], hits + 1),
+                    out_shape=(stop - row, width),
+                    transform=_strip_transform(grid["transform"], row),
+                    fill=NO_ZONE,
+                    all_touched=all_touched,
+                    dtype="int32",
+                )
+            else:
+                labels[row:stop] = NO_ZONE
+        labels.flush()
+        del labels
+
+        label_grid = cls(zones[zone_id].to_numpy(), None, grid, all_touched, path)
+        label_grid.save()
+        return cls.load(path)
+
+    def save(self):
+        """Write the sidecar of `path` (the labels are already there)."""
+        with open(self.path.with_suffix(".json"), "w") as f:
+            json.dump({"ids": self.ids.tolist(), "grid": self.grid,
+                       "all_touched": self.all_touched}, f)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), "r") as f:
+            meta = json.load(f)
+        labels = np.load(path, mmap_mode="r")
+        return cls(meta["ids"], labels, meta["grid"], meta["all_touched"], path)
+
+
+def _zones_key(zones, zone_id):
+    """Cache key of a zones file (by path, size and mtime) or GeoDataFrame (by content)."""
+    digest = hashlib.sha1(zone_id.encode())
+    if isinstance(zones, (str, Path)):
+        stat = os.stat(zones)
+        digest.update(f"{os.path.abspath(zones)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    else:
+        digest.update(str(zones.crs).encode())
+        digest.update(pd.util.hash_pandas_object(zones[zone_id], index=False).values.tobytes())
+        for wkb in shapely.to_wkb(zones.geometry.values):
+            digest.update(wkb)
+    return digest.hexdigest()
+
+
+_label_grids = {}
+
+
+def clear_label_grids():
+    """Forget the label grids loaded in this process (the disk cache stays)."""
+    _label_grids.clear()
+
+
+def get_label_grid(zones, grid, zone_id="GEOID", all_touched=False, cache_dir=None):
+    """
+    Load the label grid of `zones` on `grid` from memory or disk, building it
+    only when needed.
+
+    Grids are cached under `cache_dir` by the zones (a file's path, size and
+    mtime, or a GeoDataFrame's contents), the grid and `all_touched`; with a
+    cached grid a zones file is not even read.
+
+    Parameters:
+    zones (str, Path or GeoDataFrame): Zone polygons (GeoParquet or any
+                                       format geopandas reads)
+    grid (dict): Target grid (see `raster_grid`)
+    zone_id (str): Identifier column of `zones`
+    all_touched (bool): Label every pixel a zone touches
+    cache_dir (str or Path): Defaults to `zonal_dir()`
+
+    Returns:
+    LabelGrid
+    """
+    digest = hashlib.sha1(_zones_key(zones, zone_id).encode())
+    digest.update(json.dumps([grid, all_touched], sort_keys=True).encode())
+    path = Path(cache_dir or zonal_dir()) / f"labels-{digest.hexdigest()[:16]}.npy"
+
+    label_grid = _label_grids.get(path)
+    if label_grid is not None:
+        return label_grid
+    if path.exists() and path.with_suffix(".json").exists():
+        label_grid = LabelGrid.load(path)
+        logger.debug(f"Loaded {label_grid!r} from {path}")
+    else:
+        if isinstance(zones, (str, Path)):
+            zones = read_boundaries(zones)
+        logger.info(f"Rasterizing {len(zones)} zones onto a {grid['width']}x{grid['height']} grid")
+        label_grid = LabelGrid.build(zones, zone_id, grid, path, all_touched=all_touched)
+        logger.success(f"Saved {label_grid!r} to {path}")
+    _label_grids[path] = label_grid
+    return label_grid
+
+
+def zone_partials(labels, values, n_zones, percentiles=False):
+    """
+    Mergeable per-zone aggregates of one chunk, from the labels and values
+    of its valid pixels (flattened).
+
+    count, mean and m2 (sum of squared deviations from the mean) come from
+    bincount; min and max from sorting by zone. With `percentiles`, values
+    are sorted by (zone, value) and run-length encoded into `hist`, the
+    distinct (zone, value, count) triples, which merge exactly across chunks.
+    """
+    size = n_zones + 1
+    count = np.bincount(labels, minlength=size)
+    total = np.bincount(labels, weights=values, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    m2 = np.bincount(labels, weights=(values - mean[labels]) ** 2, minlength=size)
+
+    minimum = np.full(size, np.nan)
+    maximum = np.full(size, np.nan)
+    partial = {"count": count, "mean": np.nan_to_num(mean), "m2": m2,
+               "min": minimum, "max": maximum}
+    if not len(labels):
+        if percentiles:
+            partial["hist"] = (labels, values, np.zeros(0, dtype=np.int64))
+        return partial
+
+    if percentiles:
+        order = np.lexsort((values, labels))
+    else:
+        order = np.argsort(labels, kind="stable")
+    labels, values = labels[order], values[order]
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    zones = labels[starts]
+    if percentiles:
+        ends = np.r_[starts[1:], len(labels)] - 1
+        minimum[zones] = values[starts]
+        maximum[zones] = values[ends]
+        runs = np.flatnonzero(np.r_[True, (labels[1:] != labels[:-1]) | (values[1:] != values[:-1])])
+        partial["hist"] = (labels[runs], values[runs], np.diff(np.r_[runs, len(labels)]))
+    else:
+        minimum[zones] = np.minimum.reduceat(values, starts)
+        maximum[zones] = np.maximum.reduceat(values, starts)
+    return partial
+
+
+def _merge_hist(hists):
+    labels = np.concatenate([hist[0] for hist in hists])
+    values = np.concatenate([hist[1] for hist in hists])
+    counts = np.concatenate([hist[2] for hist in hists])
+    if len(hists) == 1 or not len(labels):
+        return labels, values, counts
+    order = np.lexsort((values, labels))
+    labels, values, counts = labels[order], values[order], counts[order]
+    runs = np.flatnonzero(np.r_[True, (labels[1:] != labels[:-1]) | (values[1:] != values[:-1])])
+    return labels[runs], values[runs], np.add.reduceat(counts, runs)
+
+
+def merge_partials(a, b):
+    """Combine two chunks' partials (Chan et al.'s parallel variance update)."""
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(count > 0, b["count"] / count, 0.0)
+    merged = {
+        "count": count,
+        "mean": a["mean"] + delta * share,
+        "m2": a["m2"] + b["m2"] + delta ** 2 * a["count"] * share,
+        "min": np.fmin(a["min"], b["min"]),
+        "max": np.fmax(a["max"], b["max"]),
+    }
+    if "hist" in a:
+        merged["hist"] = _merge_hist([a["hist"], b["hist"]])
+    return merged
+
+
+def _percentiles(hist, count, qs):
+    """
+    Per-zone percentiles from (zone, value, count) triples, interpolated
+    linearly between ranks like numpy.percentile.
+    """
+    labels, values, counts = hist
+    result = np.full((len(qs), len(count)), np.nan)
+    if not len(labels):
+        return result
+    cumulative = np.cumsum(counts)
+    zones = np.flatnonzero(count)
+    offset = np.zeros(len(count), dtype=np.int64)
+    offset[1:] = np.cumsum(count)[:-1]
+    n = count[zones]
+    for i, q in enumerate(qs):
+        position = q / 100 * (n - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, n - 1)
+        low_value = values[np.searchsorted(cumulative, offset[zones] + low, side="right")]
+        high_value = values[np.searchsorted(cumulative, offset[zones] + high, side="right")]
+        result[i, zones] = low_value + (high_value - low_value) * (position - low)
+    return result
+
+
+def finalize_partials(partial, stats):
+    """Per-zone stats (label 0 dropped) as {stat: array}."""
+    count = partial["count"]
+    empty = count == 0
+    out = {}
+    for stat in stats:
+        if stat == "count":
+            column = count
+        elif stat == "sum":
+            column = partial["mean"] * count
+        elif stat == "mean":
+            column = partial["mean"]
+        elif stat == "std":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                column = np.sqrt(partial["m2"] / count)
+        elif stat == "min":
+            column = partial["min"]
+        elif stat == "max":
+            column = partial["max"]
+        elif stat == "range":
+            column = partial["max"] - partial["min"]
+        else:
+            continue
+        if stat != "count":
+            column = np.where(empty, np.nan, column)
+        out[stat] = column[1:]
+
+    quantiles = {stat: 50.0 if stat == "median" else _percentile(stat) for stat in stats
+                 if stat == "median" or _percentile(stat) is not None}
+    if quantiles:
+        values = _percentiles(partial["hist"], count, list(quantiles.values()))
+        for stat, column in zip(quantiles, values):
+            out[stat] = column[1:]
+    return out
+
+
+def _zonal_chunk(strip, labels_path, rasters, n_zones, percentiles):
+    """Partials of every (path, overview level) raster over the rows [start, stop) of `strip` of the label grid."""
+    row_start, row_stop = strip
+    labels = np.load(labels_path, mmap_mode="r")[row_start:row_stop]
+    in_zone = labels != NO_ZONE
+    partials = []
+    for path, level in rasters:
+        src = open_source(path, level)
+        values = src.read(1, window=Window(0, row_start, src.width, row_stop - row_start))
+        valid = in_zone.copy()
+        if src.nodata is not None and not np.isnan(src.nodata):
+            valid &= values != src.nodata
+        if values.dtype.kind == "f":
+            valid &= ~np.isnan(values)
+        partials.append(zone_partials(labels[valid], values[valid].astype(np.float64), n_zones, percentiles))
+    return partials
+
+
+def _raster_names(rasters):
+    if isinstance(rasters, (str, Path)):
+        return {None: rasters}
+    if isinstance(rasters, dict):
+        return dict(rasters)
+    return {Path(path).stem: path for path in rasters}
+
+
+def zonal_stats(zones, rasters, zone_id="GEOID", stats=DEFAULT_STATS, all_touched=False,
+                resolution=None, jobs=1, chunk_rows=None, cache_dir=None, output_path=None):
+    """
+    Zonal statistics of one or more rasters over polygon zones.
+
+    The zones are rasterized once onto each raster grid (see
+    `get_label_grid`); every raster on that grid is then reduced in a single
+    pass over strips of rows, with per-zone aggregates computed for all
+    zones at once and merged across strips. Pixels are matched to zones like
+    rasterstats (by pixel centre unless `all_touched`), and nodata and NaN
+    pixels are ignored. With a `resolution`, each raster is read at its
+    matching overview level (see `cog.overview_level`) instead of in full.
+
+    Parameters:
+    zones (str, Path or GeoDataFrame): Zone polygons; reprojected to each raster's CRS
+    rasters (str, Path, list or dict): A raster, a list of rasters (named by
+                                       file stem) or a {name: path} dict
+    zone_id (str): Identifier column of `zones`
+    stats (iterable): Any of STATS and 'percentile_<q>'
+    all_touched (bool): Count every pixel a zone touches
+    resolution (float): Pixel size to compute at, in CRS units; None for full resolution
+    jobs (int): Worker processes reducing strips; None for one per CPU
+    chunk_rows (int): Rows per strip; defaults to about CHUNK_PIXELS pixels
+    cache_dir (str or Path): Label grid cache; defaults to `zonal_dir()`
+    output_path (str or Path): Optional Parquet file to write the result to
+
+    Returns:
+    DataFrame: One row per zone (in `zones` order), indexed by `zone_id`; one
+               column per stat for a single raster, else '{name}_{stat}'
+    """
+    stats = _check_stats(stats)
+    percentiles = any(stat == "median" or _percentile(stat) is not None for stat in stats)
+    named = _raster_names(rasters)
+
+    # Rasters sharing a grid share a label grid and a pass
+    groups = {}
+    dtypes = {}
+    levels = {}
+    for name, path in named.items():
+        levels[name] = resolution_level(path, resolution)
+        with rasterio.open(path, overview_level=levels[name]) as src:
+            if src.count > 1:
+                logger.warning(f"{path} has {src.count} bands; only band 1 is used")
+            grid = raster_grid(src)
+            dtypes[name] = np.dtype(src.dtypes[0])
+        groups.setdefault(json.dumps(grid, sort_keys=True), (grid, []))[1].append(name)
+
+    results = {}
+    ids = None
+    for grid, names in groups.values():
+        label_grid = get_label_grid(zones, grid, zone_id=zone_id, all_touched=all_touched,
+                                    cache_dir=cache_dir)
+        ids = label_grid.ids
+        n_zones = len(ids)
+        rows = chunk_rows or max(1, CHUNK_PIXELS // grid["width"])
+        strips = [(row, min(row + rows, grid["height"])) for row in range(0, grid["height"], rows)]
+        paths = [(str(named[name]), levels[name]) for name in names]
+        jobs_here = min(jobs or os.cpu_count() or 1, len(strips))
+        logger.info(f"Reducing {len(paths)} raster(s) over {n_zones} zones in "
+                    f"{len(strips)} strips with {jobs_here} worker(s)")
+
+        totals = [None] * len(paths)
+
+        def add(partials):
+            for i, partial in enumerate(partials):
+                totals[i] = partial if totals[i] is None else merge_partials(totals[i], partial)
+
+        args = (str(label_grid.path), paths, n_zones, percentiles)
+        for partials in imap_bounded(_zonal_chunk, strips, args, jobs_here):
+            add(partials)
+
+        for name, total in zip(names, totals):
+            results[name] = finalize_partials(total, stats)
+
+    columns = {}
+    for name in named:
+        for stat in stats:
+            column = results[name][stat]
+            # Like rasterstats, min and max of an integer raster stay integers
+            # (unless some zone has no pixels)
+            if stat in ("min", "max") and dtypes[name].kind in "iu" and not np.isnan(column).any():
+                column = column.astype(dtypes[name])
+            columns[stat if name is None else f"{name}_{stat}"] = column
+    result = pd.DataFrame(columns, index=pd.Index(ids, name=zone_id))
+    logger.success(f"Zonal statistics complete for {len(result)} zones")
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        os.makedirs(output_path.parent, exist_ok=True)
+        result.to_parquet(output_path)
+        logger.info(f"Saved zonal statistics to {output_path}")
+    return result
@@ -0,0 +1,210 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Pipeline]
+[Module with functions for the NYC preprocessing pipeline: pull, parse, merge and topology]
+[Matt Franchi]
+"""
+
+import json
+import inspect
+import argparse
+import subprocess
+from pathlib import Path
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.utils.repo import get_repo_root
+from audt_data.d03_src.pp.runner import Task, Pipeline
+from audt_data.d03_src.pp.acs.store import PROCESSED, METADATA
+
+logger = setup_logger("pp.pipeline")
+
+DEM_NAME = "DEM_LiDAR_1ft_2010_Improved_NYC_int.tif"
+TRACTS_NAME = "ct-nyc-2020.geojson"
+
+
+def data_root():
+    return Path(get_repo_root()) / "audt_data" / "d01_data"
+
+
+def _source_files(*funcs):
+    """Source files of the functions a stage calls, so editing them reruns it."""
+    return [inspect.getsourcefile(func) for func in funcs]
+
+
+def nyc_tasks(years=range(2020, 2024), acs_columns_path=None, output_format="csv",
+              downsample_factor=10, root=None, jobs=None):
+    """
+    The NYC preprocessing stages as `Task`s.
+
+    - pull_acs: Census API -> {root}/acs/raw (see `fetch.fetch_acs`)
+    - pull_geo: tract and block boundaries and the 1ft DEM -> {root}/geo/nyc
+      (d04_scripts/geo/nyc/pull.sh)
+    - ingest_geo: boundary GeoJSONs -> {root}/geo/nyc/parquet, GeoParquet
+      in EPSG:4326 and EPSG:2263 (`ingest_boundaries`)
+    - parse_acs: raw ACS files -> {root}/acs/preprocessed (`batch_process_acs`,
+      which itself only reprocesses changed files)
+    - merge_acs: raw ACS files + tracts -> {root}/acs/panel, an `AcsPanel`
+      (only with an `acs_columns_path` config, see `merge_acs_data`)
+    - cog_dem: DEM -> topology_nyc_cog.tif, a COG with overviews (`make_cog`)
+    - downsample_dem: DEM -> topology_nyc_downsampled.tif, resampled from
+      the full-resolution pixels (`downsample_raster`)
+    - sample_topology: COG at downsample_factor x its resolution + tracts
+      -> topology_nyc_sampled.csv, elevation and terrain derivative
+      (slope, aspect, TRI, TPI) statistics per tract
+
+    The pull stages are sources: they only run when their files are missing
+    (or their settings changed), so everything else works offline.
+
+    Parameters:
+    years (iterable): ACS vintages
+    acs_columns_path (str or Path): JSON config of datasets and columns to merge
+    output_format (str): 'csv' or 'parquet' for parse_acs
+    downsample_factor (int): DEM downsampling factor, and the overview level
+                             sample_topology reads
+    root (str or Path): Data directory; defaults to {repo_root}/audt_data/d01_data
+    jobs (int): Worker processes for parse_acs, downsample_dem and
+                sample_topology, GDAL threads for cog_dem
+
+    Returns:
+    list: Task objects
+    """
+    from audt_data.d03_src.pp.acs.fetch import (
+        fetch_acs, build_fetch_jobs, NYC_GROUPS, NYC_GEOGRAPHY
+    )
+    from audt_data.d03_src.pp.acs.batch_pp import batch_process_acs
+    from audt_data.d03_src.pp.acs.helpers import merge_acs_data
+    from audt_data.d03_src.pp.geo.nyc.pp_topology import downsample_raster, sample_topology
+    from audt_data.d03_src.pp.geo.nyc.zonal import zonal_stats
+    from audt_data.d03_src.pp.geo.nyc.terrain import terrain_stats
+    from audt_data.d03_src.pp.geo.nyc.raster_io import imap_bounded
+    from audt_data.d03_src.pp.geo.nyc.cog import make_cog, native_resolution, COG_NAME
+    from audt_data.d03_src.pp.geo.nyc.boundaries import (
+        ingest_boundaries, parquet_path, read_boundaries, LAYERS, CRSES
+    )
+
+    root = Path(root) if root is not None else data_root()
+    years = list(years)
+    raw_dir = root / "acs" / "raw"
+    preprocessed_dir = root / "acs" / "preprocessed"
+    geo_dir = root / "geo" / "nyc"
+    boundary_paths = [geo_dir / f"{layer}.geojson" for layer in LAYERS]
+    parquet_dir = geo_dir / "parquet"
+    boundary_parquets = [parquet_path(layer, crs, parquet_dir) for layer in LAYERS for crs in CRSES]
+    tracts_stem = Path(TRACTS_NAME).stem
+    tracts_4326 = parquet_path(tracts_stem, "EPSG:4326", parquet_dir)
+    tracts_2263 = parquet_path(tracts_stem, "EPSG:2263", parquet_dir)
+    dem_path = geo_dir / DEM_NAME
+    cog_path = geo_dir / COG_NAME
+    downsampled_path = geo_dir / "topology_nyc_downsampled.tif"
+    topology_path = geo_dir / "topology_nyc_sampled.csv"
+    raw_files = [job["path"] for job in build_fetch_jobs(NYC_GROUPS, years, NYC_GEOGRAPHY, raw_dir)]
+
+    if output_format == "parquet":
+        parsed_outputs = [preprocessed_dir / PROCESSED, preprocessed_dir / METADATA]
+    else:
+        parsed_outputs = [preprocessed_dir / "acs*_processed.csv", preprocessed_dir / "acs*_metadata.csv"]
+
+    def pull_acs():
+        results = fetch_acs(years=years, raw_dir=raw_dir, skip_existing=True)
+        if any(result["status"] == "failed" for result in results):
+            raise RuntimeError("Some ACS files could not be fetched")
+
+    def pull_geo():
+        script = Path(get_repo_root()) / "audt_data" / "d04_scripts" / "geo" / "nyc" / "pull.sh"
+        subprocess.run(["bash", str(script), str(geo_dir)], check=True)
+
+    def parse():
+        results = batch_process_acs(jobs=jobs, output_format=output_format,
+                                    raw_dir=raw_dir, preprocessed_dir=preprocessed_dir)
+        if not results or not all(result["success"] for result in results):
+            raise RuntimeError("Some ACS files failed to process")
+
+    def ingest():
+        ingest_boundaries(source_dir=geo_dir, output_dir=parquet_dir, force=True)
+
+    def cog():
+        make_cog(dem_path, cog_path, jobs=jobs)
+
+    def downsample():
+        downsample_raster(dem_path, downsample_factor=downsample_factor,
+                          REGEN_TOPOLOGY=True, OUTPUT_PATH=downsampled_path, jobs=jobs)
+
+    def topology():
+        import rasterio
+        with rasterio.open(cog_path) as src:
+            resolution = native_resolution(src) * downsample_factor
+        sample_topology(cog_path, tracts_2263, topology_path, save=True, resolution=resolution,
+                        terrain=True, jobs=jobs)
+
+    tasks = [
+        Task("pull_acs", pull_acs, outputs=raw_files, params={"years": years}, source=True),
+        Task("pull_geo", pull_geo, outputs=[*boundary_paths, dem_path], source=True),
+        Task("ingest_geo", ingest, inputs=boundary_paths, outputs=boundary_parquets,
+             code=_source_files(ingest_boundaries)),
+        Task("parse_acs", parse, inputs=raw_files, outputs=parsed_outputs,
+             params={"output_format": output_format},
+             code=_source_files(batch_process_acs)),
+        Task("cog_dem", cog, inputs=[dem_path], outputs=[cog_path], code=_source_files(make_cog)),
+        Task("downsample_dem", downsample, inputs=[dem_path], outputs=[downsampled_path],
+             params={"downsample_factor": downsample_factor},
+             code=_source_files(downsample_raster, imap_bounded)),
+        Task("sample_topology", topology, inputs=[cog_path, tracts_2263],
+             outputs=[topology_path], params={"downsample_factor": downsample_factor},
+             code=_source_files(sample_topology, zonal_stats, terrain_stats, make_cog,
+                                imap_bounded)),
+    ]
+
+    if acs_columns_path is not None:
+        with open(acs_columns_path, "r") as f:
+            acs_columns = json.load(f)
+        panel_dir = root / "acs" / "panel"
+        merge_inputs = [raw_dir / f"acs{year}_{dataset}.json" for year in years for dataset in acs_columns]
+
+        def merge():
+            # The GeoParquet tracts are in Hilbert order; sort so the panel's
+            # rows, and diffs of its files, do not depend on it
+            tracts = read_boundaries(tracts_4326).sort_values("GEOID", ignore_index=True)
+            panel = merge_acs_data(tracts, years[0], years[-1], acs_columns,
+                                   as_panel=True, data_dir=raw_dir)
+            panel.to_parquet(panel_dir)
+
+        tasks.append(Task("merge_acs", merge, inputs=[*merge_inputs, tracts_4326, acs_columns_path],
+                          outputs=[panel_dir / "geometry.parquet", panel_dir / "data.parquet"],
+                          params={"years": years}, code=_source_files(merge_acs_data)))
+    return tasks
+
+
+def nyc_pipeline(**kwargs):
+    """The NYC `Pipeline`, with its state in {root}/.pipeline (see `nyc_tasks`)."""
+    root = Path(kwargs.get("root") or data_root())
+    return Pipeline(nyc_tasks(**kwargs), state_dir=root / ".pipeline")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the NYC preprocessing pipeline")
+    parser.add_argument("targets", nargs="*", help="Tasks to bring up to date (default: all)")
+    parser.add_argument("--years", type=int, nargs=2, default=[2020, 2023], metavar=("START", "END"))
+    parser.add_argument("--acs-columns", default=None,
+                        help="JSON config of ACS datasets and columns to merge into a panel")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--downsample-factor", type=int, default=10)
+    parser.add_argument("--root", default=None, help="Data directory (default: audt_data/d01_data)")
+    parser.add_argument("--jobs", type=int, default=None, help="Tasks to run at once")
+    parser.add_argument("--force", nargs="*", default=None,
+                        help="Rerun these tasks (all if none are named) even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would run")
+    args = parser.parse_args()
+
+    pipeline = nyc_pipeline(
+        years=range(args.years[0], args.years[1] + 1),
+        acs_columns_path=args.acs_columns,
+        output_format=args.format,
+        downsample_factor=args.downsample_factor,
+        root=args.root,
+    )
+    force = True if args.force == [] else (args.force or ())
+    results = pipeline.run(targets=args.targets or None, force=force, jobs=args.jobs,
+                           dry_run=args.dry_run)
+    if any(result["status"] in ("failed", "blocked") for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,393 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Runner]
+[Module containing Task, Pipeline classes for running preprocessing stages as a task graph]
+[Matt Franchi]
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from audt_data.d03_src.utils.logger import setup_logger
+from audt_data.d03_src.pp.acs.manifest import file_fingerprint
+
+logger = setup_logger("pp.runner")
+
+STATE_NAME = "pipeline_state.json"
+STATE_VERSION = 1
+
+_GLOB_CHARS = set("*?[")
+
+
+def expand_paths(patterns):
+    """
+    Files named by a list of paths, directories (all files below them,
+    except dot files and dot directories) and glob patterns, sorted.
+    """
+    files = set()
+    for pattern in patterns:
+        pattern = str(pattern)
+        if _GLOB_CHARS & set(pattern):
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+        elif os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+                files.update(os.path.join(root, name) for name in names if not name.startswith("."))
+        elif os.path.exists(pattern):
+            files.add(pattern)
+    return sorted(files)
+
+
+def _covers(pattern, path):
+    """Whether a declared output `pattern` names `path` (a declared input)."""
+    pattern, path = str(pattern), str(path)
+    if pattern == path:
+        return True
+    if _GLOB_CHARS & set(pattern):
+        # Compare up to the first wildcard: 'raw/acs*.json' feeds 'raw/'
+        # and 'raw/acs*_md.json', and 'raw/acs2020.json'
+        stem = pattern[:min(pattern.index(c) for c in _GLOB_CHARS if c in pattern)]
+        return path.startswith(stem) or stem.startswith(path.rstrip("/") + "/")
+    return path.startswith(pattern.rstrip("/") + "/") or pattern.startswith(path.rstrip("/") + "/")
+
+
+def _source_hash(func):
+    """Hash of the source file that defines `func` (its module)."""
+    try:
+        path = inspect.getsourcefile(func)
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except (TypeError, OSError):
+        return None
+
+
+class Task:
+    """
+    One stage of a pipeline: a function plus the files it reads and writes.
+
+    Attributes:
+    name (str): Unique task name
+    func (callable): Called with no arguments to run the stage
+    inputs (list): Files, directories or glob patterns the stage reads
+    outputs (list): Files, directories or glob patterns the stage writes
+    params (dict): JSON-serializable settings; changing them reruns the task
+    after (list): Names of tasks to run first, besides those inferred from
+                  inputs and outputs
+    source (bool): The task brings data in from outside (e.g. a download):
+                   it counts as up to date whenever its outputs exist and
+                   its params are those of its last run
+    code (list): Extra source files whose changes rerun the task; the module
+                 defining `func` is always included
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, after=(),
+                 source=False, code=()):
+        self.name = name
+        self.func = func
+        self.inputs = [str(path) for path in inputs]
+        self.outputs = [str(path) for path in outputs]
+        self.params = params or {}
+        self.after = list(after)
+        self.source = source
+        self.code = [str(path) for path in code]
+
+    def __repr__(self):
+        return f"Task({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+    def code_version(self):
+        digest = hashlib.sha256(str(_source_hash(self.func)).encode())
+        for path in self.code:
+            digest.update(Path(path).read_bytes())
+        return digest.hexdigest()[:16]
+
+
+class Pipeline:
+    """
+    Runs `Task`s in dependency order, skipping those that are up to date.
+
+    A task depends on every task whose outputs cover one of its inputs, and
+    on the tasks it lists in `after`. Before a task runs, its inputs are
+    fingerprinted (size, mtime and SHA-256 per file, with hashes reused for
+    unchanged files) together with its params and code; the task is skipped
+    when that fingerprint matches the last successful run and its outputs
+    are still as that run left them. Independent tasks run concurrently on
+    a thread pool; stages that need processes (e.g. `batch_process_acs`)
+    start their own pools.
+
+    State is kept in {state_dir}/pipeline_state.json.
+    """
+
+    def __init__(self, tasks, state_dir):
+        self.tasks = {}
+        for task in tasks:
+            if task.name in self.tasks:
+                raise ValueError(f"Duplicate task name {task.name!r}")
+            self.tasks[task.name] = task
+        self.state_dir = Path(state_dir)
+        self.dependencies = self._dependencies()
+        self.order = self._toposort()
+
+    def _dependencies(self):
+        dependencies = {}
+        for task in self.tasks.values():
+            needs = set(task.after)
+            for other in self.tasks.values():
+                if other is not task and any(_covers(output, path) for output in other.outputs
+                                             for path in task.inputs):
+                    needs.add(other.name)
+            unknown = needs - set(self.tasks)
+            if unknown:
+                raise ValueError(f"Task {task.name!r} runs after unknown tasks {sorted(unknown)}")
+            dependencies[task.name] = needs
+        return dependencies
+
+    def _toposort(self):
+        order, done, visiting = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through task {name!r}")
+            visiting.add(name)
+            for dependency in sorted(self.dependencies[name]):
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.tasks:
+            visit(name)
+        return order
+
+    def downstream(self, names):
+        """`names` plus every task that depends on them, directly or not."""
+        selected = set(names)
+        for name in self.order:
+            if self.dependencies[name] & selected:
+                selected.add(name)
+        return selected
+
+    def upstream(self, names):
+        """`names` plus every task they depend on, directly or not."""
+        selected = set(names)
+        for name in reversed(self.order):
+            if name in selected:
+                selected |= self.dependencies[name]
+        return selected
+
+    def load_state(self):
+        path = self.state_dir / STATE_NAME
+        if path.exists():
+            try:
+                with open(path, "r") as f:
+                    state = json.load(f)
+                if state.get("version") == STATE_VERSION:
+                    return state
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Ignoring unreadable pipeline state {path}: {e}")
+        return {"version": STATE_VERSION, "tasks": {}}
+
+    def save_state(self, state):
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self.state_dir / STATE_NAME
+        tmp_path = path.with_name(f".{STATE_NAME}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _fingerprints(patterns, previous):
+        return {path: file_fingerprint(path, previous.get(path)) for path in expand_paths(patterns)}
+
+    @staticmethod
+    def _digest(fingerprints):
+        return hashlib.sha256(json.dumps(
+            [(path, fingerprint["sha256"]) for path, fingerprint in sorted(fingerprints.items())]
+        ).encode()).hexdigest()
+
+    def _signature(self, task, entry):
+        """Fingerprint of everything that determines a task's outputs."""
+        inputs = self._fingerprints(task.inputs, (entry or {}).get("inputs", {}))
+        missing = [path for path in task.inputs
+                   if not (_GLOB_CHARS & set(path)) and not os.path.exists(path)]
+        signature = hashlib.sha256(json.dumps({
+            "inputs": self._digest(inputs),
+            "params": task.params,
+            "code": task.code_version(),
+        }, sort_keys=True, default=str).encode()).hexdigest()
+        return signature, inputs, missing
+
+    def _outputs_intact(self, task, entry):
+        recorded = entry.get("outputs", {})
+        current = self._fingerprints(task.outputs, recorded)
+        if not current:
+            return False
+        return self._digest(current) == self._digest(recorded)
+
+    def status(self, task, entry):
+        """
+        Whether `task` needs to run.
+
+        Returns:
+        tuple: (run, reason, signature, input fingerprints)
+        """
+        if task.source:
+            if entry and entry.get("status") == "success" and entry.get("params") != task.params:
+                return True, "params changed", None, {}
+            if task.outputs and all(expand_paths([output]) for output in task.outputs):
+                return False, "outputs exist", None, {}
+            return True, "outputs missing", None, {}
+        signature, inputs, missing = self._signature(task, entry)
+        if missing:
+            return True, f"missing inputs {missing}", signature, inputs
+        if not entry or entry.get("status") != "success":
+            return True, "never ran successfully", signature, inputs
+        if entry.get("signature") != signature:
+            return True, "inputs, params or code changed", signature, inputs
+        if not self._outputs_intact(task, entry):
+            return True, "outputs missing or changed", signature, inputs
+        return False, "up to date", signature, inputs
+
+    def run(self, targets=None, force=(), jobs=None, dry_run=False):
+        """
+        Bring `targets` (and what they depend on) up to date.
+
+        Parameters:
+        targets (list): Task names to build; every task if None
+        force (list or bool): Task names to rerun even if up to date (True
+                              for all); tasks downstream of them rerun too
+                              when their inputs change
+        jobs (int): Tasks to run at once; None uses one per core
+        dry_run (bool): Only report what would run. Tasks downstream of a
+                        task that would run are reported as 'stale', since
+                        whether they rerun depends on what it writes.
+
+        Returns:
+        list: One dict per selected task, in dependency order, with 'task',
+              'status' ('ran', 'skipped', 'failed', 'blocked', or 'stale'
+              for dry runs), 'reason', 'elapsed' and 'error'
+        """
+        selected = self.upstream(targets) if targets is not None else set(self.tasks)
+        unknown = selected - set(self.tasks)
+        if unknown:
+            raise ValueError(f"Unknown tasks {sorted(unknown)}")
+        forced = selected if force is True else set(force or ())
+        order = [name for name in self.order if name in selected]
+        state = self.load_state()
+        results = {}
+
+        def decide(name):
+            task = self.tasks[name]
+            entry = state["tasks"].get(name)
+            run, reason, signature, inputs = self.status(task, entry)
+            if name in forced:
+                run, reason = True, "forced"
+            return run, reason, signature, inputs
+
+        if dry_run:
+            changed = set()
+            for name in order:
+                if self.dependencies[name] & changed:
+                    results[name] = {"task": name, "status": "stale", "reason": "upstream would run",
+                                     "elapsed": None, "error": None}
+                    changed.add(name)
+                    continue
+                run, reason, _, _ = decide(name)
+                results[name] = {"task": name, "status": "would run" if run else "skipped",
+                                 "reason": reason, "elapsed": None, "error": None}
+                if run:
+                    changed.add(name)
+            for name in order:
+                logger.info(f"{name}: {results[name]['status']} ({results[name]['reason']})")
+            return [results[name] for name in order]
+
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(order) or 1))
+        pending = list(order)
+        running = {}
+
+        def check_and_execute(name):
+            # Fingerprinting reads the inputs, so it runs on the pool too
+            run, reason, signature, inputs = decide(name)
+            if not run:
+                logger.info(f"{name}: up to date, skipped")
+                return {"task": name, "status": "skipped", "reason": reason,
+                        "elapsed": 0.0, "error": None}, None
+            logger.info(f"{name}: running ({reason})")
+            return self._execute(self.tasks[name], signature, inputs)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                # Start every task whose dependencies have all finished
+                for name in list(pending):
+                    dependencies = self.dependencies[name] & selected
+                    if any(dep not in results for dep in dependencies):
+                        continue
+                    pending.remove(name)
+                    failed = [dep for dep in dependencies if results[dep]["status"] in ("failed", "blocked")]
+                    if failed:
+                        results[name] = {"task": name, "status": "blocked",
+                                         "reason": f"upstream failed: {sorted(failed)}",
+                                         "elapsed": None, "error": None}
+                        logger.warning(f"{name}: not run, upstream {sorted(failed)} failed")
+                        continue
+                    running[pool.submit(check_and_execute, name)] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name], entry = future.result()
+                    if entry is not None:
+                        state["tasks"][name] = entry
+                        self.save_state(state)
+
+        ran = sum(result["status"] == "ran" for result in results.values())
+        failed = [name for name, result in results.items() if result["status"] in ("failed", "blocked")]
+        if failed:
+            logger.warning(f"Pipeline finished with {len(failed)} failed or blocked tasks: {failed}")
+        else:
+            logger.success(f"Pipeline up to date: {ran} ran, {len(order) - ran} skipped")
+        return [results[name] for name in order]
+
+    def _execute(self, task, signature, inputs):
+        """Run one task on a pool thread; returns (result, new state entry)."""
+        start = time.perf_counter()
+        try:
+            task.func()
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            logger.error(f"{task.name}: failed after {elapsed:.1f}s: {type(e).__name__}: {e}")
+            result = {"task": task.name, "status": "failed", "reason": "raised",
+                      "elapsed": elapsed, "error": f"{type(e).__name__}: {e}"}
+            return result, {"status": "failed", "error": result["error"]}
+
+        elapsed = time.perf_counter() - start
+        outputs = self._fingerprints(task.outputs, {})
+        missing = [output for output in task.outputs if not expand_paths([output])]
+        if missing:
+            logger.error(f"{task.name}: finished but did not write {missing}")
+            result = {"task": task.name, "status": "failed", "reason": "outputs missing",
+                      "elapsed": elapsed, "error": f"Missing outputs {missing}"}
+            return result, {"status": "failed", "error": result["error"]}
+
+        logger.success(f"{task.name}: done in {elapsed:.1f}s")
+        entry = {
+            "status": "success",
+            "signature": signature,
+            "params": task.params,
+            "inputs": inputs,
+            "outputs": outputs,
+            "elapsed": elapsed,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        return {"task": task.name, "status": "ran", "reason": "ran", "elapsed": elapsed,
+                "error": None}, entry
@@ -7,13 +7,35 @@
 """
 
 import logging
+import logging.handlers
 import os
-import inspect
+import sys
+import json
+import queue
+import multiprocessing
+from contextlib import contextmanager
 from termcolor import colored
 
 from functools import partial, partialmethod
 
 
+LOG_FORMAT = "%(asctime)s - [audt] - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Names of the loggers set up by `setup_logger`
+_configured = set()
+
+# Queue and listener while queue logging is on (see `start_queue_logging`)
+_queue = None
+_listener = None
+
+# Value of `logging._srcfile` that `start_queue_logging(caller_info=False)`
+# replaced, restored by `stop_queue_logging`; logging looks up the caller of
+# every record unless `_srcfile` is None
+_saved_srcfile = None
+_srcfile_saved = False
+
+
 class ColorfulFormatter(logging.Formatter):
     COLORS = {
         "DEBUG": {"color": "black", "attrs": []},
@@ -24,14 +46,56 @@ class ColorfulFormatter(logging.Formatter):
         "SUCCESS": {"color": "green", "attrs": []},
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Escape codes around a message, per level: colored() is only
+        # called once per level instead of once per record
+        self._wrappers = {}
+
+    def _wrapper(self, level_name):
+        wrapper = self._wrappers.get(level_name)
+        if wrapper is None:
+            style = self.COLORS.get(level_name)
+            if style is None:
+                wrapper = ("", "")
+            else:
+                prefix, _, suffix = colored("\0", style["color"], attrs=style["attrs"]).partition("\0")
+                wrapper = (prefix, suffix)
+            self._wrappers[level_name] = wrapper
+        return wrapper
+
     def format(self, record):
-        log_level = record.levelname
-        msg = super().format(record)
-        return colored(
-            msg,
-            self.COLORS.get(log_level)["color"],
-            attrs=self.COLORS.get(log_level)["attrs"],
-        )
+        prefix, suffix = self._wrapper(record.levelname)
+        return prefix + super().format(record) + suffix
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects (JSON lines), with the
+    time, level, logger name, message and process, plus the caller's
+    module, function and line when they were looked up, the formatted
+    exception if any, and anything passed with `extra={"data": {...}}`.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "created": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if record.lineno:
+            entry.update(module=record.module, function=record.funcName, line=record.lineno)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        data = getattr(record, "data", None)
+        if data is not None:
+            entry["data"] = data
+        return json.dumps(entry, default=str)
 
 
 def add_logging_level(level_name, level_num, method_name=None):
@@ -92,10 +156,12 @@ def get_module_name(name=None):
     If the name is part of the audt project, it will be shortened to the relative path.
     """
     if name == "__main__":
-        # Get the caller's filename if called from main
-        frame = inspect.stack()[2]
-        filepath = frame.filename
-        name = filepath
+        # Get the caller's filename if called from main; sys._getframe only
+        # touches the frame, while inspect.stack() reads source for every frame
+        try:
+            name = sys._getframe(2).f_code.co_filename
+        except ValueError:
+            pass
     
     if isinstance(name, str) and "audt" in name:
         # For files in the audt project, extract the part after 'audt/'
@@ -106,9 +172,63 @@ def get_module_name(name=None):
     return name
 
 
+def console_handler(stream=None):
+    """The colored console handler every AUDT logger writes to by default."""
+    ch = logging.StreamHandler(stream)
+    ch.setLevel(logging.DEBUG)
+    ch.setFormatter(ColorfulFormatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    return ch
+
+
+def json_handler(target):
+    """
+    Handler writing JSON lines (see `JsonFormatter`).
+
+    Args:
+        target: A file path to append to, or an open text stream
+    """
+    if isinstance(target, (str, os.PathLike)):
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        handler = logging.FileHandler(target, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(target)
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that prepares records in place.
+
+    The stock handler formats and copies every record so other handlers
+    still see the original; AUDT loggers have no other handlers, so the
+    copy is skipped. The message is merged with its arguments here, so
+    records stay picklable for other processes.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _handlers():
+    """Handlers for a newly set up logger: the queue if it is on, else the console."""
+    if _queue is not None:
+        return [_QueueHandler(_queue)]
+    return [console_handler()]
+
+
 def setup_logger(name=__name__, log_level=logging.INFO):
     """
     Set up a logger for the AUDT project.
+
+    Calling it again for the same name only updates the level: handlers set
+    up earlier (or swapped in by `start_queue_logging`) are left alone.
     
     Args:
         name: The logger name, defaults to the module name
@@ -125,25 +245,22 @@ def setup_logger(name=__name__, log_level=logging.INFO):
     logger = logging.getLogger(module_name)
     logger.setLevel(log_level)
 
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    try:
-        add_logging_level("SUCCESS", 25)
-    except AttributeError as e:
-        logger.debug(e)
+    if not hasattr(logging, "SUCCESS"):
+        try:
+            add_logging_level("SUCCESS", 25)
+        except AttributeError as e:
+            logger.debug(e)
 
-    # Create console handler
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
+    if module_name in _configured:
+        return logger
+    _configured.add(module_name)
 
-    # Create formatter and add it to the handlers - add AUDT prefix
-    format_str = "%(asctime)s - [audt] - %(name)s - %(levelname)s - %(message)s"
-    formatter = ColorfulFormatter(format_str, datefmt="%Y-%m-%d %H:%M:%S")
-    ch.setFormatter(formatter)
+    if logger.hasHandlers():
+        logger.handlers.clear()
 
     # Add the handlers to the logger
-    logger.addHandler(ch)
+    for handler in _handlers():
+        logger.addHandler(handler)
 
     # prevent propagation of log messages to parent logger
     logger.propagate = False
@@ -152,3 +269,116 @@ def setup_logger(name=__name__, log_level=logging.INFO):
     logging.getLogger().handlers = []
 
     return logger
+
+
+def _install(handlers):
+    for name in _configured:
+        logging.getLogger(name).handlers = list(handlers)
+
+
+def start_queue_logging(json_path=None, console=True, caller_info=True, multiprocess=True,
+                        context=None):
+    """
+    Route every AUDT logger through a queue drained by a background thread.
+
+    Logging calls then only format the message and put the record on the
+    queue; colouring, JSON encoding and writing happen on the listener
+    thread, off the caller's path. Worker processes started with
+    `init_worker_logging` (see `pool_logging_kwargs`) send their records
+    to the same queue, so pool workers log through the parent without
+    interleaving partial lines.
+
+    Args:
+        json_path: Also append JSON lines (see `JsonFormatter`) to this file
+        console: Keep the colored console output
+        caller_info: Look up the calling module, function and line for every
+            record. Turning it off skips `logging`'s stack walk, which is
+            the most expensive part of a logging call. It does so by setting
+            the private `logging._srcfile` global to None, which turns the
+            lookup off for every logger in the process, not only AUDT's,
+            until `stop_queue_logging` restores the previous value
+        multiprocess: Use a multiprocessing queue that can be handed to
+            worker processes; False uses a cheaper in-process queue
+        context: Start method ('fork', 'spawn', ...) or multiprocessing
+            context of the pools that will share the queue; the default
+            context if None
+
+    Returns:
+        The queue
+    """
+    global _queue, _listener, _saved_srcfile, _srcfile_saved
+    if _listener is not None:
+        stop_queue_logging()
+
+    handlers = []
+    if console:
+        handlers.append(console_handler())
+    if json_path is not None:
+        handlers.append(json_handler(json_path))
+
+    if not caller_info:
+        _saved_srcfile, _srcfile_saved = logging._srcfile, True
+        logging._srcfile = None
+    if multiprocess:
+        if context is None or isinstance(context, str):
+            context = multiprocessing.get_context(context)
+        _queue = context.Queue(-1)
+    else:
+        _queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _install([_QueueHandler(_queue)])
+    return _queue
+
+
+def stop_queue_logging():
+    """Flush the queue, stop the listener and give every AUDT logger its console handler back."""
+    global _queue, _listener, _saved_srcfile, _srcfile_saved
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _queue = None
+    if _srcfile_saved:
+        logging._srcfile = _saved_srcfile
+        _saved_srcfile, _srcfile_saved = None, False
+    _install([console_handler()])
+
+
+@contextmanager
+def queue_logging(json_path=None, console=True, caller_info=True, multiprocess=True, context=None):
+    """`start_queue_logging` for the duration of a block."""
+    log_queue = start_queue_logging(json_path, console, caller_info, multiprocess, context)
+    try:
+        yield log_queue
+    finally:
+        stop_queue_logging()
+
+
+def init_worker_logging(log_queue, caller_info=True):
+    """
+    Pool initializer: send this worker's AUDT log records to `log_queue`.
+
+    Loggers set up later in the worker (e.g. when a task's module is
+    imported) get a queue handler too. Without `caller_info`, the private
+    `logging._srcfile` global is set to None for the rest of the worker's
+    life, as in the parent (see `start_queue_logging`).
+    """
+    global _queue
+    _queue = log_queue
+    if not caller_info:
+        logging._srcfile = None
+    _install([_QueueHandler(log_queue)])
+
+
+def pool_logging_kwargs():
+    """
+    Keyword arguments for a ProcessPoolExecutor whose workers should log
+    through the active logging queue; empty when queue logging is off or
+    its queue cannot be shared with other processes.
+    """
+    if _listener is None or isinstance(_queue, queue.SimpleQueue):
+        return {}
+    return {"initializer": init_worker_logging, "initargs": (_queue, logging._srcfile is not None)}
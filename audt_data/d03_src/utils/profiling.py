@@ -0,0 +1,158 @@
+"""
+[augmented urban data triangulation (audt)]
+[audt-data]
+[Profiling]
+[Module containing StageRecorder classes for per-stage timing and memory instrumentation]
+[Matt Franchi]
+"""
+
+import os
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from audt_data.d03_src.utils.logger import setup_logger
+
+logger = setup_logger("utils.profiling")
+
+# Counters a stage may report and that are summed when stages are aggregated
+COUNTERS = ("rows", "columns", "bytes_in", "bytes_out")
+
+_active = ContextVar("audt_stage_recorder", default=None)
+
+
+def peak_rss():
+    """Peak resident set size of this process so far, in bytes (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class StageRecorder:
+    """
+    Records named stages of a unit of work (e.g. one ACS file).
+
+    Each stage is a dict with 'name', 'wall' and 'cpu' seconds, 'peak_rss'
+    (the process high-water mark after the stage) and 'rss_growth' (how far
+    the stage raised it), plus 'traced_peak' (bytes allocated at peak within
+    the stage) when the recorder traces memory, plus any COUNTERS the code
+    sets on it. Code marks stages with the module-level `stage` function, so
+    nothing has to pass the recorder around.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._started_tracing = False
+
+    @contextmanager
+    def activate(self):
+        """Make this the recorder `stage` records into, for the duration of the block."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, **counters):
+        span = {"name": name, **counters}
+        rss_before = peak_rss()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield span
+        finally:
+            span["wall"] = time.perf_counter() - wall_start
+            span["cpu"] = time.process_time() - cpu_start
+            span["peak_rss"] = peak_rss()
+            span["rss_growth"] = (span["peak_rss"] - rss_before) if rss_before is not None else None
+            if self.trace_memory and tracemalloc.is_tracing():
+                span["traced_peak"] = tracemalloc.get_traced_memory()[1] - traced_before
+            self.stages.append(span)
+
+    def summary(self):
+        """Totals over the recorded stages (see `aggregate_stages`)."""
+        return aggregate_stages([self.stages])
+
+
+@contextmanager
+def stage(name, **counters):
+    """
+    Mark a stage of the active `StageRecorder`; does nothing without one.
+
+    Yields a dict the block can add counters to, e.g.
+        with stage("decode_json", bytes_in=size) as span:
+            data = load(...)
+            span["rows"] = len(data)
+    """
+    recorder = _active.get()
+    if recorder is None:
+        yield {}
+        return
+    with recorder.stage(name, **counters) as span:
+        yield span
+
+
+def aggregate_stages(stage_lists):
+    """
+    Combine the stages of many units of work by stage name.
+
+    Parameters:
+    stage_lists (iterable): Lists of stage dicts, e.g. one per file
+
+    Returns:
+    dict: Stage name -> {'count', 'wall', 'cpu', 'max_wall', 'peak_rss',
+          'traced_peak' (if traced) and the summed COUNTERS}, in first-seen order
+    """
+    totals = {}
+    for stages in stage_lists:
+        for span in stages:
+            total = totals.setdefault(span["name"], {"count": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0})
+            total["count"] += 1
+            total["wall"] += span["wall"]
+            total["cpu"] += span["cpu"]
+            total["max_wall"] = max(total["max_wall"], span["wall"])
+            if span.get("peak_rss") is not None:
+                total["peak_rss"] = max(total.get("peak_rss", 0), span["peak_rss"])
+            if "traced_peak" in span:
+                total["traced_peak"] = max(total.get("traced_peak", 0), span["traced_peak"])
+            for counter in COUNTERS:
+                if span.get(counter) is not None:
+                    total[counter] = total.get(counter, 0) + span[counter]
+    return totals
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and dump the stats to `path` (no-op if None)."""
+    if path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        logger.debug(f"Saved profile to {path}")
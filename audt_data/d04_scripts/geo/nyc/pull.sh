@@ -5,9 +5,12 @@
 # [Shell script for pull]
 # [Matt Franchi]
 
+# Usage: pull.sh [SAVE_DIR]
+# SAVE_DIR defaults to {repo_root}/audt_data/d01_data/geo/nyc
+
 # Get repository root
 REPO_ROOT="$(git rev-parse --show-toplevel)"
-SAVE_DIR="${REPO_ROOT}/audt_data/d01_data/geo/nyc"
+SAVE_DIR="${1:-${REPO_ROOT}/audt_data/d01_data/geo/nyc}"
 
 # Create save directory
 mkdir -p "${SAVE_DIR}"